@@ -24,6 +24,18 @@ env = environ.Env(
     SECRET_KEY=(str, 'django-insecure-5%yfq_3aoa-0%=3#hg@q3#ytxb-#01wfg&5m)=4_n3a*cr)#se'),
     ALLOWED_HOSTS=(list, ['*']),
     TELEBOT_API_TOKEN=(str, ''),
+    TELEBOT_API_URL=(str, ''),
+    TELEBOT_WEBHOOK_SECRET=(str, ''),
+    TELEBOT_MAX_CONCURRENT_UPDATES=(int, 16),
+    DB_CONN_MAX_AGE=(int, 60),
+    CACHE_URL=(str, 'locmemcache://'),
+    INSTRUMENTATION_ENABLED=(bool, False),
+    INSTRUMENTATION_METRICS=(bool, False),
+    INSTRUMENTATION_METRICS_TOKEN=(str, ''),
+    INSTRUMENTATION_QUERY_BUDGET=(int, 20),
+    INSTRUMENTATION_DB_MS_BUDGET=(int, 100),
+    INSTRUMENTATION_TEMPLATE_MS_BUDGET=(int, 100),
+    INSTRUMENTATION_LATENCY_MS_BUDGET=(int, 500),
 
     # Email settings
     EMAIL_BACKEND=(str, 'django.core.mail.backends.smtp.EmailBackend'),
@@ -45,6 +57,10 @@ environ.Env.read_env(os.path.join(BASE_DIR, '.env'))
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = env('SECRET_KEY')
 TELEBOT_API_TOKEN = env('TELEBOT_API_TOKEN')
+# Optional Bot API URL template, e.g. for a local Bot API server
+TELEBOT_API_URL = env('TELEBOT_API_URL')
+TELEBOT_WEBHOOK_SECRET = env('TELEBOT_WEBHOOK_SECRET')
+TELEBOT_MAX_CONCURRENT_UPDATES = env('TELEBOT_MAX_CONCURRENT_UPDATES')
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = env('DEBUG')
@@ -78,6 +94,7 @@ PROJECT_APPS = [
 INSTALLED_APPS += PROJECT_APPS
 
 MIDDLEWARE = [
+    'expenses.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -123,7 +140,35 @@ else:
         'default': env.db(),
     }
 
-print(DATABASES)
+# Keep connections open between requests and bot updates
+DATABASES['default']['CONN_MAX_AGE'] = env('DB_CONN_MAX_AGE')
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Use a shared backend (rediscache://, pymemcache://, dbcache://) when running
+# several workers so cache invalidations reach all of them.
+
+CACHES = {
+    'default': env.cache('CACHE_URL'),
+}
+
+# Instrumentation
+# Logs query count, DB time, template time and latency of every request and
+# bot update, warning when they go over a budget (0 disables a budget).
+# Views override them with expenses.instrumentation.budget().
+
+INSTRUMENTATION_ENABLED = env('INSTRUMENTATION_ENABLED')
+# Serves the totals at /metrics in the Prometheus text format, to staff or to
+# scrapers sending INSTRUMENTATION_METRICS_TOKEN as a bearer token
+INSTRUMENTATION_METRICS = env('INSTRUMENTATION_METRICS')
+INSTRUMENTATION_METRICS_TOKEN = env('INSTRUMENTATION_METRICS_TOKEN')
+INSTRUMENTATION_BUDGETS = {
+    'queries': env('INSTRUMENTATION_QUERY_BUDGET'),
+    'db_ms': env('INSTRUMENTATION_DB_MS_BUDGET'),
+    'template_ms': env('INSTRUMENTATION_TEMPLATE_MS_BUDGET'),
+    'latency_ms': env('INSTRUMENTATION_LATENCY_MS_BUDGET'),
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
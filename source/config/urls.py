@@ -1,9 +1,16 @@
 from django.urls.conf import include
 from django.contrib import admin
+from django.conf import settings
 from django.urls import path
 
+from expenses.instrumentation import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("accounts/", include("django.contrib.auth.urls")),
+    path('telegram/', include('telegram.urls')),
     path('', include('expenses.urls')),
 ]
+
+if settings.INSTRUMENTATION_ENABLED and settings.INSTRUMENTATION_METRICS:
+    urlpatterns.insert(0, path('metrics', metrics_view, name='metrics'))
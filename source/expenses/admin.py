@@ -1,5 +1,30 @@
 from django.contrib import admin
-from .models import Category, Expense, ExpenseShare, ExpenseShareSummary
+from .models import (
+    BalanceSnapshot,
+    Category,
+    Expense,
+    ExpenseShare,
+    ExpenseShareSummary,
+    Household,
+    Job,
+    Membership,
+    MonthlyLedger,
+    MonthlyRollup,
+    Settlement,
+    SplitRule,
+    SplitWeight,
+)
+
+
+class MembershipInline(admin.TabularInline):
+    model = Membership
+    extra = 0
+    raw_id_fields = ['user']
+
+
+class HouseholdAdmin(admin.ModelAdmin):
+    inlines = [MembershipInline]
+    search_fields = ['name']
 
 
 class ExpenseShareInline(admin.TabularInline):
@@ -11,7 +36,29 @@ class ExpenseAdmin(admin.ModelAdmin):
     inlines = [ExpenseShareInline]
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'status', 'attempts', 'run_at', 'idempotency_key']
+    list_filter = ['status', 'name']
+
+
+class SplitWeightInline(admin.TabularInline):
+    model = SplitWeight
+    extra = 0
+
+
+class SplitRuleAdmin(admin.ModelAdmin):
+    inlines = [SplitWeightInline]
+    raw_id_fields = ['expense']
+
+
+admin.site.register(Household, HouseholdAdmin)
 admin.site.register(Category)
 admin.site.register(Expense, ExpenseAdmin)
 admin.site.register(ExpenseShare)
 admin.site.register(ExpenseShareSummary)
+admin.site.register(MonthlyLedger)
+admin.site.register(MonthlyRollup)
+admin.site.register(SplitRule, SplitRuleAdmin)
+admin.site.register(Settlement)
+admin.site.register(BalanceSnapshot)
+admin.site.register(Job, JobAdmin)
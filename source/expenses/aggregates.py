@@ -0,0 +1,40 @@
+import decimal
+
+from django.db.models import DecimalField, QuerySet, Sum, Value
+from django.db.models.functions import Coalesce
+
+ZERO = decimal.Decimal('0.00')
+CENT = decimal.Decimal('0.01')
+
+
+def decimal_sum(field: str, max_digits: int = 14, decimal_places: int = 2) -> Coalesce:
+    """
+    Sum expression over a decimal column that returns 0 instead of NULL
+    for empty sets and keeps the result typed as a Decimal.
+    """
+    output_field = DecimalField(max_digits=max_digits, decimal_places=decimal_places)
+    return Coalesce(
+        Sum(field, output_field=output_field),
+        Value(ZERO, output_field=output_field),
+        output_field=output_field,
+    )
+
+
+def sum_fields(queryset: QuerySet, **fields: str) -> dict[str, decimal.Decimal]:
+    """
+    Computes every requested sum in a single query, e.g.
+    ``sum_fields(shares, amount='amount', discount='discount')``.
+
+    Backends like SQLite hand aggregates back as floats, so the results
+    are quantized to cents before returning them.
+    """
+    result = queryset.aggregate(**{
+        alias: decimal_sum(field) for alias, field in fields.items()
+    })
+    return {
+        alias: decimal.Decimal(value).quantize(CENT) for alias, value in result.items()
+    }
+
+
+def sum_field(queryset: QuerySet, field: str) -> decimal.Decimal:
+    return sum_fields(queryset, total=field)['total']
@@ -0,0 +1,372 @@
+from typing import Callable, Optional
+import binascii
+import base64
+import json
+
+from django.utils.translation import gettext_lazy as _
+from django.views.decorators.csrf import csrf_exempt
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.decorators import method_decorator
+from django.core.exceptions import ValidationError
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.http import JsonResponse
+from django.views import View
+
+from .models import Category, Expense, ExpenseShare, ExpenseShareSummary, Membership
+from .pagination import PAGE_SIZE, Page, keyset_page, pk_page
+from .dates import month_range, parse_year_month
+from .forms import ExpenseApiForm
+
+MAX_PAGE_SIZE = 500
+MAX_BATCH_SIZE = 1000
+
+# Field name -> (model paths to load, getter)
+Fields = dict[str, tuple[tuple[str, ...], Callable]]
+
+EXPENSE_FIELDS: Fields = {
+    'id': (('id',), lambda expense: expense.pk),
+    'date': (('date',), lambda expense: expense.date),
+    'description': (('description',), lambda expense: expense.description),
+    'amount': (('amount',), lambda expense: expense.amount),
+    'category_id': (('category',), lambda expense: expense.category_id),
+    'category': (('category__name',), lambda expense: expense.category.name),
+    'paid_by_id': (('paid_by',), lambda expense: expense.paid_by_id),
+    'paid_by': (('paid_by__username',), lambda expense: expense.paid_by.username),
+}
+
+SHARE_FIELDS: Fields = {
+    'id': (('id',), lambda share: share.pk),
+    'expense_id': (('expense',), lambda share: share.expense_id),
+    'user_id': (('user',), lambda share: share.user_id),
+    'amount': (('amount',), lambda share: share.amount),
+    'discount': (('discount',), lambda share: share.discount),
+    'date': (('expense__date',), lambda share: share.expense.date),
+    'description': (('expense__description',), lambda share: share.expense.description),
+    'expense_amount': (('expense__amount',), lambda share: share.expense.amount),
+    'category': (('expense__category__name',), lambda share: share.expense.category.name),
+    'paid_by': (('expense__paid_by__username',), lambda share: share.expense.paid_by.username),
+}
+
+SUMMARY_FIELDS: Fields = {
+    'id': (('id',), lambda summary: summary.pk),
+    'user_id': (('user',), lambda summary: summary.user_id),
+    'year': (('year',), lambda summary: summary.year),
+    'month': (('month',), lambda summary: summary.month),
+    'total_amount': (('total_amount',), lambda summary: summary.total_amount),
+    'total_discount': (('total_discount',), lambda summary: summary.total_discount),
+    'to_pay': (('to_pay',), lambda summary: summary.to_pay),
+    'paid_amount': (('paid_amount',), lambda summary: summary.paid_amount),
+    'paid': (('paid',), lambda summary: summary.paid),
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status: int = 400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+
+def select_fields(queryset: QuerySet, fields: Fields, names: list[str], required: tuple[str, ...] = ()) -> QuerySet:
+    """
+    Loads only the columns, and joins only the tables, that the requested
+    fields need.
+    """
+    paths = {path for name in names for path in fields[name][0]} | set(required)
+    relations = {path.rsplit('__', 1)[0] for path in paths if '__' in path}
+
+    # select_related() without arguments would follow every relation
+    if relations:
+        queryset = queryset.select_related(*relations)
+
+    return queryset.only(*paths)
+
+
+def serialize(rows: list, fields: Fields, names: list[str]) -> list[dict]:
+    getters = [(name, fields[name][1]) for name in names]
+    return [{name: getter(row) for name, getter in getters} for row in rows]
+
+
+def build_expenses(items: list, user: User, household_id: int) -> list[Expense]:
+    """
+    Validates the expenses of a request, checking the categories and payers
+    of all of them against the household with one query each. Raises
+    ApiError with the errors of every invalid item, keyed by position, so
+    nothing is created unless everything is valid.
+    """
+    forms = [ExpenseApiForm(item if isinstance(item, dict) else {}) for item in items]
+    valid = [form.is_valid() for form in forms]
+    data = [form.cleaned_data for form in forms]
+    categories = set(Category.objects.filter(
+        pk__in={item['category'] for item in data if 'category' in item},
+        household_id=household_id
+    ).values_list('pk', flat=True))
+    payers = set(User.objects.filter(
+        pk__in={item['paid_by'] for item in data if 'paid_by' in item},
+        is_active=True,
+        membership__household_id=household_id
+    ).values_list('pk', flat=True))
+    invalid_choice = _('Select a valid choice. That choice is not one of the available choices.')
+    errors = {}
+
+    for index, form in enumerate(forms):
+        if 'category' in form.cleaned_data and form.cleaned_data['category'] not in categories:
+            form.add_error('category', ValidationError(invalid_choice, code='invalid_choice'))
+
+        if 'paid_by' in form.cleaned_data and form.cleaned_data['paid_by'] not in payers:
+            form.add_error('paid_by', ValidationError(invalid_choice, code='invalid_choice'))
+
+        if not valid[index] or form.errors:
+            errors[index] = form.errors.get_json_data()
+
+    if errors:
+        raise ApiError(_('Invalid expenses'), errors=errors)
+
+    return [
+        Expense(
+            household_id=household_id,
+            category_id=item['category'],
+            description=item['description'],
+            amount=item['amount'],
+            date=item['date'],
+            paid_by_id=item['paid_by'],
+            created_by=user,
+        )
+        for item in data
+    ]
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ApiView(View):
+    """
+    Base of the JSON endpoints for scripts. Requests log in with the
+    session, which still needs the CSRF token, or with HTTP Basic auth,
+    which other sites can't make browsers send so it doesn't. Everything is
+    scoped to the household of the user.
+    """
+    fields: Fields = {}
+    household_id: int
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            self.authenticate(request)
+            self.household_id = self.get_household_id(request)
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'error': error.message, **error.extra}, status=error.status)
+
+    def authenticate(self, request):
+        header = request.headers.get('Authorization', '')
+
+        if header.startswith('Basic '):
+            try:
+                username, password = base64.b64decode(header[6:]).decode().split(':', 1)
+            except (binascii.Error, UnicodeDecodeError, ValueError):
+                raise ApiError(_('Invalid credentials'), status=401)
+
+            user = authenticate(request, username=username, password=password)
+
+            if user is None:
+                raise ApiError(_('Invalid credentials'), status=401)
+
+            request.user = user
+            return
+
+        if not request.user.is_authenticated:
+            raise ApiError(_('Authentication required'), status=401)
+
+        # csrf_exempt skipped the middleware check, session requests still
+        # need it
+        if CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {}) is not None:
+            raise ApiError(_('CSRF verification failed'), status=403)
+
+    def get_household_id(self, request) -> int:
+        household_id = Membership.get_household_id(request.user)
+
+        if household_id is None:
+            raise ApiError(_('You are not a member of any household'), status=403)
+
+        return household_id
+
+    def get_json(self, request):
+        try:
+            return json.loads(request.body)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ApiError(_('Invalid JSON'))
+
+    def get_field_names(self, request) -> list[str]:
+        if not request.GET.get('fields'):
+            return list(self.fields)
+
+        names = request.GET['fields'].split(',')
+        unknown = [name for name in names if name not in self.fields]
+
+        if unknown:
+            raise ApiError(_('Unknown fields'), fields=unknown)
+
+        return names
+
+    def get_size(self, request) -> int:
+        try:
+            return min(max(int(request.GET.get('size', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        except ValueError:
+            raise ApiError(_('Invalid page size'))
+
+    def get_month(self, request, name: str) -> Optional[tuple[int, int]]:
+        try:
+            return parse_year_month(request.GET[name]) if request.GET.get(name) else None
+        except ValueError:
+            raise ApiError(_('Invalid month'))
+
+    def get_id(self, request, name: str) -> Optional[int]:
+        try:
+            return int(request.GET[name]) if request.GET.get(name) else None
+        except ValueError:
+            raise ApiError(_('Invalid filters'))
+
+    def get_user_id(self, request) -> int:
+        # Only staff can read other users' shares and summaries, and only
+        # within their household
+        user_id = self.get_id(request, 'user')
+        return user_id if user_id is not None and request.user.is_staff else request.user.pk
+
+    def paginated(self, page: Page, names: list[str]) -> JsonResponse:
+        return JsonResponse({
+            'results': serialize(page.rows, self.fields, names),
+            'next': page.next_cursor,
+        })
+
+
+class ExpenseApiView(ApiView):
+    """
+    GET lists expenses by date, a page at a time, with ``from``/``to``
+    months, ``category`` and ``paid_by`` filters. POST creates one expense.
+    """
+    fields = EXPENSE_FIELDS
+
+    def get(self, request):
+        names = self.get_field_names(request)
+        queryset = Expense.objects.filter(household_id=self.household_id)
+        from_month = self.get_month(request, 'from')
+        to_month = self.get_month(request, 'to')
+        category_id = self.get_id(request, 'category')
+        paid_by_id = self.get_id(request, 'paid_by')
+
+        if from_month is not None:
+            queryset = queryset.filter(date__gte=month_range(*from_month)[0])
+
+        if to_month is not None:
+            queryset = queryset.filter(date__lt=month_range(*to_month)[1])
+
+        if category_id is not None:
+            queryset = queryset.filter(category_id=category_id)
+
+        if paid_by_id is not None:
+            queryset = queryset.filter(paid_by_id=paid_by_id)
+
+        try:
+            page = keyset_page(
+                select_fields(queryset, self.fields, names, required=('date', 'id')),
+                request.GET.get('cursor'),
+                lambda expense: (expense.date, expense.pk),
+                size=self.get_size(request)
+            )
+        except ValueError:
+            raise ApiError(_('Invalid cursor'))
+
+        return self.paginated(page, names)
+
+    def post(self, request):
+        expense, = build_expenses([self.get_json(request)], request.user, self.household_id)
+        expense.save()
+        names = ['id', 'date', 'description', 'amount', 'category_id', 'paid_by_id']
+        return JsonResponse(serialize([expense], self.fields, names)[0], status=201)
+
+
+class ExpenseBatchApiView(ApiView):
+    """
+    Creates up to MAX_BATCH_SIZE expenses, given as a JSON list, in one
+    transaction with bulk inserts for the expenses, their shares and the
+    ledger and rollup. Either every expense is valid and created or none is.
+    """
+    def post(self, request):
+        items = self.get_json(request)
+
+        if isinstance(items, dict):
+            items = items.get('expenses')
+
+        if not isinstance(items, list) or not items:
+            raise ApiError(_('Expected a list of expenses'))
+
+        if len(items) > MAX_BATCH_SIZE:
+            raise ApiError(_('Too many expenses, send at most %(size)s') % {'size': MAX_BATCH_SIZE})
+
+        expenses = Expense.bulk_create_with_shares(build_expenses(items, request.user, self.household_id))
+        return JsonResponse({'created': len(expenses), 'ids': [expense.pk for expense in expenses]}, status=201)
+
+
+class ExpenseShareApiView(ApiView):
+    """
+    Shares of the current user (any user for staff, with ``user``) by
+    expense date, with ``from``/``to`` month filters.
+    """
+    fields = SHARE_FIELDS
+
+    def get(self, request):
+        names = self.get_field_names(request)
+        queryset = ExpenseShare.objects.filter(household_id=self.household_id, user_id=self.get_user_id(request))
+        from_month = self.get_month(request, 'from')
+        to_month = self.get_month(request, 'to')
+
+        if from_month is not None:
+            queryset = queryset.filter(expense__date__gte=month_range(*from_month)[0])
+
+        if to_month is not None:
+            queryset = queryset.filter(expense__date__lt=month_range(*to_month)[1])
+
+        try:
+            page = keyset_page(
+                select_fields(queryset, self.fields, names, required=('expense__date',)),
+                request.GET.get('cursor'),
+                lambda share: (share.expense.date, share.expense_id),
+                date_field='expense__date',
+                id_field='expense_id',
+                size=self.get_size(request)
+            )
+        except ValueError:
+            raise ApiError(_('Invalid cursor'))
+
+        return self.paginated(page, names)
+
+
+class ExpenseShareSummaryApiView(ApiView):
+    """
+    Monthly summaries of the current user (any user for staff, with
+    ``user``), optionally of a single ``year``.
+    """
+    fields = SUMMARY_FIELDS
+
+    def get(self, request):
+        names = self.get_field_names(request)
+        queryset = ExpenseShareSummary.objects.filter(
+            household_id=self.household_id,
+            user_id=self.get_user_id(request)
+        )
+        year = self.get_id(request, 'year')
+
+        if year is not None:
+            queryset = queryset.filter(year=year)
+
+        try:
+            page = pk_page(
+                select_fields(queryset, self.fields, names, required=('id',)),
+                request.GET.get('cursor'),
+                size=self.get_size(request)
+            )
+        except ValueError:
+            raise ApiError(_('Invalid cursor'))
+
+        return self.paginated(page, names)
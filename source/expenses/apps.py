@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ExpensesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'expenses'
+
+    def ready(self):
+        from django.conf import settings
+
+        from . import checks, signals  # noqa: F401
+
+        if settings.INSTRUMENTATION_ENABLED:
+            from .instrumentation import install
+            install()
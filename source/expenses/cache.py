@@ -0,0 +1,128 @@
+from typing import Callable, Optional
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import F
+from django.db import transaction
+
+ACTIVE_USERS_VERSION_KEY = 'expenses:active-users:version'
+
+# Process-local copy of the active users of each household, tagged with the
+# shared version it was loaded for. Workers compare versions on every read
+# and reload when another process invalidated the set.
+_active_users: tuple = (None, {})
+
+
+def get_active_users_version() -> int:
+    version = cache.get(ACTIVE_USERS_VERSION_KEY)
+
+    if version is None:
+        cache.add(ACTIVE_USERS_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(ACTIVE_USERS_VERSION_KEY)
+
+    return version
+
+
+def get_active_users(household_ids: set[int]) -> dict[int, list[User]]:
+    """
+    Active users of each household, loading every household missing from
+    the local copy with a single query.
+    """
+    global _active_users
+    version = get_active_users_version()
+    cached_version, households = _active_users
+
+    if version is None or cached_version != version:
+        households = {}
+        _active_users = (version, households)
+
+    missing = {household_id for household_id in household_ids if household_id not in households}
+
+    if missing:
+        for household_id in missing:
+            households[household_id] = []
+
+        users = User.objects.filter(
+            is_active=True,
+            membership__household_id__in=missing
+        ).annotate(
+            household_id=F('membership__household_id')
+        ).order_by('pk')
+
+        for user in users:
+            households[user.household_id].append(user)
+
+    return {household_id: households[household_id] for household_id in household_ids}
+
+
+def invalidate_active_users():
+    """
+    Makes every process reload the active users. Bumped once the current
+    transaction commits, like bump_month_generation(), so no process can
+    load the uncommitted users under the new version. Only reaches other
+    processes through a shared cache backend.
+    """
+    # A fresh timestamp instead of incr() so an evicted key can never bring
+    # back a version some worker already cached
+    transaction.on_commit(lambda: cache.set(ACTIVE_USERS_VERSION_KEY, time.time_ns(), timeout=None))
+
+
+def get_month_generation_key(household_id: int, year: Optional[int], month: Optional[int] = None) -> str:
+    if year is None:
+        return f'expenses:{int(household_id)}:all:generation'
+
+    if month is None:
+        return f'expenses:{int(household_id)}:year:{int(year)}:generation'
+
+    return f'expenses:{int(household_id)}:month:{int(year)}-{int(month)}:generation'
+
+
+def get_month_generation(household_id: int, year: Optional[int], month: Optional[int] = None) -> int:
+    """
+    Generation stamp (nanoseconds since the epoch) of the last change in a
+    household's month, in a whole year when ``month`` is None, or anywhere
+    when ``year`` is None too.
+    """
+    key = get_month_generation_key(household_id, year, month)
+    generation = cache.get(key)
+
+    if generation is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+
+    return generation
+
+
+def bump_month_generation(household_id: int, year: int, month: int):
+    """
+    Invalidates everything cached for a household's month, its year and all
+    months. Other households keep their caches. Bumped once the current
+    transaction commits so readers can't cache the uncommitted state.
+    """
+    keys = [
+        get_month_generation_key(household_id, year, month),
+        get_month_generation_key(household_id, year),
+        get_month_generation_key(household_id, None),
+    ]
+
+    def bump():
+        generation = time.time_ns()
+        cache.set_many({key: generation for key in keys}, timeout=None)
+
+    transaction.on_commit(bump)
+
+
+def get_or_set_for_month(
+    key: str,
+    household_id: int,
+    year: Optional[int],
+    month: Optional[int],
+    default: Callable,
+    timeout: int = 60 * 60 * 24,
+    generation: Optional[int] = None
+):
+    if generation is None:
+        generation = get_month_generation(household_id, year, month)
+
+    return cache.get_or_set(f'{key}:{household_id}:{year}-{month}:{generation}', default, timeout)
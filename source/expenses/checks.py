@@ -0,0 +1,19 @@
+from django.core.checks import Tags, Warning, register
+from django.conf import settings
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # The web workers, the bot and run_jobs invalidate each other's active
+    # users and month caches through the cache, a per-process one never
+    # tells the others
+    if settings.CACHES['default']['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache':
+        return [
+            Warning(
+                'The default cache is local to each process, so cache invalidations do not reach other workers.',
+                hint='Set CACHE_URL to a shared backend, e.g. rediscache://, pymemcache:// or dbcache://.',
+                id='expenses.W001',
+            )
+        ]
+
+    return []
@@ -0,0 +1,37 @@
+import datetime
+
+
+def month_range(year: int, month: int) -> tuple[datetime.date, datetime.date]:
+    """
+    Returns the half-open ``[first_of_month, first_of_next_month)`` range so
+    monthly filters compare the raw date column and can use its index.
+    """
+    start = datetime.date(int(year), int(month), 1)
+
+    if start.month == 12:
+        return start, datetime.date(start.year + 1, 1, 1)
+
+    return start, datetime.date(start.year, start.month + 1, 1)
+
+
+def year_range(year: int) -> tuple[datetime.date, datetime.date]:
+    return datetime.date(int(year), 1, 1), datetime.date(int(year) + 1, 1, 1)
+
+
+def parse_year_month(value: str) -> tuple[int, int]:
+    """
+    Parses a ``YYYY-MM`` string, raising ValueError when it isn't one.
+    """
+    year, month = (int(part) for part in value.split('-'))
+
+    if not 1 <= month <= 12:
+        raise ValueError(f'{value!r} is not a valid month')
+
+    return year, month
+
+
+def month_index(year: int, month: int) -> int:
+    """
+    Months since year 0, so month ranges can be compared as one integer.
+    """
+    return int(year) * 12 + int(month) - 1
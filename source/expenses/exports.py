@@ -0,0 +1,250 @@
+from typing import Iterable, Iterator, Optional
+from dataclasses import dataclass
+from xml.sax.saxutils import escape
+import datetime
+import decimal
+import zipfile
+import csv
+import re
+
+from django.db.models import Model, QuerySet
+
+from .models import Expense, ExpenseShare
+from .dates import month_range
+
+CHUNK_SIZE = 2000
+
+
+@dataclass(frozen=True)
+class ExportKind:
+    model: type[Model]
+    columns: tuple[tuple[str, str], ...]
+    date_field: str
+    category_field: str
+    user_field: str
+
+    @property
+    def header(self) -> list[str]:
+        return [title for title, _ in self.columns]
+
+    @property
+    def fields(self) -> list[str]:
+        return [field for _, field in self.columns]
+
+
+EXPORTS = {
+    'expenses': ExportKind(
+        model=Expense,
+        columns=(
+            ('id', 'id'),
+            ('date', 'date'),
+            ('category', 'category__name'),
+            ('description', 'description'),
+            ('amount', 'amount'),
+            ('paid_by', 'paid_by__username'),
+            ('created_by', 'created_by__username'),
+        ),
+        date_field='date',
+        category_field='category_id',
+        user_field='paid_by_id',
+    ),
+    'shares': ExportKind(
+        model=ExpenseShare,
+        columns=(
+            ('expense_id', 'expense_id'),
+            ('date', 'expense__date'),
+            ('category', 'expense__category__name'),
+            ('description', 'expense__description'),
+            ('expense_amount', 'expense__amount'),
+            ('paid_by', 'expense__paid_by__username'),
+            ('user', 'user__username'),
+            ('amount', 'amount'),
+            ('discount', 'discount'),
+        ),
+        date_field='expense__date',
+        category_field='expense__category_id',
+        user_field='user_id',
+    ),
+}
+
+
+def get_export_queryset(
+    kind: str,
+    household_id: Optional[int],
+    from_month: tuple[int, int],
+    to_month: tuple[int, int],
+    category_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> QuerySet:
+    """
+    Rows of an export as plain tuples, ordered so repeated exports of the
+    same range come out identical. Only the command line exports every
+    household at once, with ``household_id`` None.
+    """
+    export = EXPORTS[kind]
+    start, _ = month_range(*from_month)
+    _, end = month_range(*to_month)
+
+    queryset = export.model.objects.filter(**{
+        f'{export.date_field}__gte': start,
+        f'{export.date_field}__lt': end,
+    })
+
+    if household_id is not None:
+        queryset = queryset.filter(household_id=household_id)
+
+    if category_id is not None:
+        queryset = queryset.filter(**{export.category_field: category_id})
+
+    if user_id is not None:
+        queryset = queryset.filter(**{export.user_field: user_id})
+
+    return queryset.order_by(export.date_field, 'pk').values_list(*export.fields)
+
+
+def iter_rows(queryset: QuerySet, chunk_size: int = CHUNK_SIZE) -> Iterator[tuple]:
+    # iterator() skips the queryset cache and fetches chunk_size rows at a
+    # time, server-side cursors are used on PostgreSQL
+    return queryset.iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    """
+    File-like object that hands back what is written to it instead of
+    storing it, so csv.writer can feed a streaming response.
+    """
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv(header: list[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(header).encode('utf-8')
+
+    for row in rows:
+        yield writer.writerow(row).encode('utf-8')
+
+
+class ZipStream:
+    """
+    Write-only, unseekable buffer for zipfile. Each write is kept until it
+    is drained, so the archive can be sent while it is being built.
+    """
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+XLSX_FILES = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Export" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+# Control characters are not allowed in XML 1.0 documents
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def xlsx_cell(value) -> str:
+    if value is None:
+        return '<c/>'
+
+    if isinstance(value, (int, float, decimal.Decimal)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+
+    text = escape(XML_INVALID.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def xlsx_row(row: Iterable) -> str:
+    return '<row>' + ''.join(xlsx_cell(value) for value in row) + '</row>'
+
+
+def iter_xlsx(header: list[str], rows: Iterable[tuple], rows_per_chunk: int = 1000) -> Iterator[bytes]:
+    """
+    Minimal single sheet workbook written as a stream. Strings are stored
+    inline instead of in a shared strings table, so nothing but the current
+    chunk of rows is held in memory. Spreadsheet apps stop reading after
+    1,048,576 rows.
+    """
+    stream = ZipStream()
+
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_FILES.items():
+            archive.writestr(name, content)
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>' + xlsx_row(header)
+            ).encode('utf-8'))
+            chunk = []
+
+            for row in rows:
+                chunk.append(xlsx_row(row))
+
+                if len(chunk) >= rows_per_chunk:
+                    sheet.write(''.join(chunk).encode('utf-8'))
+                    chunk.clear()
+
+                    if data := stream.drain():
+                        yield data
+
+            sheet.write((''.join(chunk) + '</sheetData></worksheet>').encode('utf-8'))
+
+    yield stream.drain()
+
+
+WRITERS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (iter_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+
+def iter_export(kind: str, file_format: str, queryset: QuerySet, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    writer, _ = WRITERS[file_format]
+    return writer(EXPORTS[kind].header, iter_rows(queryset, chunk_size))
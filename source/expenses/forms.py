@@ -28,8 +28,13 @@ class ExpenseForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user')
+        self.household_id = kwargs.pop('household_id')
         super().__init__(*args, **kwargs)
-        self.fields['paid_by'].queryset = self.fields['paid_by'].queryset.filter(is_active=True)
+        self.fields['category'].queryset = self.fields['category'].queryset.filter(household_id=self.household_id)
+        self.fields['paid_by'].queryset = self.fields['paid_by'].queryset.filter(
+            is_active=True,
+            membership__household_id=self.household_id
+        )
         self.initial['paid_by'] = self.user
         self.initial['date'] = forms.DateInput().format_value(timezone.now())
 
@@ -42,10 +47,31 @@ class ExpenseForm(forms.ModelForm):
         return amount
 
     def save(self, commit=True):
+        self.instance.household_id = self.household_id
         self.instance.created_by = self.user
         return super().save(commit=commit)
 
 
+class ExpenseApiForm(forms.Form):
+    """
+    One expense of an API request. Related objects are given by id and
+    checked against the household for the whole batch at once by the view.
+    """
+    category = forms.IntegerField(min_value=1)
+    description = forms.CharField(required=False)
+    amount = forms.DecimalField(max_digits=8, decimal_places=2)
+    date = forms.DateField()
+    paid_by = forms.IntegerField(min_value=1)
+
+    def clean_amount(self):
+        amount = self.cleaned_data['amount']
+
+        if amount <= 0:
+            raise forms.ValidationError(_('Amount should be greater than 0'))
+
+        return amount
+
+
 class ExpenseFilterForm(forms.Form):
     month = forms.ChoiceField(
         choices=MONTHS.items(),
@@ -0,0 +1,114 @@
+from typing import Iterable, Iterator, Optional
+from dataclasses import dataclass
+import datetime
+import decimal
+import csv
+import re
+
+
+@dataclass
+class ImportRow:
+    line: int
+    date: datetime.date
+    amount: decimal.Decimal
+    description: str
+    category: Optional[str] = None
+    paid_by: Optional[str] = None
+
+
+class ImportRowError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def parse_amount(value: str, line: int) -> decimal.Decimal:
+    cleaned = value.strip()
+    # Accept both 1,234.56 and 1234,56
+    cleaned = cleaned.replace(',', '') if '.' in cleaned else cleaned.replace(',', '.')
+
+    try:
+        amount = decimal.Decimal(cleaned)
+    except decimal.InvalidOperation:
+        raise ImportRowError(line, f'invalid amount {value!r}')
+
+    if not amount.is_finite():
+        raise ImportRowError(line, f'invalid amount {value!r}')
+
+    return amount
+
+
+def read_csv(lines: Iterable[str], delimiter: str = ',') -> Iterator[tuple[int, dict]]:
+    """
+    Streams rows from a CSV with a ``date,amount,category,paid_by,description``
+    header. ``category`` and ``paid_by`` may be left empty to use defaults.
+    """
+    reader = csv.DictReader(lines, delimiter=delimiter)
+
+    for row in reader:
+        yield reader.line_num, row
+
+
+def parse_csv_row(line: int, row: dict) -> ImportRow:
+    try:
+        date = datetime.date.fromisoformat((row.get('date') or '').strip())
+    except ValueError:
+        raise ImportRowError(line, f'invalid date {row.get("date")!r}')
+
+    return ImportRow(
+        line=line,
+        date=date,
+        amount=parse_amount(row.get('amount') or '', line),
+        description=(row.get('description') or '').strip(),
+        category=(row.get('category') or '').strip() or None,
+        paid_by=(row.get('paid_by') or '').strip() or None,
+    )
+
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+
+def read_ofx(lines: Iterable[str]) -> Iterator[tuple[int, dict]]:
+    """
+    Streams the ``STMTTRN`` blocks of an OFX statement. Works for both the
+    SGML (v1, unclosed tags) and XML (v2) flavours.
+    """
+    transaction = None
+    start = 0
+
+    for line_number, line in enumerate(lines, start=1):
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+
+            if tag == 'STMTTRN':
+                if not closing:
+                    transaction, start = {}, line_number
+                elif transaction is not None:
+                    yield start, transaction
+                    transaction = None
+            elif transaction is not None and not closing and value.strip():
+                transaction[tag] = value.strip()
+
+
+def parse_ofx_row(line: int, transaction: dict) -> Optional[ImportRow]:
+    try:
+        date = datetime.datetime.strptime(transaction.get('DTPOSTED', '')[:8], '%Y%m%d').date()
+    except ValueError:
+        raise ImportRowError(line, f'invalid DTPOSTED {transaction.get("DTPOSTED")!r}')
+
+    amount = parse_amount(transaction.get('TRNAMT', ''), line)
+
+    # Only debits are expenses, credits are skipped
+    if amount >= 0:
+        return None
+
+    description = ' - '.join(
+        value for value in (transaction.get('NAME'), transaction.get('MEMO')) if value
+    )
+    return ImportRow(line=line, date=date, amount=-amount, description=description)
+
+
+FORMATS = {
+    'csv': (read_csv, parse_csv_row),
+    'ofx': (read_ofx, parse_ofx_row),
+}
@@ -0,0 +1,278 @@
+from typing import Awaitable, Callable, Optional
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import collections
+import functools
+import threading
+import logging
+import json
+import time
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.template import base
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Route of the requests no URL pattern matched, 404s and scanners among
+# them. Their raw paths would add a label, and totals, per path.
+UNRESOLVED_ROUTE = '<unresolved>'
+
+
+@dataclass
+class Metrics:
+    route: str
+    queries: int = 0
+    db_time: float = 0.0
+    template_time: float = 0.0
+    latency: float = 0.0
+    budget: dict = field(default_factory=dict)
+    template_depth: int = 0
+
+    def over_budget(self) -> list[str]:
+        budget = {**settings.INSTRUMENTATION_BUDGETS, **self.budget}
+        measured = {
+            'queries': self.queries,
+            'db_ms': self.db_time * 1000,
+            'template_ms': self.template_time * 1000,
+            'latency_ms': self.latency * 1000,
+        }
+        return [
+            name for name, limit in budget.items()
+            if limit and measured.get(name, 0) > limit
+        ]
+
+
+_current: ContextVar[Optional[Metrics]] = ContextVar('instrumentation_metrics', default=None)
+
+
+class Registry:
+    """
+    Per process totals exposed in the Prometheus text format. Each worker
+    keeps its own, so scrape every worker or aggregate them upstream.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals: dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.buckets: dict[str, list[int]] = collections.defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+
+    def observe(self, metrics: Metrics, over_budget: list[str]):
+        with self.lock:
+            totals = self.totals[metrics.route]
+            totals['requests'] += 1
+            totals['queries'] += metrics.queries
+            totals['db_seconds'] += metrics.db_time
+            totals['template_seconds'] += metrics.template_time
+            totals['latency_seconds'] += metrics.latency
+            totals['over_budget'] += bool(over_budget)
+
+            buckets = self.buckets[metrics.route]
+
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if metrics.latency <= bound:
+                    buckets[index] += 1
+
+    def render(self) -> str:
+        lines = []
+        counters = (
+            ('requests', 'Handled requests and bot updates'),
+            ('queries', 'Database queries'),
+            ('db_seconds', 'Time spent in database queries'),
+            ('template_seconds', 'Time spent rendering templates'),
+            ('over_budget', 'Requests over any of their budgets'),
+        )
+
+        with self.lock:
+            for name, help_text in counters:
+                lines.append(f'# HELP home_expenses_{name}_total {help_text}')
+                lines.append(f'# TYPE home_expenses_{name}_total counter')
+
+                for route, totals in sorted(self.totals.items()):
+                    lines.append(f'home_expenses_{name}_total{{route="{route}"}} {totals[name]}')
+
+            lines.append('# HELP home_expenses_latency_seconds Request latency')
+            lines.append('# TYPE home_expenses_latency_seconds histogram')
+
+            for route, totals in sorted(self.totals.items()):
+                for bound, count in zip(LATENCY_BUCKETS, self.buckets[route]):
+                    lines.append(f'home_expenses_latency_seconds_bucket{{route="{route}",le="{bound}"}} {count}')
+
+                lines.append(f'home_expenses_latency_seconds_bucket{{route="{route}",le="+Inf"}} {totals["requests"]}')
+                lines.append(f'home_expenses_latency_seconds_sum{{route="{route}"}} {totals["latency_seconds"]}')
+                lines.append(f'home_expenses_latency_seconds_count{{route="{route}"}} {totals["requests"]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - start
+
+
+def add_query_wrapper(sender, connection, **kwargs):
+    # Fires again whenever a persistent connection is reopened
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def timed_render(render: Callable) -> Callable:
+    @functools.wraps(render)
+    def wrapper(self, context):
+        metrics = _current.get()
+
+        if metrics is None:
+            return render(self, context)
+
+        # Included templates are part of the outermost render
+        metrics.template_depth += 1
+        start = time.perf_counter()
+
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_depth -= 1
+
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - start
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def install():
+    """
+    Hooks query and template timing in. Only called when instrumentation
+    is enabled, so nothing is wrapped otherwise.
+    """
+    connection_created.connect(add_query_wrapper, dispatch_uid='instrumentation')
+
+    if not getattr(base.Template.render, 'instrumented', False):
+        base.Template.render = timed_render(base.Template.render)
+
+
+def report(metrics: Metrics):
+    over_budget = metrics.over_budget()
+    registry.observe(metrics, over_budget)
+
+    payload = json.dumps({
+        'route': metrics.route,
+        'queries': metrics.queries,
+        'db_ms': round(metrics.db_time * 1000, 2),
+        'template_ms': round(metrics.template_time * 1000, 2),
+        'latency_ms': round(metrics.latency * 1000, 2),
+        'over_budget': over_budget,
+    })
+
+    if over_budget:
+        logger.warning(payload)
+    else:
+        logger.info(payload)
+
+
+def budget(**limits: int) -> Callable:
+    """
+    Overrides the default budgets (``queries``, ``db_ms``, ``template_ms``,
+    ``latency_ms``) of a view function or class.
+    """
+    def decorator(view):
+        view.instrumentation_budget = limits
+        return view
+
+    return decorator
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = Metrics(route=UNRESOLVED_ROUTE)
+        token = _current.set(metrics)
+        start = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.latency = time.perf_counter() - start
+            _current.reset(token)
+
+        if request.resolver_match is not None:
+            metrics.route = request.resolver_match.view_name or request.resolver_match.route
+
+        report(metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        view_class = getattr(view_func, 'view_class', None)
+        limits = getattr(view_func, 'instrumentation_budget', None) or getattr(view_class, 'instrumentation_budget', None)
+
+        if metrics is not None and limits:
+            metrics.budget = limits
+
+
+def instrumented(handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Same measurements as the middleware for an async bot handler. The
+    handler is returned untouched when instrumentation is disabled.
+    """
+    if not settings.INSTRUMENTATION_ENABLED:
+        return handler
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        metrics = Metrics(
+            route=f'telegram:{handler.__name__}',
+            budget=getattr(handler, 'instrumentation_budget', None) or {}
+        )
+        # The context is copied into the threads running the ORM code, so
+        # their queries are counted here as well
+        token = _current.set(metrics)
+        start = time.perf_counter()
+
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            metrics.latency = time.perf_counter() - start
+            _current.reset(token)
+            report(metrics)
+
+    return wrapper
+
+
+def metrics_view(request):
+    """
+    Prometheus scrapes with the INSTRUMENTATION_METRICS_TOKEN bearer token,
+    staff can look at it from a browser session.
+    """
+    token = settings.INSTRUMENTATION_METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    user = getattr(request, 'user', None)
+
+    if not (
+        (token and constant_time_compare(authorization, f'Bearer {token}'))
+        or (user is not None and user.is_active and user.is_staff)
+    ):
+        return HttpResponseForbidden()
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
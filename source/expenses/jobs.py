@@ -0,0 +1,140 @@
+from typing import Callable, Optional
+import traceback
+import datetime
+import logging
+import random
+import uuid
+
+from django.db import close_old_connections, models
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS: dict[str, Callable] = {}
+
+BACKOFF_BASE = 30
+BACKOFF_MAX = 3600
+
+
+def task(name: str) -> Callable:
+    """
+    Registers a function as a job that can be enqueued by ``name``. Tasks
+    live in the ``tasks`` module of each app and get the payload as
+    keyword arguments.
+    """
+    def decorator(func: Callable) -> Callable:
+        TASKS[name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(
+    name: str,
+    key: Optional[str] = None,
+    max_attempts: int = 5,
+    run_at: Optional[datetime.datetime] = None,
+    **payload
+) -> Job:
+    """
+    Adds a job to the queue. When ``key`` is given and a job with that key
+    already exists, that job is returned instead of adding another one.
+    """
+    defaults = {
+        'name': name,
+        'payload': payload,
+        'max_attempts': max_attempts,
+        'run_at': run_at or timezone.now(),
+    }
+
+    if key is None:
+        return Job.objects.create(**defaults)
+
+    job, _ = Job.objects.get_or_create(idempotency_key=key, defaults=defaults)
+    return job
+
+
+def enqueue_many(jobs: list[Job]) -> int:
+    """
+    Adds many jobs with a single insert, skipping the idempotency keys that
+    were already enqueued. Returns how many jobs were added.
+    """
+    keys = [job.idempotency_key for job in jobs if job.idempotency_key]
+    existing = set(Job.objects.filter(idempotency_key__in=keys).values_list('idempotency_key', flat=True))
+    jobs = [job for job in jobs if job.idempotency_key not in existing]
+    Job.objects.bulk_create(jobs, batch_size=1000, ignore_conflicts=True)
+    return len(jobs)
+
+
+def claim(limit: int, lease: int) -> list[Job]:
+    """
+    Takes up to ``limit`` due jobs for this worker. Claiming is one
+    conditional UPDATE, so concurrent workers never get the same job even
+    on databases without SELECT ... FOR UPDATE. Running jobs whose lease
+    expired (their worker died) are taken again.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = models.Q(status=Job.PENDING, run_at__lte=now) | models.Q(
+        status=Job.RUNNING,
+        locked_at__lt=now - datetime.timedelta(seconds=lease)
+    )
+    ids = list(Job.objects.filter(due).order_by('run_at', 'pk').values_list('pk', flat=True)[:limit])
+
+    if not ids:
+        return []
+
+    Job.objects.filter(due, pk__in=ids).update(status=Job.RUNNING, locked_by=token, locked_at=now)
+    return list(Job.objects.filter(locked_by=token, status=Job.RUNNING).order_by('run_at', 'pk'))
+
+
+def get_backoff(attempts: int) -> float:
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    # Jitter keeps retries of a failed batch from hitting the server at once
+    return delay + random.uniform(0, delay / 2)
+
+
+def run(job: Job) -> bool:
+    """
+    Runs a claimed job and records the outcome. Failed jobs are retried
+    with an exponential backoff until they run out of attempts.
+    """
+    close_old_connections()
+
+    try:
+        func = TASKS[job.name]
+        func(**job.payload)
+    except Exception as error:
+        job.attempts += 1
+        job.last_error = ''.join(traceback.format_exception_only(type(error), error)).strip()
+        job.locked_by = job.locked_at = None
+
+        if job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            logger.error('Job %s #%s failed for good after %s attempts: %s', job.name, job.pk, job.attempts, job.last_error)
+        else:
+            job.status = Job.PENDING
+            job.run_at = timezone.now() + datetime.timedelta(seconds=get_backoff(job.attempts))
+            logger.warning(
+                'Job %s #%s failed (attempt %s), retrying at %s: %s',
+                job.name,
+                job.pk,
+                job.attempts,
+                job.run_at,
+                job.last_error
+            )
+
+        job.save(update_fields=['attempts', 'last_error', 'locked_by', 'locked_at', 'status', 'finished_at', 'run_at'])
+        return False
+    else:
+        job.attempts += 1
+        job.status = Job.DONE
+        job.finished_at = timezone.now()
+        job.locked_by = job.locked_at = None
+        job.save(update_fields=['attempts', 'status', 'finished_at', 'locked_by', 'locked_at'])
+        return True
+    finally:
+        close_old_connections()
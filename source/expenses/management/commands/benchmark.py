@@ -0,0 +1,376 @@
+from typing import Callable, Optional
+from itertools import chain, islice
+import statistics
+import platform
+import tempfile
+import random
+import datetime
+import decimal
+import time
+import json
+import os
+
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management import call_command
+from django.db import connection, reset_queries, transaction
+from django.core.cache import cache
+from django.test import Client
+from django.urls import reverse
+import django
+
+from expenses.models import Expense, ExpenseShare, ExpenseShareSummary, MonthlyLedger
+from expenses.seeding import get_seed_categories, get_seed_households, iter_seed_expenses
+from expenses.cache import invalidate_active_users
+from expenses.search import search_expenses
+from expenses.settlements import settle
+
+BENCHMARK_MONTH = (2022, 6)
+SETTLEMENT_GROUP_SIZES = (8, 12, 100, 500)
+API_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a throwaway test database at several scales and times the expense '
+        'operations, views and the /gastos handler, printing the results as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales',
+            default='20,100,500',
+            help='Comma separated everyday expenses per month to seed, one run each'
+        )
+        parser.add_argument('--users', type=int, default=3)
+        parser.add_argument('--categories', type=int, default=8)
+        parser.add_argument('--years', type=int, default=1)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per operation')
+        parser.add_argument(
+            '--households',
+            type=int,
+            default=0,
+            help='Also time the monthly processing of this many small households, e.g. 10000'
+        )
+        parser.add_argument('--household-per-month', type=int, default=10, help='Everyday expenses of each of those households')
+        parser.add_argument('--workers', type=int, default=4, help='Processes of the parallel monthly processing run')
+        parser.add_argument('--household-repeat', type=int, default=1, help='Timed runs of the monthly processing')
+        parser.add_argument(
+            '--month-sizes',
+            default='',
+            help='Comma separated expenses of a single month to time the monthly totals at, e.g. 100,1000,10000,100000'
+        )
+        parser.add_argument('--output', help='Write the JSON here instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+            month_sizes = sorted(int(size) for size in options['month_sizes'].split(',') if size)
+        except ValueError:
+            raise CommandError('--scales and --month-sizes must be comma separated lists of integers')
+
+        self.repeat = options['repeat']
+        results = [
+            {'scale': size, 'expenses': None, 'operation': f'settle:{size}_members', **measurement}
+            for size, measurement in self.run_settlements(options['seed'])
+        ]
+
+        if options['households'] and connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+            # Worker processes can't open an in-memory database. Forked
+            # workers inherit the test database name, spawned ones wouldn't.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), 'expenses-benchmark.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        try:
+            for scale in scales:
+                call_command('flush', interactive=False, verbosity=0)
+                cache.clear()
+                call_command(
+                    'seed_expenses',
+                    users=options['users'],
+                    categories=options['categories'],
+                    start=(BENCHMARK_MONTH[0], 1),
+                    years=options['years'],
+                    per_month=scale,
+                    seed=options['seed'],
+                    stdout=self.stderr,
+                )
+
+                expenses = Expense.objects.count()
+
+                for operation, measurement in self.run_scale(options['users']):
+                    results.append({'scale': scale, 'expenses': expenses, 'operation': operation, **measurement})
+
+            if month_sizes:
+                results.extend(self.run_month_sizes(month_sizes, options['users'], options['categories'], options['seed']))
+
+            if options['households']:
+                results.extend(self.run_households(
+                    options['households'],
+                    options['users'],
+                    options['categories'],
+                    options['household_per_month'],
+                    options['workers'],
+                    options['household_repeat'],
+                    options['seed']
+                ))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = json.dumps({
+            'meta': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'users': options['users'],
+                'categories': options['categories'],
+                'years': options['years'],
+                'seed': options['seed'],
+                'repeat': self.repeat,
+                'month_sizes': month_sizes,
+                'households': options['households'],
+                'workers': options['workers'],
+            },
+            'results': results,
+        }, indent=2)
+
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
+
+    def measure(
+        self,
+        func: Callable,
+        setup: Callable = None,
+        count_queries: bool = True,
+        repeat: Optional[int] = None
+    ) -> dict:
+        timings = []
+
+        for _ in range(repeat or self.repeat):
+            if setup is not None:
+                setup()
+
+            # The query log is capped, once full it can't tell new queries apart
+            reset_queries()
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - start) * 1000)
+
+        return {
+            # Queries made from other threads can't be captured
+            'queries': len(queries) if count_queries else None,
+            'min_ms': round(min(timings), 3),
+            'median_ms': round(statistics.median(timings), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+        }
+
+    def rolled_back(self, func: Callable) -> Callable:
+        def wrapper():
+            with transaction.atomic():
+                func()
+                transaction.set_rollback(True)
+
+        return wrapper
+
+    def run_settlements(self, seed: int):
+        rng = random.Random(seed)
+
+        for size in SETTLEMENT_GROUP_SIZES:
+            balances = {user_id: decimal.Decimal(rng.randint(-50000, 50000)) / 100 for user_id in range(1, size)}
+            balances[size] = -sum(balances.values())
+            yield size, self.measure(lambda: settle(balances), count_queries=False)
+
+    def run_scale(self, user_count: int):
+        from telegram.models import TelegramUser
+        from telegram import telebot
+        from asgiref.sync import async_to_sync
+
+        year, month = BENCHMARK_MONTH
+        household, (user, *_others) = get_seed_households(1, user_count)[0]
+        template = Expense.objects.filter(paid_by=user).first()
+
+        def new_expense() -> Expense:
+            return Expense(
+                household=household,
+                paid_by=user,
+                created_by=user,
+                category_id=template.category_id,
+                amount=decimal.Decimal('123.45'),
+                date=datetime.date(year, month, 15),
+            )
+
+        def create_from_expense():
+            expense = Expense.objects.bulk_create([new_expense()])[0]
+            ExpenseShare.create_from_expense(expense)
+
+        yield 'create_from_expense', self.measure(self.rolled_back(create_from_expense))
+        # The cold run reloads the active users on every save, as it was
+        # done before they were cached
+        for name, setup in (('expense_save', None), ('expense_save:cold_users', invalidate_active_users)):
+            measurement = self.measure(self.rolled_back(lambda: new_expense().save()), setup=setup)
+            measurement['saves_per_s'] = round(1000 / measurement['median_ms'], 1)
+            yield name, measurement
+
+        yield 'calc_monthly_expense', self.measure(lambda: ExpenseShare.calc_monthly_expense(household.pk, year, month))
+
+        summary = ExpenseShareSummary.objects.filter(year=year, month=month, user=user).select_related('user').first()
+        yield 'get_email_body', self.measure(summary.get_email_body)
+        yield 'search:common', self.measure(lambda: search_expenses(household.pk, 'supermarket'))
+        yield 'search:prefix', self.measure(lambda: search_expenses(household.pk, 'pizz din'))
+        yield 'search:rare_filtered', self.measure(
+            lambda: search_expenses(household.pk, 'dentist', from_month=(year, 1), to_month=(year, 12), payer_id=user.pk)
+        )
+
+        client = Client()
+        client.force_login(user)
+        month_query = {'month': month, 'year': year}
+        # Name, URL, query string and whether the view caches its response
+        views = (
+            ('home', reverse('home'), {}, True),
+            ('expense_list', reverse('expense-list'), month_query, True),
+            ('expense_user_list', reverse('expense-user-list'), month_query, True),
+            ('dashboard_api', reverse('dashboard-api'), {'from': year, 'to': year}, False),
+            ('search', reverse('search'), {'q': 'supermarket'}, False),
+            ('export_expenses_csv', reverse('export', args=['expenses', 'csv']), {'from': f'{year}-01', 'to': f'{year}-12'}, False),
+        )
+
+        for name, url, query, cached in views:
+            def get():
+                response = client.get(url, query)
+
+                # Streaming responses only hit the database while consumed
+                if response.streaming:
+                    b''.join(response.streaming_content)
+
+            yield f'view:{name}', self.measure(get, setup=cache.clear)
+
+            if cached:
+                yield f'view:{name}:cached', self.measure(get)
+
+        item = {'category': template.category_id, 'amount': '12.34', 'date': f'{year}-{month:02d}-15', 'paid_by': user.pk}
+        batch = json.dumps([item] * API_BATCH_SIZE)
+
+        yield 'api:create', self.measure(self.rolled_back(
+            lambda: client.post(reverse('api-expenses'), json.dumps(item), content_type='application/json')
+        ))
+        yield f'api:batch_create_{API_BATCH_SIZE}', self.measure(self.rolled_back(
+            lambda: client.post(reverse('api-expenses-batch'), batch, content_type='application/json')
+        ))
+
+        TelegramUser.objects.get_or_create(user=user, defaults={'telegram_id': user.pk, 'household': household})
+        telegram_id = TelegramUser.objects.get(user=user).telegram_id
+        gastos = async_to_sync(telebot.user_expenses_reply)
+
+        yield 'telegram:gastos', self.measure(
+            lambda: gastos(telegram_id, f'/gastos {month} {year}'),
+            setup=cache.clear,
+            count_queries=False
+        )
+
+    def run_month_sizes(self, sizes: list[int], user_count: int, category_count: int, seed: int):
+        """
+        Grows a single month to each of ``sizes`` expenses and times its
+        totals: the ledger read the views, emails and bot use, the SUM
+        aggregates and, as the baseline, the Python loop they replaced.
+        """
+        year, month = BENCHMARK_MONTH
+        call_command('flush', interactive=False, verbosity=0)
+        cache.clear()
+
+        household, users = get_seed_households(1, user_count)[0]
+        categories = get_seed_categories([household], category_count)[household.pk]
+        user = users[0]
+        total = 0
+
+        def python_loop() -> decimal.Decimal:
+            amount = decimal.Decimal(0)
+
+            for expense in Expense.objects.filter(household=household).in_month(year, month):
+                amount += expense.amount
+
+            return amount
+
+        operations = (
+            ('ledger_monthly_total', lambda: MonthlyLedger.get_monthly_total(household.pk, year, month)),
+            ('expense_monthly_total', lambda: Expense.get_monthly_total(household.pk, year, month)),
+            ('monthly_discounted_total', lambda: ExpenseShare.get_monthly_discounted_total(household.pk, year, month, user)),
+            ('python_loop_monthly_total', python_loop),
+        )
+
+        for size in sizes:
+            # Each size adds to the expenses of the previous one
+            expenses = iter_seed_expenses(household, users, categories, (year, month), 1, max(size - total, 0), seed + size)
+
+            with transaction.atomic():
+                while chunk := list(islice(expenses, 5000)):
+                    Expense.bulk_create_with_shares(chunk)
+
+            total = Expense.objects.count()
+
+            for name, func in operations:
+                yield {'scale': size, 'expenses': total, 'operation': f'month_size:{name}', **self.measure(func)}
+
+    def run_households(
+        self,
+        count: int,
+        user_count: int,
+        category_count: int,
+        per_month: int,
+        workers: int,
+        repeat: int,
+        seed: int
+    ):
+        """
+        Seeds ``count`` households with one month of expenses each and times
+        calc_month_total over all of them, in this process and spread over
+        ``workers`` processes.
+        """
+        year, month = BENCHMARK_MONTH
+        call_command('flush', interactive=False, verbosity=0)
+        cache.clear()
+
+        start = time.perf_counter()
+        households = get_seed_households(count, user_count)
+        categories = get_seed_categories([household for household, _users in households], category_count)
+        expenses = chain.from_iterable(
+            iter_seed_expenses(household, users, categories[household.pk], (year, month), 1, per_month, seed + number)
+            for number, (household, users) in enumerate(households)
+        )
+
+        with transaction.atomic():
+            while chunk := list(islice(expenses, 5000)):
+                Expense.bulk_create_with_shares(chunk)
+
+        self.stderr.write('Seeded %s households in %.2fs' % (count, time.perf_counter() - start))
+        total = Expense.objects.count()
+
+        # calc_month_total runs in a single process on SQLite
+        worker_counts = {1} if connection.vendor == 'sqlite' else {1, workers}
+
+        for processes in sorted(worker_counts):
+            measurement = self.measure(
+                lambda: call_command(
+                    'calc_month_total',
+                    from_month=(year, month),
+                    no_notify=True,
+                    workers=processes
+                ),
+                count_queries=False,
+                repeat=repeat
+            )
+            measurement['households_per_s'] = round(count / (measurement['median_ms'] / 1000), 1)
+            yield {
+                'scale': count,
+                'expenses': total,
+                'operation': f'calc_month_total:{count}_households:{processes}_workers',
+                **measurement,
+            }
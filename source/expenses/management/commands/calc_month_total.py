@@ -1,32 +1,252 @@
-import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import argparse
+import time
 
-from django.core.management.base import BaseCommand
-from django.utils.translation import gettext as _
+from django.core.management.base import BaseCommand, CommandError
 from django.db.models import QuerySet
+from django.db import connection, connections, transaction
 from django.utils import timezone
+import django
 
-from dateutil.relativedelta import relativedelta
+from expenses.models import ExpenseShare, ExpenseShareSummary, MonthlyLedger
+from expenses.notifications import enqueue_summaries, send_summaries
+from expenses.dates import parse_year_month
 
-from expenses.models import ExpenseShare, ExpenseShareSummary
 
-logger = logging.getLogger(__name__)
+def year_month(value: str) -> tuple[int, int]:
+    try:
+        return parse_year_month(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'{value!r} is not a YYYY-MM month')
+
+
+def iter_months(start: tuple[int, int], end: tuple[int, int]):
+    year, month = start
+
+    while (year, month) <= end:
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def init_worker():
+    # Spawned workers start from scratch, forked ones already have the apps
+    # loaded. Either way they open their own database connection on demand.
+    django.setup()
+
+
+def calc_households(year: int, month: int, household_ids: list[int]) -> tuple[int, int, int, int, float]:
+    """
+    Recomputes a month of a batch of households in a single transaction,
+    so the commit is paid once per batch instead of once per household.
+    """
+    start = time.perf_counter()
+
+    with transaction.atomic():
+        count = sum(
+            len(ExpenseShare.calc_monthly_expense(household_id, year, month))
+            for household_id in household_ids
+        )
+
+    return year, month, len(household_ids), count, time.perf_counter() - start
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--from',
+            dest='from_month',
+            type=year_month,
+            help='First month (YYYY-MM) to recompute, defaults to the current month'
+        )
+        parser.add_argument(
+            '--to',
+            dest='to_month',
+            type=year_month,
+            help='Last month (YYYY-MM) to recompute, defaults to --from'
+        )
+        parser.add_argument(
+            '--household',
+            dest='households',
+            type=int,
+            action='append',
+            help='Only recompute this household (id), can be repeated. Defaults to every household with expenses'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Processes the households and months are spread across'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Households recomputed per transaction'
+        )
+        notify = parser.add_mutually_exclusive_group()
+        notify.add_argument(
+            '--notify',
+            action='store_true',
+            help='Email the users the summaries of every recomputed month, not only the current one'
+        )
+        notify.add_argument(
+            '--no-notify',
+            action='store_true',
+            help='Recompute the summaries without emailing the users'
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Send the summaries from this command instead of queueing them for run_jobs'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            help='Number of parallel SMTP connections used to send the summaries with --sync, defaults to 1'
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=2,
+            help='Retries per recipient before reporting it as failed'
+        )
+
     def handle(self, *args, **options):
-        previous = timezone.now()
-        previous_month = previous.month
-        previous_year = previous.year
+        now = timezone.now()
+        from_month = options['from_month'] or (now.year, now.month)
+        to_month = options['to_month'] or from_month
 
-        logger.info('Calculating totals for %s/%s', previous_month, previous_year)
+        if to_month < from_month:
+            raise CommandError('--to must not be before --from')
 
-        ExpenseShare.calc_monthly_expense(previous_year, previous_month)
+        if options['concurrency'] is not None and not options['sync']:
+            raise CommandError('--concurrency only applies with --sync, run_jobs takes its own --concurrency')
 
+        months = list(iter_months(from_month, to_month))
+        start = time.perf_counter()
+        units = self.get_units(months, options['households'], max(1, options['batch_size']))
+
+        total_households = total_summaries = 0
+        verbosity = options['verbosity']
+
+        if verbosity >= 2:
+            self.stdout.write('Calculating totals for %s month(s) from %s/%s to %s/%s, %s household month(s)' % (
+                len(months),
+                from_month[1],
+                from_month[0],
+                to_month[1],
+                to_month[0],
+                sum(len(household_ids) for _year, _month, household_ids in units)
+            ))
+
+        for year, month, households, count, elapsed in self.calc_months(units, options['workers']):
+            total_households += households
+            total_summaries += count
+
+            if verbosity >= 2:
+                self.stdout.write('Totals of %s household(s) for %s/%s calculated in %.2fs (%s summaries)' % (
+                    households,
+                    month,
+                    year,
+                    elapsed,
+                    count
+                ))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write('Calculated %s household months and %s summaries in %.2fs (%.1f household months/s)' % (
+            total_households,
+            total_summaries,
+            elapsed,
+            total_households / elapsed if elapsed else 0
+        ))
+
+        if options['no_notify']:
+            return
+
+        # A backfill must not email the users about every past month again
+        notify_months = months if options['notify'] else [month for month in months if month == (now.year, now.month)]
+
+        for year, month in notify_months:
+            self.notify(
+                year,
+                month,
+                options['households'],
+                options['sync'],
+                options['concurrency'] or 1,
+                options['retries']
+            )
+
+    def get_units(
+        self,
+        months: list[tuple[int, int]],
+        household_ids: Optional[list[int]],
+        batch_size: int
+    ) -> list[tuple[int, int, list[int]]]:
+        """
+        (year, month, household_ids) batches to recompute. Without --household,
+        the households with ledger rows or summaries in each month, the rest
+        have nothing to do.
+        """
+        units = []
+
+        for year, month in months:
+            if household_ids:
+                households = sorted(set(household_ids))
+            else:
+                with_ledgers = MonthlyLedger.objects.filter(year=year, month=month).values_list('household_id', flat=True)
+                with_summaries = ExpenseShareSummary.objects.filter(year=year, month=month).values_list('household_id', flat=True)
+                households = sorted(set(with_ledgers.distinct()) | set(with_summaries.distinct()))
+
+            units.extend(
+                (year, month, households[index:index + batch_size])
+                for index in range(0, len(households), batch_size)
+            )
+
+        return units
+
+    def calc_months(self, units: list[tuple[int, int, list[int]]], workers: int):
+        if workers > 1 and connection.vendor == 'sqlite':
+            # SQLite has a single writer, the workers would only starve each
+            # other waiting for its lock
+            self.stderr.write('SQLite allows a single writer, ignoring --workers')
+            workers = 1
+
+        if workers <= 1 or len(units) <= 1:
+            for year, month, household_ids in units:
+                yield calc_households(year, month, household_ids)
+            return
+
+        # Children must never reuse the parent's open connections
+        connections.close_all()
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            yield from executor.map(calc_households, *zip(*units))
+
+    def notify(
+        self,
+        year: int,
+        month: int,
+        household_ids: Optional[list[int]],
+        sync: bool,
+        concurrency: int,
+        retries: int
+    ):
         summaries: QuerySet[ExpenseShareSummary] = ExpenseShareSummary.objects.filter(
-            month=previous_month,
-            year=previous_year
-        )
+            month=month,
+            year=year
+        ).select_related('user')
+
+        if household_ids:
+            summaries = summaries.filter(household_id__in=household_ids)
+
+        if not sync:
+            queued = enqueue_summaries(summaries, retries=retries)
+            self.stdout.write('Queued %s summaries for %s/%s' % (queued, month, year))
+            return
 
-        [summary.notify_user() for summary in summaries if summary.user.email]
+        report = send_summaries(summaries, concurrency=concurrency, retries=retries)
+        self.stdout.write('Sent %s summaries for %s/%s, %s failed' % (len(report.sent), month, year, len(report.failed)))
 
-        logger.info('Done')
+        for recipient, error in report.failed.items():
+            self.stderr.write(f'Failed to notify {recipient} for {month}/{year}: {error}')
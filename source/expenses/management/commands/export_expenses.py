@@ -0,0 +1,84 @@
+import logging
+import time
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from expenses.exports import CHUNK_SIZE, EXPORTS, WRITERS, get_export_queryset, iter_export
+from expenses.models import Category
+from .calc_month_total import year_month
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Streams expenses or shares of a month range to a CSV or XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=EXPORTS.keys())
+        parser.add_argument('--output', default='-', help='File to write, "-" writes CSV to stdout')
+        parser.add_argument('--format', choices=WRITERS.keys(), help='Defaults to the output extension or csv')
+        parser.add_argument('--from', dest='from_month', type=year_month, help='First month (YYYY-MM), defaults to the current month')
+        parser.add_argument('--to', dest='to_month', type=year_month, help='Last month (YYYY-MM), defaults to --from')
+        parser.add_argument('--household', type=int, help='Only export this household (id), defaults to all of them')
+        parser.add_argument('--category', help='Only export this category')
+        parser.add_argument('--user', help='Only export expenses paid by, or shares of, this username')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        output = options['output']
+        file_format = options['format'] or (output.rsplit('.', 1)[-1].lower() if '.' in output else 'csv')
+
+        if file_format not in WRITERS:
+            raise CommandError(f'Unknown format {file_format!r}, use --format')
+
+        if output == '-' and file_format != 'csv':
+            raise CommandError('Only CSV can be written to stdout, use --output')
+
+        now = timezone.now()
+        from_month = options['from_month'] or (now.year, now.month)
+        to_month = options['to_month'] or from_month
+
+        if to_month < from_month:
+            raise CommandError('--to must not be before --from')
+
+        household_id = options['household']
+        category_id = user_id = None
+
+        if options['category']:
+            categories = Category.objects.all()
+
+            if household_id is not None:
+                categories = categories.filter(household_id=household_id)
+
+            try:
+                category_id = categories.get(name__iexact=options['category']).pk
+            except Category.DoesNotExist:
+                raise CommandError(f'Unknown category {options["category"]!r}')
+            except Category.MultipleObjectsReturned:
+                raise CommandError(f'Category {options["category"]!r} exists in several households, use --household')
+
+        if options['user']:
+            try:
+                user_id = User.objects.get(username=options['user']).pk
+            except User.DoesNotExist:
+                raise CommandError(f'Unknown user {options["user"]!r}')
+
+        queryset = get_export_queryset(options['kind'], household_id, from_month, to_month, category_id, user_id)
+        chunks = iter_export(options['kind'], file_format, queryset, options['chunk_size'])
+        start = time.perf_counter()
+        size = 0
+
+        file = sys.stdout.buffer if output == '-' else open(output, 'wb')
+
+        try:
+            for chunk in chunks:
+                file.write(chunk)
+                size += len(chunk)
+        finally:
+            if file is not sys.stdout.buffer:
+                file.close()
+
+        logger.info('Exported %s bytes of %s in %.2fs', size, options['kind'], time.perf_counter() - start)
@@ -0,0 +1,165 @@
+from typing import Optional
+from itertools import islice
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from expenses.importers import FORMATS, ImportRow, ImportRowError
+from expenses.models import Category, Expense, ExpenseRow, Household
+from expenses.aggregates import CENT
+
+logger = logging.getLogger(__name__)
+
+MAX_AMOUNT = 10 ** 6
+
+
+class Command(BaseCommand):
+    help = 'Imports expenses from a CSV or OFX file in batched transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=FORMATS.keys(), help='Defaults to the file extension')
+        parser.add_argument('--household', type=int, help='Household (id) to import into, required when there are several')
+        parser.add_argument('--delimiter', default=',', help='CSV delimiter')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--paid-by', help='Username used when a row has no payer (required for OFX)')
+        parser.add_argument('--category', help='Category used when a row has no category (required for OFX)')
+        parser.add_argument('--created-by', help='Username recorded as creator, defaults to the payer')
+        parser.add_argument('--create-categories', action='store_true', help='Create unknown categories')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and roll everything back')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+
+        if file_format not in FORMATS:
+            raise CommandError(f'Unknown format {file_format!r}, use --format')
+
+        self.household = self.get_household(options['household'])
+        self.users = {
+            user.username: user
+            for user in User.objects.filter(membership__household=self.household)
+        }
+        self.categories = {
+            category.name.lower(): category
+            for category in Category.objects.filter(household=self.household)
+        }
+        self.create_categories = options['create_categories']
+        self.default_paid_by = options['paid_by'] and self.get_user(options['paid_by'])
+        # Looked up per row like the others, so a category it creates is
+        # rolled back with the chunk on --dry-run
+        self.default_category = options['category']
+
+        if self.default_category and not self.create_categories:
+            self.get_category(self.default_category)
+        self.created_by = options['created_by'] and self.get_user(options['created_by'])
+
+        reader, parser = FORMATS[file_format]
+        start = time.perf_counter()
+        imported = skipped = 0
+
+        with open(options['path'], newline='', encoding='utf-8-sig') as file:
+            reader_kwargs = {'delimiter': options['delimiter']} if file_format == 'csv' else {}
+            records = reader(file, **reader_kwargs)
+
+            while chunk := list(islice(records, options['chunk_size'])):
+                known_categories = dict(self.categories)
+
+                # Each chunk commits on its own, a failure only loses the
+                # chunk it happened in
+                with transaction.atomic():
+                    expenses = []
+
+                    for line, record in chunk:
+                        try:
+                            row = parser(line, record)
+
+                            if row is not None:
+                                expenses.append(self.build_expense(row))
+                        except ImportRowError as error:
+                            skipped += 1
+                            self.stderr.write(f'Skipped {error}')
+
+                    Expense.bulk_create_with_shares(expenses)
+
+                    if options['dry_run']:
+                        transaction.set_rollback(True)
+
+                if options['dry_run']:
+                    # The categories the chunk created were rolled back too
+                    self.categories = known_categories
+
+                imported += len(expenses)
+                logger.info('Imported %s expenses (%.0f rows/s)', imported, imported / (time.perf_counter() - start))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write('%s %s expenses, skipped %s rows in %.2fs (%.0f rows/s)' % (
+            'Validated' if options['dry_run'] else 'Imported',
+            imported,
+            skipped,
+            elapsed,
+            imported / elapsed if elapsed else 0,
+        ))
+
+    def get_household(self, household_id: Optional[int]) -> Household:
+        if household_id is not None:
+            try:
+                return Household.objects.get(pk=household_id)
+            except Household.DoesNotExist:
+                raise CommandError(f'Household {household_id} does not exist')
+
+        households = list(Household.objects.all()[:2])
+
+        if len(households) != 1:
+            raise CommandError('Use --household to choose the household to import into')
+
+        return households[0]
+
+    def get_user(self, username: str, line: int = 0) -> User:
+        try:
+            return self.users[username]
+        except KeyError:
+            if not line:
+                raise CommandError(f'User {username!r} is not a member of the household')
+
+            raise ImportRowError(line, f'user {username!r} is not a member of the household')
+
+    def get_category(self, name: str, line: int = 0) -> Category:
+        category = self.categories.get(name.lower())
+
+        if category is None:
+            if not self.create_categories:
+                if not line:
+                    raise CommandError(f'Category {name!r} does not exist, use --create-categories')
+
+                raise ImportRowError(line, f'category {name!r} does not exist')
+
+            category = self.categories[name.lower()] = Category.objects.create(household=self.household, name=name)
+
+        return category
+
+    def build_expense(self, row: ImportRow) -> ExpenseRow:
+        paid_by = self.get_user(row.paid_by, row.line) if row.paid_by else self.default_paid_by
+        category_name = row.category or self.default_category
+        category = self.get_category(category_name, row.line) if category_name else None
+
+        if not paid_by:
+            raise ImportRowError(row.line, 'no payer, use --paid-by')
+
+        if not category:
+            raise ImportRowError(row.line, 'no category, use --category')
+
+        if row.amount <= 0 or row.amount >= MAX_AMOUNT:
+            raise ImportRowError(row.line, f'amount {row.amount} out of range')
+
+        return ExpenseRow(
+            household_id=self.household.pk,
+            paid_by_id=paid_by.pk,
+            category_id=category.pk,
+            amount=row.amount.quantize(CENT),
+            description=row.description,
+            created_by_id=(self.created_by or paid_by).pk,
+            date=row.date,
+        )
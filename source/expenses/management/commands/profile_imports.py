@@ -0,0 +1,90 @@
+import argparse
+import subprocess
+import time
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+
+def profile(argv: list[str]) -> tuple[float, list[tuple[str, int, int]]]:
+    """
+    Runs ``manage.py argv`` in a fresh interpreter with ``-X importtime``.
+    Returns the wall time in ms and (module, self us, cumulative us) of each
+    import, in the order Python reports them.
+    """
+    command = [sys.executable, '-X', 'importtime', str(settings.BASE_DIR / 'manage.py'), *argv]
+    start = time.perf_counter()
+    result = subprocess.run(command, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if result.returncode:
+        errors = '\n'.join(line for line in result.stderr.splitlines() if not line.startswith('import time:'))
+        raise CommandError(f'{" ".join(argv)} failed:\n{errors[-2000:]}')
+
+    modules = []
+
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        own, cumulative, name = line[len('import time:'):].split('|')
+
+        # Header line
+        if not own.strip().isdigit():
+            continue
+
+        modules.append((name.strip(), int(own), int(cumulative)))
+
+    return elapsed, modules
+
+
+class Command(BaseCommand):
+    help = 'Profiles the imports of a cold start of another management command with python -X importtime'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'argv',
+            nargs=argparse.REMAINDER,
+            metavar='command',
+            help='manage.py command line to profile, e.g. calc_month_total --help. Defaults to check'
+        )
+        parser.add_argument('--top', type=int, default=20, help='Slowest modules to list')
+        parser.add_argument('--repeat', type=int, default=3, help='Cold starts to run, the fastest one is reported')
+        parser.add_argument(
+            '--self',
+            dest='by_self',
+            action='store_true',
+            help='Rank modules by their own import time instead of including what they import'
+        )
+        parser.add_argument(
+            '--max-ms',
+            type=float,
+            help='Fail when the fastest cold start takes longer than this, e.g. in CI'
+        )
+
+    def handle(self, *args, **options):
+        argv = options['argv'] or ['check']
+        # The first run warms the bytecode and file system caches
+        runs = [profile(argv) for _ in range(max(1, options['repeat']))]
+        elapsed, modules = min(runs, key=lambda run: run[0])
+
+        self.stdout.write('%s: %.0fms cold start, %.0fms importing %s modules' % (
+            ' '.join(argv),
+            elapsed,
+            sum(own for _name, own, _cumulative in modules) / 1000,
+            len(modules)
+        ))
+
+        column = 1 if options['by_self'] else 2
+        self.stdout.write('%10s %10s  %s' % ('self ms', 'total ms', 'module'))
+
+        for name, own, cumulative in sorted(modules, key=lambda module: module[column], reverse=True)[:options['top']]:
+            self.stdout.write('%10.1f %10.1f  %s' % (own / 1000, cumulative / 1000, name))
+
+        if options['max_ms'] is not None and elapsed > options['max_ms']:
+            raise CommandError('Cold start of %s took %.0fms, over the %.0fms budget' % (
+                ' '.join(argv),
+                elapsed,
+                options['max_ms']
+            ))
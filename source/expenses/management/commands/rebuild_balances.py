@@ -0,0 +1,65 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+
+from expenses.models import BalanceSnapshot, ExpenseShareSummary, Household, Membership
+from .calc_month_total import year_month
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the carried-over balance snapshots from a month onward'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='from_month', type=year_month, help='First month (YYYY-MM), defaults to the first summary')
+        parser.add_argument('--household', type=int, help='Only rebuild this household (id), defaults to all of them')
+        parser.add_argument('--user', help='Only rebuild the balances of this username')
+
+    def handle(self, *args, **options):
+        household_ids = [options['household']] if options['household'] is not None else None
+        user_ids = None
+
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'Unknown user {options["user"]!r}')
+
+            user_ids = [user.pk]
+            household_ids = [Membership.get_household_id(user)]
+
+            if household_ids[0] is None:
+                raise CommandError(f'User {options["user"]!r} is not a member of any household')
+
+        if household_ids is None:
+            household_ids = list(Household.objects.order_by('pk').values_list('pk', flat=True))
+
+        start = time.perf_counter()
+        rebuilt = 0
+
+        for household_id in household_ids:
+            from_month = options['from_month']
+
+            if from_month is None:
+                from_month = ExpenseShareSummary.objects.filter(
+                    household_id=household_id
+                ).order_by('year', 'month').values_list('year', 'month').first()
+
+                if from_month is None:
+                    continue
+
+            BalanceSnapshot.rebuild(household_id, *from_month, user_ids=user_ids)
+            rebuilt += 1
+            logger.debug('Rebuilt balances of household %s from %s/%s', household_id, from_month[1], from_month[0])
+
+        if not rebuilt:
+            self.stdout.write('No summaries to rebuild from')
+            return
+
+        self.stdout.write('Rebuilt balances of %s household(s) in %.2fs' % (
+            rebuilt,
+            time.perf_counter() - start,
+        ))
@@ -0,0 +1,98 @@
+import decimal
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from expenses.models import MonthlyLedger, MonthlyRollup
+from expenses.aggregates import CENT
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Checks the monthly ledger and rollup against the raw expenses and optionally repairs them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--household', type=int, help='Only check this household (id)')
+        parser.add_argument('--year', type=int, help='Only check this year')
+        parser.add_argument('--month', type=int, help='Only check this month (requires --year)')
+        parser.add_argument('--repair', action='store_true', help='Rewrite the drifted rows')
+
+    def handle(self, *args, **options):
+        household_id = options['household']
+        year = options['year']
+        month = options['month']
+
+        if month is not None and year is None:
+            raise CommandError('--month requires --year')
+
+        ledgers = MonthlyLedger.objects.all()
+        rollups = MonthlyRollup.objects.all()
+
+        if household_id is not None:
+            ledgers = ledgers.filter(household_id=household_id)
+            rollups = rollups.filter(household_id=household_id)
+
+        if year is not None:
+            ledgers = ledgers.filter(year=year)
+            rollups = rollups.filter(year=year)
+
+        if month is not None:
+            ledgers = ledgers.filter(month=month)
+            rollups = rollups.filter(month=month)
+
+        self.reconcile(
+            MonthlyLedger,
+            MonthlyLedger.compute_expected(household_id, year, month),
+            {(row.household_id, row.user_id, row.year, row.month): row for row in ledgers},
+            ('household_id', 'user_id', 'year', 'month'),
+            options['repair']
+        )
+        self.reconcile(
+            MonthlyRollup,
+            MonthlyRollup.compute_expected(household_id, year, month),
+            {(row.household_id, row.year, row.month, row.category_id, row.paid_by_id): row for row in rollups},
+            ('household_id', 'year', 'month', 'category_id', 'paid_by_id'),
+            options['repair']
+        )
+
+    def reconcile(
+        self,
+        model: type[models.Model],
+        expected: dict,
+        current: dict[tuple, models.Model],
+        key_fields: tuple[str, ...],
+        repair: bool
+    ):
+        drifted = []
+        keys = expected.keys() | current.keys()
+
+        for key in keys:
+            row = current.get(key)
+            # Rows whose expenses are all gone must be back to zero
+            values = expected.get(key, dict.fromkeys(model.DELTA_FIELDS, 0))
+            values = {
+                field: value.quantize(CENT) if isinstance(value, decimal.Decimal) else value
+                for field, value in values.items()
+            }
+
+            if row is None or any(getattr(row, field) != value for field, value in values.items()):
+                drifted.append((key, values))
+                self.stdout.write('%s drift for %s: %s -> %s' % (
+                    model.__name__,
+                    dict(zip(key_fields, key)),
+                    row and {field: getattr(row, field) for field in values},
+                    values,
+                ))
+
+        logger.info('Checked %s %s rows, %s drifted', len(keys), model.__name__, len(drifted))
+
+        if not drifted or not repair:
+            return
+
+        with transaction.atomic():
+            for key, values in drifted:
+                model.objects.update_or_create(**dict(zip(key_fields, key)), defaults=values)
+
+        self.stdout.write('Repaired %s %s rows' % (len(drifted), model.__name__))
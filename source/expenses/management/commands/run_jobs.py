@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import signal
+import time
+
+from django.utils.module_loading import autodiscover_modules
+from django.core.management.base import BaseCommand
+
+from expenses.jobs import claim, run
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Runs queued jobs (summary emails, Telegram messages) with retries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Jobs run at the same time')
+        parser.add_argument('--batch', type=int, default=20, help='Jobs claimed per round')
+        parser.add_argument('--poll', type=float, default=1.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--lease', type=int, default=300, help='Seconds before a running job of a dead worker is retried')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is due instead of polling')
+
+    def handle(self, *args, **options):
+        # Registers the tasks of every app
+        autodiscover_modules('tasks')
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processed = failed = 0
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            while not self.stopping:
+                jobs = claim(options['batch'], options['lease'])
+
+                if not jobs:
+                    if options['once']:
+                        break
+
+                    time.sleep(options['poll'])
+                    continue
+
+                for succeeded in executor.map(run, jobs):
+                    processed += 1
+                    failed += not succeeded
+
+                logger.info('Ran %s jobs, %s failed (%.1f jobs/s)', processed, failed, processed / (time.perf_counter() - start))
+
+        self.stdout.write('Ran %s jobs, %s failed' % (processed, failed))
+
+    def stop(self, signum, frame):
+        # Finish the jobs already claimed, then exit
+        self.stopping = True
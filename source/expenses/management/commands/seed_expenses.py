@@ -0,0 +1,64 @@
+from itertools import chain, islice
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from expenses.seeding import get_seed_categories, get_seed_households, iter_seed_expenses
+from expenses.models import Expense
+from .calc_month_total import year_month
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Generates deterministic households with years of expenses and their shares'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--households', type=int, default=1, help='Households to seed ("Seed household N")')
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=3,
+            help='Members of each household (seed-user-NNN in the first one, password "seed")'
+        )
+        parser.add_argument('--categories', type=int, default=8)
+        parser.add_argument('--start', type=year_month, default=(2022, 1), help='First month (YYYY-MM)')
+        parser.add_argument('--years', type=int, default=2)
+        parser.add_argument('--per-month', type=int, default=60, help='Everyday expenses per month, besides the monthly bills')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        households = get_seed_households(options['households'], options['users'])
+        categories = get_seed_categories([household for household, _users in households], options['categories'])
+        # Each household gets its own stream, the first one the same as
+        # when there was only one
+        expenses = chain.from_iterable(
+            iter_seed_expenses(
+                household,
+                users,
+                categories[household.pk],
+                options['start'],
+                options['years'] * 12,
+                options['per_month'],
+                options['seed'] + number
+            )
+            for number, (household, users) in enumerate(households)
+        )
+        created = 0
+
+        with transaction.atomic():
+            while chunk := list(islice(expenses, options['chunk_size'])):
+                Expense.bulk_create_with_shares(chunk)
+                created += len(chunk)
+                logger.info('Created %s expenses', created)
+
+        self.stdout.write('Created %s expenses for %s household(s) of %s users in %.2fs' % (
+            created,
+            len(households),
+            options['users'],
+            time.perf_counter() - start,
+        ))
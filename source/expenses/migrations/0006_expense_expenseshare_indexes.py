@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0005_alter_expense_paid_by'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date', 'paid_by'], name='expenses_ex_date_2b98af_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(fields=['user', 'expense'], name='expenses_ex_user_id_25b16d_idx'),
+        ),
+    ]
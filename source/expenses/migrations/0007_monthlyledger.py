@@ -0,0 +1,68 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:24
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_ledger(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    MonthlyLedger = apps.get_model('expenses', 'MonthlyLedger')
+    ledgers = {}
+
+    def ledger_for(user_id, date):
+        key = (user_id, date.year, date.month)
+
+        if key not in ledgers:
+            ledgers[key] = MonthlyLedger(user_id=user_id, year=date.year, month=date.month)
+
+        return ledgers[key]
+
+    for expense in Expense.objects.prefetch_related('expenseshare_set').iterator(chunk_size=2000):
+        ledger_for(expense.paid_by_id, expense.date).total_paid += expense.amount
+
+        for share in expense.expenseshare_set.all():
+            if share.user_id == expense.paid_by_id:
+                portion = expense.amount - share.discount
+            else:
+                portion = share.amount
+
+            ledger = ledger_for(share.user_id, expense.date)
+            ledger.total_amount += portion
+            ledger.total_discount += share.discount
+            ledger.to_pay += portion - share.discount
+
+    MonthlyLedger.objects.bulk_create(ledgers.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0006_expense_expenseshare_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('total_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_discount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('to_pay', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledgers', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['year', 'month'], name='expenses_mo_year_759e57_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyledger',
+            constraint=models.UniqueConstraint(fields=('user', 'year', 'month'), name='unique_user_monthly_ledger'),
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:33
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_rollup(apps, schema_editor):
+    Expense = apps.get_model('expenses', 'Expense')
+    MonthlyRollup = apps.get_model('expenses', 'MonthlyRollup')
+    rollups = {}
+
+    for expense in Expense.objects.iterator(chunk_size=2000):
+        key = (expense.date.year, expense.date.month, expense.category_id, expense.paid_by_id)
+
+        if key not in rollups:
+            rollups[key] = MonthlyRollup(
+                year=key[0],
+                month=key[1],
+                category_id=key[2],
+                paid_by_id=key[3]
+            )
+
+        rollups[key].total += expense.amount
+        rollups[key].count += 1
+
+    MonthlyRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0007_monthlyledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='expenses.category')),
+                ('paid_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('year', 'month', 'category', 'paid_by'), name='unique_monthly_rollup'),
+        ),
+        migrations.RunPython(backfill_rollup, migrations.RunPython.noop),
+    ]
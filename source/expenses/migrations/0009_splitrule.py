@@ -0,0 +1,48 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:44
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0008_monthlyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SplitRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='split_rule', to='expenses.category', verbose_name='Categoría')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SplitWeight',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.DecimalField(decimal_places=2, default=Decimal('1'), max_digits=6, verbose_name='Weight')),
+                ('fixed_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Fixed amount')),
+                ('excluded', models.BooleanField(default=False, verbose_name='Excluded')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weights', to='expenses.splitrule')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='split_weights', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='splitrule',
+            name='expense',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='split_rule', to='expenses.expense', verbose_name='Expense'),
+        ),
+        migrations.AddConstraint(
+            model_name='splitweight',
+            constraint=models.UniqueConstraint(fields=('rule', 'user'), name='unique_split_weight'),
+        ),
+        migrations.AddConstraint(
+            model_name='splitrule',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('category__isnull', False), ('expense__isnull', True)), models.Q(('category__isnull', True), ('expense__isnull', False)), _connector='OR'), name='split_rule_category_or_expense'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:48
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_balances(apps, schema_editor):
+    ExpenseShareSummary = apps.get_model('expenses', 'ExpenseShareSummary')
+    BalanceSnapshot = apps.get_model('expenses', 'BalanceSnapshot')
+
+    # Months marked as paid were paid in full
+    ExpenseShareSummary.objects.filter(paid=True).update(paid_amount=models.F('to_pay'))
+
+    balances = {}
+    snapshots = []
+
+    for summary in ExpenseShareSummary.objects.order_by('year', 'month', 'user').iterator(chunk_size=2000):
+        carried = balances.get(summary.user_id, Decimal('0.00'))
+        balance = carried + summary.to_pay - summary.paid_amount
+        balances[summary.user_id] = balance
+        snapshots.append(BalanceSnapshot(
+            user_id=summary.user_id,
+            year=summary.year,
+            month=summary.month,
+            period=summary.year * 12 + summary.month - 1,
+            carried=carried,
+            due=summary.to_pay,
+            paid=summary.paid_amount,
+            balance=balance,
+        ))
+
+    BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0010_settlement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expensesharesummary',
+            name='paid_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('period', models.IntegerField()),
+                ('carried', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('due', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(fields=('user', 'period'), name='unique_user_balance_snapshot'),
+        ),
+        migrations.RunPython(backfill_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0012_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date', 'id'], name='expenses_ex_date_9369f8_idx'),
+        ),
+    ]
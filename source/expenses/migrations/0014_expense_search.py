@@ -0,0 +1,157 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:05
+
+from django.db import migrations
+
+# The search index is kept in sync by triggers, so bulk inserts, queryset
+# updates and category renames are indexed the same as Expense.save()
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE expenses_expense_search USING fts5(
+        description,
+        category,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER expenses_expense_search_insert AFTER INSERT ON expenses_expense
+    BEGIN
+        INSERT INTO expenses_expense_search (rowid, description, category)
+        SELECT new.id, new.description, name FROM expenses_category WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER expenses_expense_search_update AFTER UPDATE OF description, category_id ON expenses_expense
+    WHEN old.description IS NOT new.description OR old.category_id IS NOT new.category_id
+    BEGIN
+        UPDATE expenses_expense_search
+        SET description = new.description,
+            category = (SELECT name FROM expenses_category WHERE id = new.category_id)
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER expenses_expense_search_delete AFTER DELETE ON expenses_expense
+    BEGIN
+        DELETE FROM expenses_expense_search WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER expenses_category_search_update AFTER UPDATE OF name ON expenses_category
+    WHEN old.name IS NOT new.name
+    BEGIN
+        UPDATE expenses_expense_search SET category = new.name
+        WHERE rowid IN (SELECT id FROM expenses_expense WHERE category_id = new.id);
+    END
+    """,
+    """
+    INSERT INTO expenses_expense_search (rowid, description, category)
+    SELECT expense.id, expense.description, category.name
+    FROM expenses_expense expense
+    JOIN expenses_category category ON category.id = expense.category_id
+    """,
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS expenses_category_search_update',
+    'DROP TRIGGER IF EXISTS expenses_expense_search_delete',
+    'DROP TRIGGER IF EXISTS expenses_expense_search_update',
+    'DROP TRIGGER IF EXISTS expenses_expense_search_insert',
+    'DROP TABLE IF EXISTS expenses_expense_search',
+]
+
+POSTGRESQL_FORWARD = [
+    'ALTER TABLE expenses_expense ADD COLUMN search_vector tsvector',
+    """
+    CREATE FUNCTION expenses_search_vector(description text, category text) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce(category, '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+    $$ LANGUAGE sql IMMUTABLE
+    """,
+    """
+    CREATE FUNCTION expenses_expense_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := expenses_search_vector(
+            NEW.description,
+            (SELECT name FROM expenses_category WHERE id = NEW.category_id)
+        );
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER expenses_expense_search_insert BEFORE INSERT ON expenses_expense
+    FOR EACH ROW EXECUTE FUNCTION expenses_expense_search_trigger()
+    """,
+    """
+    CREATE TRIGGER expenses_expense_search_update BEFORE UPDATE OF description, category_id ON expenses_expense
+    FOR EACH ROW
+    WHEN (OLD.description IS DISTINCT FROM NEW.description OR OLD.category_id IS DISTINCT FROM NEW.category_id)
+    EXECUTE FUNCTION expenses_expense_search_trigger()
+    """,
+    """
+    CREATE FUNCTION expenses_category_search_trigger() RETURNS trigger AS $$
+    BEGIN
+        UPDATE expenses_expense SET search_vector = expenses_search_vector(description, NEW.name)
+        WHERE category_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER expenses_category_search_update AFTER UPDATE OF name ON expenses_category
+    FOR EACH ROW
+    WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION expenses_category_search_trigger()
+    """,
+    """
+    UPDATE expenses_expense expense SET search_vector = expenses_search_vector(expense.description, category.name)
+    FROM expenses_category category
+    WHERE category.id = expense.category_id
+    """,
+    'CREATE INDEX expenses_expense_search_idx ON expenses_expense USING GIN (search_vector)',
+]
+
+POSTGRESQL_BACKWARD = [
+    'DROP TRIGGER IF EXISTS expenses_category_search_update ON expenses_category',
+    'DROP FUNCTION IF EXISTS expenses_category_search_trigger()',
+    'DROP TRIGGER IF EXISTS expenses_expense_search_update ON expenses_expense',
+    'DROP TRIGGER IF EXISTS expenses_expense_search_insert ON expenses_expense',
+    'DROP FUNCTION IF EXISTS expenses_expense_search_trigger()',
+    'DROP FUNCTION IF EXISTS expenses_search_vector(text, text)',
+    'ALTER TABLE expenses_expense DROP COLUMN IF EXISTS search_vector',
+]
+
+# Other backends search with LIKE and need nothing
+STATEMENTS = {
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+    'postgresql': (POSTGRESQL_FORWARD, POSTGRESQL_BACKWARD),
+}
+
+
+def run_statements(schema_editor, index: int):
+    statements = STATEMENTS.get(schema_editor.connection.vendor)
+
+    if statements is None:
+        return
+
+    for statement in statements[index]:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    run_statements(schema_editor, 0)
+
+
+def drop_search_index(apps, schema_editor):
+    run_statements(schema_editor, 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0013_expense_date_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,273 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import importlib
+
+# The search index of 0014 gets a household column, so searches only walk
+# the rows of one household. Only SQLite needs it, PostgreSQL filters the
+# tsvector matches by household_id.
+search = importlib.import_module('expenses.migrations.0014_expense_search')
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE expenses_expense_search USING fts5(
+        description,
+        category,
+        household,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER expenses_expense_search_insert AFTER INSERT ON expenses_expense
+    BEGIN
+        INSERT INTO expenses_expense_search (rowid, description, category, household)
+        SELECT new.id, new.description, name, 'h' || new.household_id FROM expenses_category WHERE id = new.category_id;
+    END
+    """,
+    """
+    CREATE TRIGGER expenses_expense_search_update AFTER UPDATE OF description, category_id, household_id ON expenses_expense
+    WHEN old.description IS NOT new.description
+        OR old.category_id IS NOT new.category_id
+        OR old.household_id IS NOT new.household_id
+    BEGIN
+        UPDATE expenses_expense_search
+        SET description = new.description,
+            category = (SELECT name FROM expenses_category WHERE id = new.category_id),
+            household = 'h' || new.household_id
+        WHERE rowid = new.id;
+    END
+    """,
+    search.SQLITE_FORWARD[3],
+    search.SQLITE_FORWARD[4],
+    """
+    INSERT INTO expenses_expense_search (rowid, description, category, household)
+    SELECT expense.id, expense.description, category.name, 'h' || expense.household_id
+    FROM expenses_expense expense
+    JOIN expenses_category category ON category.id = expense.category_id
+    """,
+]
+
+HOUSEHOLD_MODELS = (
+    'Category',
+    'Expense',
+    'ExpenseShare',
+    'ExpenseShareSummary',
+    'MonthlyLedger',
+    'MonthlyRollup',
+    'Settlement',
+    'BalanceSnapshot',
+)
+
+
+def run_sqlite_statements(schema_editor, statements: list[str]):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    run_sqlite_statements(schema_editor, search.SQLITE_BACKWARD)
+
+
+def create_search_index(apps, schema_editor):
+    run_sqlite_statements(schema_editor, search.SQLITE_FORWARD)
+
+
+def create_household_search_index(apps, schema_editor):
+    run_sqlite_statements(schema_editor, SQLITE_FORWARD)
+
+
+def drop_household_search_index(apps, schema_editor):
+    run_sqlite_statements(schema_editor, search.SQLITE_BACKWARD)
+
+
+def create_default_household(apps, schema_editor):
+    # Until now one deployment was one household, so everything that exists
+    # goes to a single one with every user as a member
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    Household = apps.get_model('expenses', 'Household')
+    Membership = apps.get_model('expenses', 'Membership')
+    Category = apps.get_model('expenses', 'Category')
+    db = schema_editor.connection.alias
+    user_ids = list(User.objects.using(db).values_list('pk', flat=True))
+
+    if not user_ids and not Category.objects.using(db).exists():
+        return
+
+    household = Household.objects.using(db).create(name='Home')
+    Membership.objects.using(db).bulk_create(
+        [Membership(household=household, user_id=user_id) for user_id in user_ids],
+        batch_size=1000
+    )
+
+    for name in HOUSEHOLD_MODELS:
+        apps.get_model('expenses', name).objects.using(db).update(household=household)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('expenses', '0014_expense_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Household',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Name')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Membership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('household', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='expenses.household')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='membership', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(drop_search_index, create_search_index),
+        migrations.RemoveConstraint(
+            model_name='monthlyrollup',
+            name='unique_monthly_rollup',
+        ),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expenses_ex_date_2b98af_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='expense',
+            name='expenses_ex_date_9369f8_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='expenseshare',
+            name='expenses_ex_user_id_25b16d_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='monthlyledger',
+            name='expenses_mo_year_759e57_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='settlement',
+            name='expenses_se_year_0f2637_idx',
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='household',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='categories', to='expenses.household'),
+        ),
+        migrations.AddField(
+            model_name='expense',
+            name='household',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expenses', to='expenses.household', verbose_name='Household'),
+        ),
+        migrations.AddField(
+            model_name='expenseshare',
+            name='household',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='expense_shares', to='expenses.household'),
+        ),
+        migrations.AddField(
+            model_name='expensesharesummary',
+            name='household',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='expenses.household'),
+        ),
+        migrations.AddField(
+            model_name='monthlyledger',
+            name='household',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledgers', to='expenses.household'),
+        ),
+        migrations.AddField(
+            model_name='monthlyrollup',
+            name='household',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='expenses.household'),
+        ),
+        migrations.AddField(
+            model_name='settlement',
+            name='household',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='settlements', to='expenses.household'),
+        ),
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='household',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='expenses.household'),
+        ),
+        migrations.RunPython(create_default_household, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='category',
+            name='household',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='categories', to='expenses.household'),
+        ),
+        migrations.AlterField(
+            model_name='expense',
+            name='household',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='expenses', to='expenses.household', verbose_name='Household'),
+        ),
+        migrations.AlterField(
+            model_name='expenseshare',
+            name='household',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='expense_shares', to='expenses.household'),
+        ),
+        migrations.AlterField(
+            model_name='expensesharesummary',
+            name='household',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='expenses.household'),
+        ),
+        migrations.AlterField(
+            model_name='monthlyledger',
+            name='household',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ledgers', to='expenses.household'),
+        ),
+        migrations.AlterField(
+            model_name='monthlyrollup',
+            name='household',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='expenses.household'),
+        ),
+        migrations.AlterField(
+            model_name='settlement',
+            name='household',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='settlements', to='expenses.household'),
+        ),
+        migrations.AlterField(
+            model_name='balancesnapshot',
+            name='household',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='expenses.household'),
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['household', 'period'], name='expenses_ba_househo_e95eae_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['household', 'date', 'paid_by'], name='expenses_ex_househo_6b0fb7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['household', 'date', 'id'], name='expenses_ex_househo_698509_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expenseshare',
+            index=models.Index(fields=['household', 'user', 'expense'], name='expenses_ex_househo_c52f00_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='expensesharesummary',
+            index=models.Index(fields=['household', 'year', 'month'], name='expenses_ex_househo_630a8a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='monthlyledger',
+            index=models.Index(fields=['household', 'year', 'month'], name='expenses_mo_househo_6277a8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='settlement',
+            index=models.Index(fields=['household', 'year', 'month'], name='expenses_se_househo_894230_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('household', 'year', 'month', 'category', 'paid_by'), name='unique_monthly_rollup'),
+        ),
+        migrations.RunPython(create_household_search_index, drop_household_search_index),
+    ]
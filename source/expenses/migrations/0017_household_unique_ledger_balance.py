@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2026-10-18 19:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0016_expense_search_without_household'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='balancesnapshot',
+            name='unique_user_balance_snapshot',
+        ),
+        migrations.RemoveConstraint(
+            model_name='monthlyledger',
+            name='unique_user_monthly_ledger',
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(fields=('household', 'user', 'period'), name='unique_household_user_balance_snapshot'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyledger',
+            constraint=models.UniqueConstraint(fields=('household', 'user', 'year', 'month'), name='unique_household_user_monthly_ledger'),
+        ),
+    ]
@@ -1,4 +1,31 @@
-from django.utils import timezone
+from typing import Callable, Optional
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.translation import gettext_lazy as _
+from django.core.exceptions import PermissionDenied
+from django.utils.http import http_date
+from django.http import HttpResponse
+from django.utils import timezone, translation
+
+from .cache import get_month_generation, get_or_set_for_month
+from .pagination import decode_cursor
+from .models import Membership
+
+
+class HouseholdMixin:
+    def get_household_id(self, request) -> int:
+        """
+        Household of the logged in user, which scopes every query of the
+        view. Users that don't belong to one get a 403.
+        """
+        if not hasattr(request, 'household_id'):
+            request.household_id = Membership.get_household_id(request.user)
+
+        if request.household_id is None:
+            raise PermissionDenied(_('You are not a member of any household'))
+
+        return request.household_id
 
 
 class FilterMixin:
@@ -10,3 +37,76 @@ class FilterMixin:
 
     def is_user(self, request) -> bool:
         return bool(request.GET.get('user', False))
+
+    def is_all_months(self, request) -> bool:
+        return bool(request.GET.get('all', False))
+
+    def get_cursor(self, request) -> Optional[str]:
+        """
+        Cursor of the page to load, raises ValueError when it's malformed.
+        """
+        cursor = request.GET.get('cursor') or None
+
+        if cursor is not None:
+            decode_cursor(cursor)
+
+        return cursor
+
+    def get_next_url(self, request, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+
+        query = request.GET.copy()
+        query['cursor'] = cursor
+        return f'{request.path}?{query.urlencode()}'
+
+
+class MonthCacheMixin:
+    """
+    Caches the rendered response of a view per user and month. Entries are
+    keyed by the household's month generation, so saving an expense of a
+    month only invalidates that month of that household, and the generation
+    doubles as ETag and Last-Modified so htmx refreshes of an unchanged
+    month get a 304.
+    Every page of a paginated list is cached on its own.
+    """
+    cache_name: str = ''
+
+    def get_cache_key(self, request) -> str:
+        cursor = request.GET.get('cursor', '')
+        return f'views:{self.cache_name}:{request.user.pk}:{translation.get_language()}:{cursor}'
+
+    def cached_response(
+        self,
+        request,
+        household_id: int,
+        year: Optional[int],
+        month: Optional[int],
+        render: Callable[[], HttpResponse]
+    ) -> HttpResponse:
+        generation = get_month_generation(household_id, year, month)
+        key = self.get_cache_key(request)
+        etag = '"%s"' % hashlib.md5(f'{key}:{household_id}:{year}-{month}:{generation}'.encode()).hexdigest()
+        last_modified_timestamp = generation // 10 ** 9
+
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified_timestamp
+        )
+
+        if response is None:
+            content = get_or_set_for_month(
+                key,
+                household_id,
+                year,
+                month,
+                lambda: render().content,
+                generation=generation
+            )
+            response = HttpResponse(content)
+
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified_timestamp)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
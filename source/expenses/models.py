@@ -1,16 +1,177 @@
+from typing import Optional, Union
+from itertools import chain
+from dataclasses import dataclass
+import datetime
+import operator
 import decimal
 
 from django.utils.translation import gettext as _
 from django.contrib.auth.models import User
-from django.core.mail import send_mail
-from django.db.models import QuerySet
+from django.core.mail import EmailMultiAlternatives
+from django.utils.html import escape
+from django.db.models import F, QuerySet
+from django.db import connection, connections, models, transaction
+from django.utils import timezone
 from django.conf import settings
-from django.db import models
 
-import prettytable as pt
+from .aggregates import ZERO, sum_field, sum_fields
+from .dates import month_index, month_range, year_range
+from .cache import bump_month_generation, get_active_users
+from .splits import split_amount
+from .settlements import settle
+
+
+class InsertQuerySet(models.QuerySet):
+    def insert_rows(
+        self,
+        field_names: tuple[str, ...],
+        rows: list[tuple],
+        return_pks: bool = False,
+        conflict_sql: str = ''
+    ) -> list[int]:
+        """
+        Inserts ``rows``, tuples with the values of ``field_names``, with
+        multi-row INSERTs and no model instances. bulk_create() prepares
+        every value through its field, which takes longer than the INSERTs
+        themselves for thousands of rows. Values are passed as they are, so
+        they must be what the fields would store: ids, Decimals with the
+        field's decimal places, dates, strings.
+
+        Returns the new pks, in the order of ``rows``, with ``return_pks``.
+        Backends that can't return them from a multi-row INSERT, like MySQL,
+        insert one row at a time and read each pk back instead.
+        """
+        connection = connections[self.db]
+        opts = self.model._meta
+        fields = [opts.get_field(name) for name in field_names]
+        quote_name = connection.ops.quote_name
+        bulk_pks = return_pks and connection.features.can_return_rows_from_bulk_insert
+        returning = connection.ops.return_insert_columns([opts.pk])[0] if bulk_pks else ''
+        sql = 'INSERT INTO %s (%s) %%s %s %s' % (
+            quote_name(opts.db_table),
+            ', '.join(quote_name(field.column) for field in fields),
+            conflict_sql,
+            returning
+        )
+        # Without RETURNING the pk of each row is only known one at a time
+        batch_size = max(connection.ops.bulk_batch_size(fields, rows), 1) if bulk_pks or not return_pks else 1
+        # Every batch but the last one has the same statement
+        statements = {}
+        pks = []
+
+        with transaction.atomic(using=self.db, savepoint=False), connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+
+                if len(batch) not in statements:
+                    statements[len(batch)] = sql % connection.ops.bulk_insert_sql(
+                        fields,
+                        [['%s'] * len(fields)] * len(batch)
+                    )
+
+                cursor.execute(statements[len(batch)], list(chain.from_iterable(batch)))
+
+                if bulk_pks:
+                    pks.extend(pk for pk, in connection.ops.fetch_returned_insert_rows(cursor))
+                elif return_pks:
+                    pks.append(connection.ops.last_insert_id(cursor, opts.db_table, opts.pk.column))
+
+        return pks
+
+
+class ExpenseQuerySet(InsertQuerySet):
+    def in_month(self, year: int, month: int) -> 'ExpenseQuerySet':
+        start, end = month_range(year, month)
+        return self.filter(date__gte=start, date__lt=end)
+
+
+class ExpenseShareQuerySet(InsertQuerySet):
+    def in_month(self, year: int, month: int) -> 'ExpenseShareQuerySet':
+        start, end = month_range(year, month)
+        return self.filter(expense__date__gte=start, expense__date__lt=end)
+
+
+class DeltaQuerySet(InsertQuerySet):
+    # Above this many keys the deltas are added with upserts, instead of
+    # with one UPDATE per key
+    BULK_DELTAS = 20
+
+    def apply_deltas(self, key_fields: tuple[str, ...], deltas: dict, sign: int = 1):
+        """
+        Adds ``deltas``, ``{key: {field: value}}`` with keys holding the values
+        of ``key_fields``, to their rows and creates the missing ones. A few
+        keys are updated in place with F() expressions, bigger batches are
+        added by the database with multi-row upserts.
+        """
+        if not deltas:
+            return
+
+        with transaction.atomic(using=self.db):
+            if len(deltas) > self.BULK_DELTAS:
+                self.upsert_deltas(key_fields, deltas, sign)
+                return
+
+            if sign > 0:
+                self.bulk_create([self.model(**dict(zip(key_fields, key))) for key in deltas], ignore_conflicts=True)
+
+            for key, delta in deltas.items():
+                self.filter(**dict(zip(key_fields, key))).update(**{
+                    field: F(field) + sign * value for field, value in delta.items()
+                })
+
+    def upsert_deltas(self, key_fields: tuple[str, ...], deltas: dict, sign: int = 1):
+        connection = connections[self.db]
+        opts = self.model._meta
+        fields = sorted({field for delta in deltas.values() for field in delta})
+        columns = [connection.ops.quote_name(opts.get_field(field).column) for field in fields]
+
+        if connection.vendor == 'mysql':
+            conflict_sql = 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+                f'{column} = {column} + VALUES({column})' for column in columns
+            )
+        else:
+            unique = next(
+                constraint for constraint in opts.constraints
+                if isinstance(constraint, models.UniqueConstraint)
+            )
+            table = connection.ops.quote_name(opts.db_table)
+            conflict_sql = 'ON CONFLICT (%s) DO UPDATE SET %s' % (
+                ', '.join(connection.ops.quote_name(opts.get_field(field).column) for field in unique.fields),
+                ', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in columns)
+            )
+
+        self.insert_rows(
+            key_fields + tuple(fields),
+            [key + tuple(sign * delta.get(field, 0) for field in fields) for key, delta in deltas.items()],
+            conflict_sql=conflict_sql
+        )
+
+
+class Household(models.Model):
+    """
+    Group of users sharing expenses. Every expense, share, summary and
+    aggregate belongs to one household and queries never cross them.
+    """
+    name = models.CharField(verbose_name=_('Name'), max_length=100)
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class Membership(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='memberships')
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='membership')
+
+    def __str__(self) -> str:
+        return f'{self.user} - {self.household}'
+
+    @classmethod
+    def get_household_id(cls, user: User) -> Optional[int]:
+        return cls.objects.filter(user_id=user.pk).values_list('household_id', flat=True).first()
 
 
 class Category(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='categories')
     name = models.CharField(max_length=100)
 
     def __str__(self) -> str:
@@ -18,6 +179,14 @@ class Category(models.Model):
 
 
 class Expense(models.Model):
+    household = models.ForeignKey(
+        Household,
+        verbose_name=_('Household'),
+        on_delete=models.CASCADE,
+        related_name='expenses',
+        # Covered by the composite indexes below
+        db_index=False
+    )
     paid_by = models.ForeignKey(
         User,
         verbose_name=_('Paid by'),
@@ -46,141 +215,465 @@ class Expense(models.Model):
     )
     date = models.DateField(verbose_name=_('Date'))
 
+    objects = ExpenseQuerySet.as_manager()
+
+    # Fields the shares, the ledger and the rollup are computed from
+    SPLIT_FIELDS = ('household', 'amount', 'paid_by', 'date', 'category')
+    # Columns written by bulk_create_with_shares()
+    INSERT_FIELDS = ('household_id', 'paid_by_id', 'category_id', 'amount', 'description', 'created_by_id', 'date')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'date', 'paid_by']),
+            # Keyset pagination of the expense lists
+            models.Index(fields=['household', 'date', 'id']),
+        ]
+
     def __str__(self) -> str:
         return f'{self.paid_by} - {self.amount}'
 
     @classmethod
-    def get_by_month(cls, year: int, month: int) -> QuerySet['Expense']:
-        return Expense.objects.filter(date__year=year, date__month=month)
+    def get_by_month(cls, household_id: int, year: int, month: int) -> QuerySet['Expense']:
+        return cls.__select_for_list(Expense.objects.filter(household_id=household_id).in_month(year, month))
 
     @classmethod
-    def get_monthly_total(cls, year: int, month: int) -> decimal.Decimal:
-        shares = cls.objects.filter(date__year=year, date__month=month)
-        total = decimal.Decimal(0.0)
+    def get_all(cls, household_id: int) -> QuerySet['Expense']:
+        return cls.__select_for_list(Expense.objects.filter(household_id=household_id))
 
-        for share in shares:
-            total += share.amount
+    @classmethod
+    def get_by_ids(cls, ids: list[int]) -> dict[int, 'Expense']:
+        # Only by primary key: with the household too, SQLite prefers the
+        # household index over a list of ids and walks every expense of it
+        return cls.__select_for_list(Expense.objects.all()).in_bulk(ids)
+
+    @classmethod
+    def __select_for_list(cls, queryset: QuerySet['Expense']) -> QuerySet['Expense']:
+        return queryset.select_related(
+            'category',
+            'paid_by'
+        ).only(
+            'date',
+            'description',
+            'amount',
+            'category__name',
+            'paid_by__username'
+        )
+
+    @classmethod
+    def get_monthly_total(cls, household_id: int, year: int, month: int) -> decimal.Decimal:
+        return sum_field(cls.objects.filter(household_id=household_id).in_month(year, month), 'amount')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered to tell whether a save has to touch the shares
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_split_values(self) -> dict:
+        return {
+            self._meta.get_field(name).attname: getattr(self, self._meta.get_field(name).attname)
+            for name in self.SPLIT_FIELDS
+        }
 
-        return total
+    def has_split_changes(self, update_fields=None) -> bool:
+        """
+        Whether saving changes anything the shares, ledger or rollup depend
+        on. Unknown previous values count as a change.
+        """
+        if update_fields is not None and not set(update_fields) & {
+            name for field in self.SPLIT_FIELDS for name in (field, self._meta.get_field(field).attname)
+        }:
+            return False
+
+        loaded = getattr(self, '_loaded_values', None)
+
+        if loaded is None:
+            return True
+
+        return any(
+            attname not in loaded or loaded[attname] != value
+            for attname, value in self.get_split_values().items()
+        )
 
     def save(self, **kwargs):
         created = self.pk is None
-        super().save(**kwargs)
 
-        if created:
-            ExpenseShare.create_from_expense(self)
-        else:
+        if not created and not self.has_split_changes(kwargs.get('update_fields')):
+            # e.g. only the description changed: a single UPDATE
+            super().save(**kwargs)
+            bump_month_generation(self.household_id, self.date.year, self.date.month)
+            return
+
+        with transaction.atomic():
+            if not created:
+                previous = Expense.objects.filter(pk=self.pk).first()
+
+                if previous is not None:
+                    previous.apply_aggregates(sign=-1)
+
+            super().save(**kwargs)
+
+            if created:
+                ExpenseShare.create_from_expense(self)
+            else:
+                ExpenseShare.update_from_expense(self)
+
+            self.apply_aggregates()
+
+        self._loaded_values = self.get_split_values()
+
+    def resplit(self):
+        """
+        Rebuilds the shares after the split rule of the expense changed.
+        """
+        with transaction.atomic():
+            self.apply_aggregates(sign=-1)
             ExpenseShare.update_from_expense(self)
+            self.apply_aggregates()
+
+    def apply_aggregates(self, sign: int = 1):
+        """
+        Adds (or with ``sign=-1`` removes) this expense and its current shares
+        to the ledger and the rollup, and invalidates its cached month.
+        """
+        MonthlyLedger.apply_expense(self, sign=sign)
+        MonthlyRollup.apply_deltas(MonthlyRollup.get_expense_deltas(self), sign=sign)
+        bump_month_generation(self.household_id, self.date.year, self.date.month)
+
+    @classmethod
+    def bulk_create_with_shares(
+        cls,
+        expenses: list[Union['Expense', 'ExpenseRow']]
+    ) -> list[Union['Expense', 'ExpenseRow']]:
+        """
+        Inserts many expenses at once, together with their shares, ledger and
+        rollup deltas, in a single transaction. ``save()`` is not called.
+        Takes Expense instances or ExpenseRow values, which are much cheaper
+        to build for imports of thousands of rows, and sets their pks.
+        """
+        with transaction.atomic():
+            pks = cls.objects.insert_rows(
+                cls.INSERT_FIELDS,
+                list(map(operator.attrgetter(*cls.INSERT_FIELDS), expenses)),
+                return_pks=True
+            )
+
+            for expense, pk in zip(expenses, pks):
+                expense.pk = pk
+
+                if isinstance(expense, Expense):
+                    expense._state.adding = False
+                    expense._state.db = connection.alias
+
+            shares = ExpenseShare.create_from_expenses(expenses)
+            ledger_deltas = {}
+            rollup_deltas = {}
+
+            for expense in expenses:
+                MonthlyLedger.get_expense_deltas(expense, shares[expense.pk], ledger_deltas)
+                MonthlyRollup.get_expense_deltas(expense, rollup_deltas)
+
+            MonthlyLedger.apply_deltas(ledger_deltas)
+            MonthlyRollup.apply_deltas(rollup_deltas)
+
+            for household_id, year, month in {
+                (expense.household_id, expense.date.year, expense.date.month) for expense in expenses
+            }:
+                bump_month_generation(household_id, year, month)
+
+        return expenses
+
+
+@dataclass
+class ExpenseRow:
+    """
+    Values of a new expense for Expense.bulk_create_with_shares(), with the
+    attributes the shares, ledger and rollup are computed from.
+    """
+    household_id: int
+    paid_by_id: int
+    category_id: int
+    amount: decimal.Decimal
+    description: Optional[str]
+    created_by_id: int
+    date: datetime.date
+    pk: Optional[int] = None
 
 
 class ExpenseShare(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='expense_shares', db_index=False)
     expense = models.ForeignKey(Expense, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expense_shares')
     amount = models.DecimalField(max_digits=8, decimal_places=2)
-    discount = models.DecimalField(max_digits=8, decimal_places=2, default=decimal.Decimal(0.0))
+    discount = models.DecimalField(max_digits=8, decimal_places=2, default=ZERO)
+
+    objects = ExpenseShareQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'user', 'expense']),
+        ]
 
     def __str__(self) -> str:
         return f'{self.user} - {self.amount} - {self.discount} - {self.expense}'
 
     @staticmethod
-    def __get_active_users() -> QuerySet[User]:
-        return User.objects.filter(is_active=True)
+    def __get_active_users(household_ids: set[int]) -> dict[int, list[User]]:
+        return get_active_users(household_ids)
     
     @classmethod
-    def get_by_month(cls, year: int, month: int, user: User) -> QuerySet['ExpenseShare']:
-        return ExpenseShare.objects.filter(
-            expense__date__year=year,
-            expense__date__month=month,
+    def get_by_month(cls, household_id: int, year: int, month: int, user: User) -> QuerySet['ExpenseShare']:
+        return cls.__select_for_list(ExpenseShare.objects.in_month(year, month), household_id, user)
+
+    @classmethod
+    def get_all_for_user(cls, household_id: int, user: User) -> QuerySet['ExpenseShare']:
+        return cls.__select_for_list(ExpenseShare.objects.all(), household_id, user)
+
+    @classmethod
+    def __select_for_list(
+        cls,
+        queryset: QuerySet['ExpenseShare'],
+        household_id: int,
+        user: User
+    ) -> QuerySet['ExpenseShare']:
+        return queryset.filter(
+            household_id=household_id,
             user=user
+        ).select_related(
+            'expense__category',
+            'expense__paid_by'
+        ).only(
+            'amount',
+            'discount',
+            'expense__date',
+            'expense__description',
+            'expense__amount',
+            'expense__category__name',
+            'expense__paid_by__username'
         )
 
-    @classmethod
-    def create_from_expense(cls, expense: Expense):
-        users = cls.__get_active_users()
+    @staticmethod
+    def get_split(
+        expense: Union[Expense, 'ExpenseRow'],
+        user_ids: list[int],
+        rule: Optional['SplitRule'] = None
+    ) -> list[tuple[int, decimal.Decimal, decimal.Decimal]]:
+        """
+        Splits the expense with its rule, equally between ``user_ids`` (the
+        active users of its household) when it has none, into (user_id,
+        amount, discount) shares. The payer's share keeps amount 0 and
+        discounts what the others owe, excluded users get no share.
+        """
+        portions = split_amount(
+            expense.amount,
+            user_ids,
+            rule.get_members() if rule is not None else None,
+            expense.paid_by_id
+        )
         shares = []
-        total_users = users.count()
 
-        for user in users:
-            amount = expense.amount / total_users if user != expense.paid_by else 0.0
-            discount = 0.0
+        for user_id in user_ids:
+            portion = portions.get(user_id)
 
-            if user == expense.paid_by:
-                discount = (expense.amount * (total_users - 1)) / total_users
+            if user_id == expense.paid_by_id:
+                shares.append((user_id, ZERO, expense.amount - (portion or ZERO)))
+            elif portion is not None:
+                shares.append((user_id, portion, ZERO))
 
-            share = cls(expense=expense, user=user, amount=amount, discount=discount)
-            shares.append(share)
+        return shares
 
-        cls.objects.bulk_create(shares)
+    @classmethod
+    def build_from_expense(
+        cls,
+        expense: Expense,
+        users: list[User],
+        rule: Optional['SplitRule'] = None
+    ) -> list['ExpenseShare']:
+        return [
+            cls(household_id=expense.household_id, expense_id=expense.pk, user_id=user_id, amount=amount, discount=discount)
+            for user_id, amount, discount in cls.get_split(expense, [user.pk for user in users], rule)
+        ]
 
     @classmethod
-    def update_from_expense(cls, expense: Expense):
-        cls.objects.filter(expense=expense).delete()
-        cls.create_from_expense(expense)
+    def create_from_expense(cls, expense: Expense):
+        cls.create_from_expenses([expense])
 
     @classmethod
-    def get_per_user_monthly_total(cls, year: int, month: int) -> decimal.Decimal:
-        monthly_total = Expense.get_monthly_total(year, month)
-        return monthly_total / cls.__get_active_users().count()
+    def create_from_expenses(cls, expenses: list[Union[Expense, 'ExpenseRow']]) -> dict[int, list[tuple]]:
+        """
+        Splits a batch of expenses in one pass: the active users of their
+        households come from the cache, the split rules of the whole batch
+        are read at once and every share is written with multi-row INSERTs.
+        Returns the (user_id, amount, discount) shares of each expense pk.
+        """
+        user_ids = {
+            household_id: [user.pk for user in users]
+            for household_id, users in cls.__get_active_users({expense.household_id for expense in expenses}).items()
+        }
+        rules = SplitRule.get_for_expenses(expenses, expense_rules=False)
+        shares = {}
+        rows = []
+
+        for expense in expenses:
+            pk, household_id = expense.pk, expense.household_id
+            shares[pk] = cls.get_split(expense, user_ids[household_id], rules.get(pk))
+            rows += [(household_id, pk, *share) for share in shares[pk]]
+
+        cls.objects.insert_rows(('household_id', 'expense_id', 'user_id', 'amount', 'discount'), rows)
+        return shares
 
     @classmethod
-    def get_monthly_discounted_total(cls, year: int, month: int, user: User) -> decimal.Decimal:
-        shares = cls.objects.filter(
-            expense__date__year=year,
-            expense__date__month=month,
-            user=user
-        )
-        total = decimal.Decimal(0.0)
+    def update_from_expense(cls, expense: Expense):
+        """
+        Brings the shares of an edited expense to its current split, only
+        writing the differences so unchanged shares keep their rows.
+        """
+        users = cls.__get_active_users({expense.household_id})[expense.household_id]
+        rule = SplitRule.get_for_expenses([expense]).get(expense.pk)
+        target = {share.user_id: share for share in cls.build_from_expense(expense, users, rule)}
+        kept = set()
+        to_update = []
+        to_delete = []
 
-        for share in shares:
-            total += share.discount
+        for share in cls.objects.filter(expense=expense).only('household', 'user', 'amount', 'discount'):
+            wanted = target.get(share.user_id)
+
+            if wanted is None or share.user_id in kept:
+                to_delete.append(share.pk)
+                continue
+
+            kept.add(share.user_id)
 
-        return total
+            if (share.household_id, share.amount, share.discount) != (
+                wanted.household_id,
+                wanted.amount,
+                wanted.discount
+            ):
+                share.household_id = wanted.household_id
+                share.amount = wanted.amount
+                share.discount = wanted.discount
+                to_update.append(share)
+
+        if to_delete:
+            cls.objects.filter(pk__in=to_delete).delete()
+
+        if to_update:
+            cls.objects.bulk_update(to_update, ['household', 'amount', 'discount'])
+
+        cls.objects.bulk_create([share for user_id, share in target.items() if user_id not in kept])
 
     @classmethod
-    def calc_monthly_expense(cls, year: int, month: int):
-        users = cls.__get_active_users()
-        total_amount = Expense.get_monthly_total(year, month) / users.count()
+    def get_per_user_monthly_total(cls, household_id: int, year: int, month: int) -> dict[int, decimal.Decimal]:
+        """
+        Part of the month's expenses that belongs to each active user, as
+        split by the rules of the expenses. Keyed by user id, users without
+        shares that month are left out.
+        """
+        return dict(MonthlyLedger.objects.filter(
+            household_id=household_id,
+            year=year,
+            month=month,
+            user__is_active=True
+        ).values_list('user', 'total_amount'))
 
-        shares = cls.objects.filter(
-            expense__date__year=year,
-            expense__date__month=month
-        ).values('user').annotate(
-            total_discount=models.Sum('discount')
-        )
+    @classmethod
+    def get_monthly_discounted_total(cls, household_id: int, year: int, month: int, user: User) -> decimal.Decimal:
+        shares = cls.objects.in_month(year, month).filter(household_id=household_id, user=user)
+        return sum_field(shares, 'discount')
 
-        # Delete previous month summary
-        ExpenseShareSummary.objects.filter(year=year, month=month).delete()
-
-        # Create new summary
-        ExpenseShareSummary.objects.bulk_create([
-            ExpenseShareSummary(
-                user=user,
-                year=year,
-                month=month,
-                total_discount=share['total_discount'],
-                total_amount=total_amount,
-                to_pay=total_amount - share['total_discount']
-            ) for user, share in zip(users, shares)
-        ])
+    @classmethod
+    def calc_monthly_expense(cls, household_id: int, year: int, month: int) -> list['ExpenseShareSummary']:
+        # One ledger row per user with expenses that month, so users without
+        # shares don't shift anyone else's totals
+        ledgers = list(MonthlyLedger.objects.filter(
+            household_id=household_id,
+            year=year,
+            month=month,
+            user__is_active=True
+        ))
+
+        with transaction.atomic():
+            previous = ExpenseShareSummary.objects.filter(household_id=household_id, year=year, month=month)
+            # Payments already registered survive the recalculation
+            payments = {
+                summary.user_id: summary
+                for summary in previous.only('user', 'paid_amount', 'paid')
+            }
+
+            # Delete previous month summary
+            previous.delete()
+
+            # Create new summary
+            summaries = []
+
+            for ledger in ledgers:
+                payment = payments.get(ledger.user_id)
+                paid_amount = payment.paid_amount if payment is not None else ZERO
+
+                summaries.append(ExpenseShareSummary(
+                    household_id=household_id,
+                    user_id=ledger.user_id,
+                    year=year,
+                    month=month,
+                    total_discount=ledger.total_discount,
+                    total_amount=ledger.total_amount,
+                    to_pay=ledger.to_pay,
+                    paid_amount=paid_amount,
+                    paid=payment is not None and payment.paid and paid_amount >= ledger.to_pay
+                ))
+
+            summaries = ExpenseShareSummary.objects.bulk_create(summaries)
+            Settlement.create_for_month(household_id, year, month, ledgers)
+            BalanceSnapshot.rebuild(household_id, year, month)
+            bump_month_generation(household_id, year, month)
+
+        return summaries
 
 
 class ExpenseShareSummary(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='summaries', db_index=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     year = models.IntegerField()
     month = models.IntegerField()
     total_discount = models.DecimalField(max_digits=8, decimal_places=2)
     total_amount = models.DecimalField(max_digits=8, decimal_places=2)
-    to_pay = models.DecimalField(max_digits=8, decimal_places=2, default=decimal.Decimal(0.0))
+    to_pay = models.DecimalField(max_digits=8, decimal_places=2, default=ZERO)
+    paid_amount = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
     paid = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'year', 'month']),
+        ]
+
     def __str__(self) -> str:
         return f'{self.user} ({self.total_amount} - {self.total_discount} = {self.to_pay})'
 
     def set_paid(self):
-        self.paid = True
-        self.save(update_fields=['paid'])
+        remainder = self.to_pay - self.paid_amount
+
+        # Creditors, and users who already paid, have nothing left to pay
+        if remainder > 0:
+            self.register_payment(remainder)
+
+    def register_payment(self, amount: decimal.Decimal):
+        """
+        Records a payment towards this month. Whatever is left unpaid, or
+        paid in excess, is carried over to the next months' balances.
+        """
+        with transaction.atomic():
+            self.paid_amount += amount
+            self.paid = self.paid_amount >= self.to_pay
+            self.save(update_fields=['paid_amount', 'paid'])
+            BalanceSnapshot.rebuild(self.household_id, self.year, self.month, user_ids=[self.user_id])
+
+        bump_month_generation(self.household_id, self.year, self.month)
 
     def get_email_body(self) -> str:
+        # Only the summary emails need it, keep it out of every cold start
+        import prettytable as pt
+
         table = pt.PrettyTable()
         table.field_names = [
             _('Date'),
@@ -200,13 +693,9 @@ class ExpenseShareSummary(models.Model):
         table.vrules = pt.ALL
         table.padding_width = 3
 
-        total = Expense.get_monthly_total(self.year, self.month)
-        total_per_user = ExpenseShare.get_per_user_monthly_total(self.year, self.month)
-        shares = ExpenseShare.objects.filter(
-            expense__date__year=self.year,
-            expense__date__month=self.month,
-            user=self.user
-        )
+        total = MonthlyLedger.get_monthly_total(self.household_id, self.year, self.month)
+        total_per_user = self.total_amount
+        shares = ExpenseShare.get_by_month(self.household_id, self.year, self.month, self.user)
 
         for share in shares:
             table.add_row([
@@ -241,17 +730,579 @@ class ExpenseShareSummary(models.Model):
                 'border': '1',
                 'style': 'border-width: 1px; border-collapse: collapse;'
             }),
-        )
+        ) + self.get_settlements_html() + self.get_balance_html()
+
+    def get_settlements(self) -> QuerySet['Settlement']:
+        return Settlement.get_for_user(self.household_id, self.user, self.year, self.month)
+
+    def get_settlements_html(self) -> str:
+        lines = []
+
+        for settlement in self.get_settlements():
+            if settlement.from_user_id == self.user_id:
+                lines.append(_('You pay %s to %s') % (settlement.amount, settlement.to_user.username))
+            else:
+                lines.append(_('%s pays you %s') % (settlement.from_user.username, settlement.amount))
+
+        if not lines:
+            return ''
+
+        items = ''.join(f'<li>{escape(line)}</li>' for line in lines)
+        return f'<p>{escape(_("Transfers to settle the month:"))}</p><ul>{items}</ul>'
+
+    def get_balance_html(self) -> str:
+        balance = BalanceSnapshot.get_balance(self.household_id, self.user, self.year, self.month)
+        return f'<p>{escape(_("Balance including previous months: %s") % balance)}</p>'
 
     def get_email_subject(self) -> str:
         return _('Monthly expense summary for %s/%s') % (self.month, self.year)
 
-    def notify_user(self):
-        send_mail(
+    def build_email(self) -> EmailMultiAlternatives:
+        body = self.get_email_body()
+        message = EmailMultiAlternatives(
             self.get_email_subject(),
-            self.get_email_body(),
+            body,
             settings.EMAIL_HOST_USER,
             [self.user.email],
-            html_message=self.get_email_body(),
-            fail_silently=False,
         )
+        message.attach_alternative(body, 'text/html')
+        return message
+
+    def get_notification_key(self) -> str:
+        # Versioned by what the email says: a month that changed is sent
+        # again, recomputing an unchanged one isn't
+        return f'summary-email:{self.user_id}:{self.year}-{self.month}:{self.to_pay}:{self.paid_amount}'
+
+    def notify_user(self):
+        """
+        Queues the summary email, the job worker renders and sends it.
+        """
+        from .jobs import enqueue
+
+        enqueue(
+            'expenses.send_summary_email',
+            key=self.get_notification_key(),
+            user_id=self.user_id,
+            year=self.year,
+            month=self.month
+        )
+
+
+class MonthlyLedger(models.Model):
+    """
+    Running per-user totals of a month, kept up to date by delta every time
+    an expense is saved or deleted so reads never touch the raw shares.
+    """
+    KEY_FIELDS = ('household_id', 'user_id', 'year', 'month')
+    DELTA_FIELDS = ('total_paid', 'total_amount', 'total_discount', 'to_pay')
+
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='ledgers', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledgers')
+    year = models.IntegerField()
+    month = models.IntegerField()
+    total_paid = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+    total_discount = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+    to_pay = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+
+    objects = DeltaQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['household', 'user', 'year', 'month'], name='unique_household_user_monthly_ledger'),
+        ]
+        indexes = [
+            models.Index(fields=['household', 'year', 'month']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.month}/{self.year} ({self.total_amount} - {self.total_discount} = {self.to_pay})'
+
+    @classmethod
+    def get_for_user(cls, household_id: int, user: User, year: int, month: int) -> 'MonthlyLedger':
+        ledger = cls.objects.filter(household_id=household_id, user=user, year=year, month=month).first()
+        return ledger or cls(household_id=household_id, user=user, year=year, month=month)
+
+    @classmethod
+    def get_monthly_total(cls, household_id: int, year: int, month: int) -> decimal.Decimal:
+        return sum_field(cls.objects.filter(household_id=household_id, year=year, month=month), 'total_paid')
+
+    @classmethod
+    def get_total(cls, household_id: int) -> decimal.Decimal:
+        return sum_field(cls.objects.filter(household_id=household_id), 'total_paid')
+
+    @classmethod
+    def get_totals_for_user(cls, household_id: int, user: User) -> 'MonthlyLedger':
+        """
+        Unsaved ledger adding up every month of a user.
+        """
+        totals = sum_fields(
+            cls.objects.filter(household_id=household_id, user=user),
+            **{field: field for field in cls.DELTA_FIELDS}
+        )
+        return cls(household_id=household_id, user=user, **totals)
+
+    @classmethod
+    def get_expense_deltas(cls, expense: Expense, shares, deltas: Optional[dict] = None) -> dict:
+        """
+        Accumulates the ledger deltas of an expense and its (user_id, amount,
+        discount) shares, keyed by (household_id, user_id, year, month).
+        """
+        if deltas is None:
+            deltas = {}
+
+        household_id, paid_by_id, amount_paid = expense.household_id, expense.paid_by_id, expense.amount
+        year, month = expense.date.year, expense.date.month
+
+        def delta_for(user_id: int) -> dict:
+            key = (household_id, user_id, year, month)
+            delta = deltas.get(key)
+
+            if delta is None:
+                delta = deltas[key] = dict.fromkeys(cls.DELTA_FIELDS, ZERO)
+
+            return delta
+
+        delta_for(paid_by_id)['total_paid'] += amount_paid
+
+        for user_id, amount, discount in shares:
+            # Part of the expense that belongs to the user. The payer's share
+            # keeps it implicitly as the amount not discounted to the others.
+            portion = amount_paid - discount if user_id == paid_by_id else amount
+            delta = delta_for(user_id)
+            delta['total_amount'] += portion
+            delta['total_discount'] += discount
+            delta['to_pay'] += portion - discount
+
+        return deltas
+
+    @classmethod
+    def apply_expense(cls, expense: Expense, sign: int = 1):
+        shares = ExpenseShare.objects.filter(expense=expense).values_list('user', 'amount', 'discount')
+        cls.apply_deltas(cls.get_expense_deltas(expense, shares), sign=sign)
+
+    @classmethod
+    def apply_deltas(cls, deltas: dict, sign: int = 1):
+        cls.objects.apply_deltas(cls.KEY_FIELDS, deltas, sign)
+
+    @classmethod
+    def compute_expected(
+        cls,
+        household_id: Optional[int] = None,
+        year: Optional[int] = None,
+        month: Optional[int] = None
+    ) -> dict:
+        """
+        Recomputes the ledger values from the raw expenses and shares, keyed
+        like the deltas, of one household or all of them. Used to detect and
+        repair drift.
+        """
+        expenses = Expense.objects.all()
+
+        if household_id is not None:
+            expenses = expenses.filter(household_id=household_id)
+
+        if year is not None and month is not None:
+            expenses = expenses.in_month(year, month)
+        elif year is not None:
+            start, end = year_range(year)
+            expenses = expenses.filter(date__gte=start, date__lt=end)
+
+        expenses = expenses.only('household', 'paid_by', 'amount', 'date').prefetch_related(
+            models.Prefetch(
+                'expenseshare_set',
+                queryset=ExpenseShare.objects.only('expense', 'user', 'amount', 'discount')
+            )
+        )
+        expected = {}
+
+        for expense in expenses.iterator(chunk_size=2000):
+            cls.get_expense_deltas(expense, [
+                (share.user_id, share.amount, share.discount) for share in expense.expenseshare_set.all()
+            ], expected)
+
+        return expected
+
+
+class MonthlyRollup(models.Model):
+    """
+    Expense totals bucketed by month, category and payer, updated by delta
+    like MonthlyLedger. Dashboards read years of data from here with a
+    single range scan instead of grouping the raw expenses.
+    """
+    KEY_FIELDS = ('household_id', 'year', 'month', 'category_id', 'paid_by_id')
+    DELTA_FIELDS = ('total', 'count')
+
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='rollups', db_index=False)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='rollups')
+    paid_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='rollups')
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=ZERO)
+    count = models.IntegerField(default=0)
+
+    objects = DeltaQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['household', 'year', 'month', 'category', 'paid_by'],
+                name='unique_monthly_rollup'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.month}/{self.year} {self.category} {self.paid_by} ({self.total})'
+
+    @classmethod
+    def get_expense_deltas(cls, expense: Expense, deltas: Optional[dict] = None) -> dict:
+        """
+        Accumulates the rollup delta of an expense, keyed by
+        (household_id, year, month, category_id, paid_by_id).
+        """
+        if deltas is None:
+            deltas = {}
+
+        key = (expense.household_id, expense.date.year, expense.date.month, expense.category_id, expense.paid_by_id)
+        delta = deltas.get(key)
+
+        if delta is None:
+            delta = deltas[key] = {'total': ZERO, 'count': 0}
+
+        delta['total'] += expense.amount
+        delta['count'] += 1
+        return deltas
+
+    @classmethod
+    def apply_deltas(cls, deltas: dict, sign: int = 1):
+        cls.objects.apply_deltas(cls.KEY_FIELDS, deltas, sign)
+
+    @classmethod
+    def get_between(cls, household_id: int, from_year: int, to_year: int) -> QuerySet['MonthlyRollup']:
+        return cls.objects.filter(
+            household_id=household_id,
+            year__gte=from_year,
+            year__lte=to_year,
+            count__gt=0
+        ).select_related(
+            'category',
+            'paid_by'
+        ).only(
+            'year',
+            'month',
+            'total',
+            'count',
+            'category__name',
+            'paid_by__username'
+        ).order_by('year', 'month')
+
+    @classmethod
+    def compute_expected(
+        cls,
+        household_id: Optional[int] = None,
+        year: Optional[int] = None,
+        month: Optional[int] = None
+    ) -> dict:
+        """
+        Recomputes the rollup from the raw expenses, keyed like the deltas.
+        """
+        expenses = Expense.objects.all()
+
+        if household_id is not None:
+            expenses = expenses.filter(household_id=household_id)
+
+        if year is not None and month is not None:
+            expenses = expenses.in_month(year, month)
+        elif year is not None:
+            start, end = year_range(year)
+            expenses = expenses.filter(date__gte=start, date__lt=end)
+
+        expected = {}
+
+        for expense in expenses.only('household', 'date', 'amount', 'category', 'paid_by').iterator(chunk_size=2000):
+            cls.get_expense_deltas(expense, expected)
+
+        return expected
+
+
+class SplitRule(models.Model):
+    """
+    How the expenses of a category, or a single expense, are split between
+    the active users. Users without a weight weigh 1, expenses without a
+    rule are split equally. An expense rule wins over its category rule.
+    """
+    category = models.OneToOneField(
+        Category,
+        verbose_name=_('Category'),
+        on_delete=models.CASCADE,
+        related_name='split_rule',
+        blank=True,
+        null=True
+    )
+    expense = models.OneToOneField(
+        Expense,
+        verbose_name=_('Expense'),
+        on_delete=models.CASCADE,
+        related_name='split_rule',
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=(
+                    models.Q(category__isnull=False, expense__isnull=True)
+                    | models.Q(category__isnull=True, expense__isnull=False)
+                ),
+                name='split_rule_category_or_expense'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return str(self.expense or self.category)
+
+    def get_members(self) -> dict[int, 'SplitWeight']:
+        return {weight.user_id: weight for weight in self.weights.all()}
+
+    @classmethod
+    def get_for_expenses(cls, expenses: list[Expense], expense_rules: bool = True) -> dict[int, 'SplitRule']:
+        """
+        Rule applying to each expense of a batch, keyed by expense pk. Without
+        ``expense_rules`` only the category rules are read, e.g. for expenses
+        just inserted, which can't have a rule of their own yet.
+        """
+        condition = models.Q(category_id__in={expense.category_id for expense in expenses})
+
+        if expense_rules:
+            condition |= models.Q(expense_id__in={expense.pk for expense in expenses})
+
+        rules = cls.objects.filter(condition).prefetch_related('weights')
+
+        by_expense = {}
+        by_category = {}
+
+        for rule in rules:
+            if rule.expense_id is not None:
+                by_expense[rule.expense_id] = rule
+            else:
+                by_category[rule.category_id] = rule
+
+        return {
+            expense.pk: rule for expense in expenses
+            if (rule := by_expense.get(expense.pk) or by_category.get(expense.category_id)) is not None
+        }
+
+
+class SplitWeight(models.Model):
+    """
+    Part of a split rule for one user: a weight, a fixed amount taken
+    before the weighted split, or an exclusion.
+    """
+    rule = models.ForeignKey(SplitRule, on_delete=models.CASCADE, related_name='weights')
+    user = models.ForeignKey(User, verbose_name=_('User'), on_delete=models.CASCADE, related_name='split_weights')
+    weight = models.DecimalField(verbose_name=_('Weight'), max_digits=6, decimal_places=2, default=decimal.Decimal(1))
+    fixed_amount = models.DecimalField(
+        verbose_name=_('Fixed amount'),
+        max_digits=8,
+        decimal_places=2,
+        blank=True,
+        null=True
+    )
+    excluded = models.BooleanField(verbose_name=_('Excluded'), default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'user'], name='unique_split_weight'),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.rule} - {self.user} ({self.weight})'
+
+
+class Settlement(models.Model):
+    """
+    One transfer of the plan that settles a month: ``from_user`` pays
+    ``amount`` to ``to_user``.
+    """
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='settlements', db_index=False)
+    year = models.IntegerField()
+    month = models.IntegerField()
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='settlements_to_pay')
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='settlements_to_receive')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['household', 'year', 'month']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.month}/{self.year} {self.from_user} -> {self.to_user} ({self.amount})'
+
+    @classmethod
+    def get_for_user(cls, household_id: int, user: User, year: int, month: int) -> QuerySet['Settlement']:
+        return cls.objects.filter(
+            models.Q(from_user=user) | models.Q(to_user=user),
+            household_id=household_id,
+            year=year,
+            month=month
+        ).select_related(
+            'from_user',
+            'to_user'
+        ).order_by('-amount')
+
+    @classmethod
+    def create_for_month(
+        cls,
+        household_id: int,
+        year: int,
+        month: int,
+        ledgers: list[MonthlyLedger]
+    ) -> list['Settlement']:
+        """
+        Replaces the plan of a household's month. Each user owes what their
+        portions add up to minus what they paid.
+        """
+        balances = {ledger.user_id: ledger.total_amount - ledger.total_paid for ledger in ledgers}
+
+        with transaction.atomic():
+            cls.objects.filter(household_id=household_id, year=year, month=month).delete()
+            return cls.objects.bulk_create([
+                cls(
+                    household_id=household_id,
+                    year=year,
+                    month=month,
+                    from_user_id=debtor,
+                    to_user_id=creditor,
+                    amount=amount
+                )
+                for debtor, creditor, amount in settle(balances)
+            ])
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Cumulative balance of a user at the end of a month: what was carried
+    from the previous months plus what was due minus what was paid.
+    Positive balances are still owed, negative ones were overpaid.
+
+    Snapshots are written for every month with a summary, so the balance
+    as of any month is the latest snapshot up to it.
+    """
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='balance_snapshots', db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_snapshots')
+    year = models.IntegerField()
+    month = models.IntegerField()
+    # month_index(year, month), so "latest up to a month" is one index range
+    period = models.IntegerField()
+    carried = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+    due = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+    paid = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=ZERO)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['household', 'user', 'period'], name='unique_household_user_balance_snapshot'),
+        ]
+        indexes = [
+            models.Index(fields=['household', 'period']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.user} {self.month}/{self.year} ({self.balance})'
+
+    @classmethod
+    def get_balance(cls, household_id: int, user: User, year: int, month: int) -> decimal.Decimal:
+        snapshot = cls.objects.filter(
+            household_id=household_id,
+            user=user,
+            period__lte=month_index(year, month)
+        ).order_by('-period').values_list('balance', flat=True).first()
+
+        return snapshot if snapshot is not None else ZERO
+
+    @classmethod
+    def rebuild(cls, household_id: int, year: int, month: int, user_ids: Optional[list[int]] = None):
+        """
+        Recomputes the snapshots of a household from a month onward, starting
+        from each user's balance at the end of the previous month.
+        """
+        period = month_index(year, month)
+        scope = {'household_id': household_id} if user_ids is None else {
+            'household_id': household_id,
+            'user_id__in': user_ids
+        }
+        summaries = ExpenseShareSummary.objects.filter(
+            models.Q(year__gt=year) | models.Q(year=year, month__gte=month),
+            **scope
+        ).only('user', 'year', 'month', 'to_pay', 'paid_amount').order_by('year', 'month', 'user')
+        # Only the users with summaries to replay need their carried balance
+        balances = dict(User.objects.filter(pk__in=summaries.values('user')).annotate(
+            carried=models.Subquery(
+                cls.objects.filter(
+                    household_id=household_id,
+                    user=models.OuterRef('pk'),
+                    period__lt=period
+                ).order_by('-period').values('balance')[:1]
+            )
+        ).values_list('pk', 'carried'))
+        snapshots = []
+
+        for summary in summaries.iterator(chunk_size=2000):
+            carried = balances.get(summary.user_id) or ZERO
+            balance = carried + summary.to_pay - summary.paid_amount
+            balances[summary.user_id] = balance
+            snapshots.append(cls(
+                household_id=household_id,
+                user_id=summary.user_id,
+                year=summary.year,
+                month=summary.month,
+                period=month_index(summary.year, summary.month),
+                carried=carried,
+                due=summary.to_pay,
+                paid=summary.paid_amount,
+                balance=balance
+            ))
+
+        with transaction.atomic():
+            cls.objects.filter(period__gte=period, **scope).delete()
+            cls.objects.bulk_create(snapshots, batch_size=1000)
+
+
+class Job(models.Model):
+    """
+    Unit of background work run by the ``run_jobs`` worker, see
+    expenses.jobs. Jobs with the same idempotency key are only enqueued once.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    idempotency_key = models.CharField(max_length=200, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=64, blank=True, null=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.name} #{self.pk} ({self.status})'
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable
+import logging
+import time
+
+from django.core.mail import EmailMessage, get_connection
+
+from .models import ExpenseShareSummary, Job
+from .jobs import enqueue_many
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DispatchReport:
+    sent: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+
+def send_batch(messages: list[EmailMessage], retries: int, report: DispatchReport):
+    """
+    Sends the messages one by one over a single SMTP connection so a failure
+    only affects its own recipient. Failed sends reopen the connection and
+    are retried with an exponential backoff.
+    """
+    connection = get_connection()
+
+    try:
+        for message in messages:
+            recipient = ', '.join(message.to)
+
+            for attempt in range(retries + 1):
+                try:
+                    connection.open()
+                    connection.send_messages([message])
+                    report.sent.append(recipient)
+                    break
+                except Exception as error:
+                    connection.close()
+
+                    if attempt == retries:
+                        logger.error('Could not send summary to %s: %s', recipient, error)
+                        report.failed[recipient] = str(error)
+                    else:
+                        time.sleep(0.5 * 2 ** attempt)
+    finally:
+        connection.close()
+
+
+def send_summaries(
+    summaries: Iterable[ExpenseShareSummary],
+    concurrency: int = 1,
+    retries: int = 2
+) -> DispatchReport:
+    report = DispatchReport()
+    start = time.perf_counter()
+
+    # Rendering needs the ORM, so it stays in this thread
+    messages = [summary.build_email() for summary in summaries if summary.user.email]
+    logger.info('Rendered %s summaries in %.2fs', len(messages), time.perf_counter() - start)
+
+    if concurrency <= 1 or len(messages) <= 1:
+        send_batch(messages, retries, report)
+    else:
+        batches = [messages[index::concurrency] for index in range(concurrency)]
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(send_batch, batch, retries, report) for batch in batches if batch]:
+                future.result()
+
+    report.elapsed = time.perf_counter() - start
+    logger.info(
+        'Sent %s summaries, %s failed in %.2fs',
+        len(report.sent),
+        len(report.failed),
+        report.elapsed
+    )
+    return report
+
+
+def enqueue_summaries(summaries: Iterable[ExpenseShareSummary], retries: int = 4) -> int:
+    """
+    Queues the summary emails with a single insert, summaries already
+    queued for their month are skipped. Returns how many were queued.
+    """
+    return enqueue_many([
+        Job(
+            name='expenses.send_summary_email',
+            idempotency_key=summary.get_notification_key(),
+            payload={'user_id': summary.user_id, 'year': summary.year, 'month': summary.month},
+            max_attempts=retries + 1
+        ) for summary in summaries
+    ])
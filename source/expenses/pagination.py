@@ -0,0 +1,66 @@
+from typing import Callable, Optional
+from dataclasses import dataclass
+import datetime
+
+from django.db.models import QuerySet
+
+PAGE_SIZE = 50
+
+
+@dataclass
+class Page:
+    rows: list
+    next_cursor: Optional[str]
+
+
+def encode_cursor(date: datetime.date, pk: int) -> str:
+    return f'{date.isoformat()}_{pk}'
+
+
+def decode_cursor(cursor: str) -> tuple[datetime.date, int]:
+    """
+    Raises ValueError for anything that isn't a cursor made by
+    ``encode_cursor``.
+    """
+    date, pk = cursor.split('_')
+    return datetime.date.fromisoformat(date), int(pk)
+
+
+def keyset_page(
+    queryset: QuerySet,
+    cursor: Optional[str],
+    get_key: Callable[[object], tuple[datetime.date, int]],
+    date_field: str = 'date',
+    id_field: str = 'id',
+    size: int = PAGE_SIZE,
+) -> Page:
+    """
+    Page of ``queryset`` ordered by ``(date_field, id_field)`` that starts
+    right after ``cursor``. Seeks through the index instead of using OFFSET,
+    so any page costs the same as the first one however deep it is.
+    ``get_key`` returns the ``(date, id)`` of a row to build the next cursor.
+    """
+    if cursor:
+        date, pk = decode_cursor(cursor)
+        queryset = queryset.filter(**{f'{date_field}__gte': date}).exclude(**{
+            date_field: date,
+            f'{id_field}__lte': pk,
+        })
+
+    # One extra row tells whether there is a next page without a COUNT
+    rows = list(queryset.order_by(date_field, id_field)[:size + 1])
+    next_cursor = encode_cursor(*get_key(rows[size - 1])) if len(rows) > size else None
+    return Page(rows[:size], next_cursor)
+
+
+def pk_page(queryset: QuerySet, cursor: Optional[str], size: int = PAGE_SIZE) -> Page:
+    """
+    Page of ``queryset`` ordered by primary key that starts right after
+    ``cursor``, for tables without a date to seek on.
+    """
+    if cursor:
+        queryset = queryset.filter(pk__gt=int(cursor))
+
+    rows = list(queryset.order_by('pk')[:size + 1])
+    next_cursor = str(rows[size - 1].pk) if len(rows) > size else None
+    return Page(rows[:size], next_cursor)
@@ -0,0 +1,211 @@
+from typing import Optional
+from dataclasses import dataclass, field
+import re
+
+from django.db import connection
+
+from .models import Expense
+from .dates import month_range
+
+PAGE_SIZE = 20
+FACETS = ('category', 'payer', 'month')
+MAX_TERMS = 8
+# Matches ranked, counted and faceted per search. Broader searches only
+# look at their newest matches, ranking and faceting every match of a
+# common word takes hundreds of ms on a million expenses.
+MAX_HITS = 1000
+
+# Month index (year * 12 + month - 1) of a match, per backend
+MONTH_INDEX = {
+    'sqlite': "CAST(strftime('%%Y', hits.date) AS INTEGER) * 12 + CAST(strftime('%%m', hits.date) AS INTEGER) - 1",
+    'mysql': 'CAST(EXTRACT(YEAR FROM hits.date) * 12 + EXTRACT(MONTH FROM hits.date) - 1 AS SIGNED)',
+}
+DEFAULT_MONTH_INDEX = 'CAST(EXTRACT(YEAR FROM hits.date) * 12 + EXTRACT(MONTH FROM hits.date) - 1 AS INTEGER)'
+
+# Newest matches first, per backend. SQLite only walks the full-text index
+# backwards, without sorting every match, when ordered by its own rowid.
+NEWEST_FIRST = {
+    'sqlite': 'expenses_expense_search.rowid DESC',
+}
+DEFAULT_NEWEST_FIRST = 'expense.id DESC'
+
+
+@dataclass
+class SearchResult:
+    expenses: list[Expense]
+    total: int
+    page: int
+    has_next: bool
+    # Facet name -> [{'id': ..., 'name': ..., 'count': ...}]
+    facets: dict[str, list[dict]] = field(default_factory=dict)
+    # More than MAX_HITS matches: the total, facets and ranking only cover
+    # the newest MAX_HITS
+    capped: bool = False
+
+
+def get_terms(query: str) -> list[str]:
+    """
+    Words of a search box query. Anything else is dropped so user input
+    can never break the full-text query syntax.
+    """
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def get_hits_sql(household_id: int, terms: list[str]) -> tuple[str, list]:
+    """
+    SELECT of the matching expenses of a household with a ``score``, lower
+    is better. SQLite uses the FTS5 table, PostgreSQL the tsvector column
+    with its GIN index and other backends fall back to unranked LIKE lookups.
+    """
+    vendor = connection.vendor
+    columns = 'expense.id, expense.date, expense.category_id, expense.paid_by_id'
+
+    if vendor == 'sqlite':
+        # bm25() counts the matches of every phrase of the query over the
+        # whole index, so the household is filtered by the join rather than
+        # matched as a token: every row of the household would be counted.
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # CROSS JOIN keeps the full-text match as the outer loop, otherwise
+        # date or payer filters make SQLite scan their index and probe the
+        # full-text table once per row
+        return (
+            f'SELECT {columns}, bm25(expenses_expense_search) AS score '
+            'FROM expenses_expense_search '
+            'CROSS JOIN expenses_expense expense ON expense.id = expenses_expense_search.rowid '
+            'WHERE expenses_expense_search MATCH %s AND expense.household_id = %s',
+            [match, household_id]
+        )
+
+    if vendor == 'postgresql':
+        match = ' & '.join(f'{term}:*' for term in terms)
+        return (
+            f'SELECT {columns}, -ts_rank(expense.search_vector, to_tsquery(\'simple\', %s)) AS score '
+            'FROM expenses_expense expense '
+            'WHERE expense.search_vector @@ to_tsquery(\'simple\', %s) AND expense.household_id = %s',
+            [match, match, household_id]
+        )
+
+    conditions = ' AND '.join(
+        '(LOWER(expense.description) LIKE %s OR LOWER(category.name) LIKE %s)' for _ in terms
+    )
+    return (
+        f'SELECT {columns}, 0 AS score '
+        'FROM expenses_expense expense '
+        'JOIN expenses_category category ON category.id = expense.category_id '
+        f'WHERE expense.household_id = %s AND {conditions}',
+        [household_id] + [f'%{term}%' for term in terms for _ in range(2)]
+    )
+
+
+def search_expenses(
+    household_id: int,
+    query: str,
+    page: int = 1,
+    size: int = PAGE_SIZE,
+    from_month: Optional[tuple[int, int]] = None,
+    to_month: Optional[tuple[int, int]] = None,
+    category_id: Optional[int] = None,
+    payer_id: Optional[int] = None,
+    facets: tuple[str, ...] = FACETS,
+) -> SearchResult:
+    """
+    Expenses of a household whose description or category match every word
+    of ``query``, best matches first. A single query returns the page, the number of
+    matches and the requested facet counts; a second one loads the page.
+    Only the newest MAX_HITS matches are ranked and counted.
+    """
+    terms = get_terms(query)
+
+    if not terms:
+        return SearchResult([], 0, page, False, {name: [] for name in facets})
+
+    vendor = connection.vendor
+
+    hits_sql, params = get_hits_sql(household_id, terms)
+    filters = []
+
+    if from_month is not None:
+        filters.append('expense.date >= %s')
+        params.append(month_range(*from_month)[0])
+
+    if to_month is not None:
+        filters.append('expense.date < %s')
+        params.append(month_range(*to_month)[1])
+
+    if category_id is not None:
+        filters.append('expense.category_id = %s')
+        params.append(category_id)
+
+    if payer_id is not None:
+        filters.append('expense.paid_by_id = %s')
+        params.append(payer_id)
+
+    if filters:
+        hits_sql += ' AND ' + ' AND '.join(filters)
+
+    # One extra match tells whether the search was capped
+    hits_sql += f' ORDER BY {NEWEST_FIRST.get(vendor, DEFAULT_NEWEST_FIRST)} LIMIT %s'
+    params.append(MAX_HITS + 1)
+
+    month_index = MONTH_INDEX.get(vendor, DEFAULT_MONTH_INDEX)
+    parts = [
+        # One extra row tells whether there is a next page
+        'SELECT * FROM (SELECT \'hit\' AS kind, id AS ref, NULL AS label, score AS value '
+        'FROM hits ORDER BY score, date DESC, id DESC LIMIT %s OFFSET %s) page',
+        'SELECT \'total\', NULL, NULL, COUNT(*) FROM matches',
+    ]
+    params += [size + 1, (page - 1) * size]
+
+    if 'category' in facets:
+        parts.append(
+            'SELECT \'category\', category.id, category.name, COUNT(*) FROM hits '
+            'JOIN expenses_category category ON category.id = hits.category_id '
+            'GROUP BY category.id, category.name'
+        )
+
+    if 'payer' in facets:
+        parts.append(
+            'SELECT \'payer\', payer.id, payer.username, COUNT(*) FROM hits '
+            'JOIN auth_user payer ON payer.id = hits.paid_by_id '
+            'GROUP BY payer.id, payer.username'
+        )
+
+    if 'month' in facets:
+        parts.append(
+            f'SELECT \'month\', {month_index}, NULL, COUNT(*) FROM hits '
+            'GROUP BY 2'
+        )
+
+    sql = f'WITH matches AS ({hits_sql}), hits AS (SELECT * FROM matches LIMIT {MAX_HITS}) ' + ' UNION ALL '.join(parts)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    hits = sorted((value, position, key) for position, (kind, key, _label, value) in enumerate(rows) if kind == 'hit')
+    total = next(int(value) for kind, _key, _label, value in rows if kind == 'total')
+    result = SearchResult(
+        [],
+        min(total, MAX_HITS),
+        page,
+        len(hits) > size,
+        {name: [] for name in facets},
+        capped=total > MAX_HITS
+    )
+
+    for kind, key, label, value in rows:
+        if kind == 'month':
+            label = '%d-%02d' % (key // 12, key % 12 + 1)
+
+        if kind in result.facets:
+            result.facets[kind].append({'id': key, 'name': label, 'count': int(value)})
+
+    for name in result.facets:
+        result.facets[name].sort(key=lambda facet: (-facet['count'], facet['id']))
+
+    # The union doesn't keep the order of the page, the scores do. The ids
+    # are matches of the household already.
+    ids = [key for _value, _position, key in hits[:size]]
+    expenses = Expense.get_by_ids(ids)
+    result.expenses = [expenses[pk] for pk in ids if pk in expenses]
+    return result
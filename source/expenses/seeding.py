@@ -0,0 +1,177 @@
+from typing import Iterator
+import datetime
+import calendar
+import decimal
+import random
+import math
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+
+from .models import Category, Expense, Household, Membership
+from .cache import invalidate_active_users
+from .aggregates import CENT
+
+# Name, typical amount and whether it is paid once a month
+CATEGORIES = (
+    ('Groceries', 45, False),
+    ('Rent', 900, True),
+    ('Utilities', 120, True),
+    ('Internet', 40, True),
+    ('Transport', 25, False),
+    ('Restaurants', 35, False),
+    ('Health', 60, False),
+    ('Home', 50, False),
+    ('Entertainment', 30, False),
+    ('Pets', 25, False),
+    ('Travel', 250, False),
+    ('Education', 80, False),
+)
+
+# What the expenses of a category are usually about, so searches over
+# seeded descriptions hit a realistic share of the rows
+DESCRIPTIONS = {
+    'Groceries': ('Supermarket', 'Bakery', 'Butcher', 'Farmers market', 'Fruit shop'),
+    'Utilities': ('Electricity bill', 'Water bill', 'Gas bill'),
+    'Internet': ('Fiber internet', 'Mobile plan'),
+    'Transport': ('Bus card', 'Taxi', 'Fuel', 'Parking', 'Train ticket'),
+    'Restaurants': ('Pizza dinner', 'Sushi', 'Coffee shop', 'Burger lunch', 'Tapas'),
+    'Health': ('Pharmacy', 'Dentist', 'Doctor visit', 'Glasses'),
+    'Home': ('Hardware store', 'Cleaning supplies', 'Furniture', 'Plumber'),
+    'Entertainment': ('Cinema tickets', 'Concert', 'Streaming subscription', 'Books'),
+    'Pets': ('Dog food', 'Vet visit', 'Cat litter'),
+    'Travel': ('Hotel', 'Flight tickets', 'Car rental'),
+    'Education': ('Course fee', 'School supplies', 'Language lessons'),
+}
+
+MAX_AMOUNT = decimal.Decimal('999999.99')
+
+
+HOUSEHOLD_PREFIX = 'Seed household '
+
+
+def get_seed_username(household: int, index: int) -> str:
+    # The first household keeps the names it had when there was only one
+    if household == 1:
+        return f'seed-user-{index:03d}'
+
+    return f'seed-{household:05d}-user-{index:03d}'
+
+
+def get_seed_households(count: int, user_count: int) -> list[tuple[Household, list[User]]]:
+    """
+    Seed households with their members. Whatever is missing is created with
+    bulk inserts, so thousands of households take a few queries.
+    """
+    password = make_password('seed')
+    names = [f'{HOUSEHOLD_PREFIX}{number}' for number in range(1, count + 1)]
+    households = {household.name: household for household in Household.objects.filter(name__startswith=HOUSEHOLD_PREFIX)}
+    households.update((household.name, household) for household in Household.objects.bulk_create(
+        [Household(name=name) for name in names if name not in households],
+        batch_size=1000
+    ))
+
+    usernames = [
+        get_seed_username(number, index)
+        for number in range(1, count + 1)
+        for index in range(1, user_count + 1)
+    ]
+    users = {user.username: user for user in User.objects.filter(username__startswith='seed-')}
+    users.update((user.username, user) for user in User.objects.bulk_create(
+        [
+            User(username=username, email=f'{username}@example.com', password=password)
+            for username in usernames if username not in users
+        ],
+        batch_size=1000
+    ))
+
+    seeded = []
+    memberships = []
+
+    for number, name in enumerate(names, start=1):
+        members = [users[get_seed_username(number, index)] for index in range(1, user_count + 1)]
+        memberships.extend(Membership(household=households[name], user=user) for user in members)
+        seeded.append((households[name], members))
+
+    Membership.objects.bulk_create(memberships, batch_size=1000, ignore_conflicts=True)
+    # Bulk inserts send no signals
+    invalidate_active_users()
+    return seeded
+
+
+def get_seed_categories(households: list[Household], count: int) -> dict[int, list[tuple[Category, int, bool]]]:
+    """
+    The first ``count`` categories of each household, keyed by household pk.
+    """
+    kinds = [
+        CATEGORIES[index] if index < len(CATEGORIES) else (f'Category {index + 1}', 30, False)
+        for index in range(count)
+    ]
+    existing = {
+        (category.household_id, category.name): category
+        for category in Category.objects.filter(household__name__startswith=HOUSEHOLD_PREFIX)
+    }
+    existing.update(((category.household_id, category.name), category) for category in Category.objects.bulk_create(
+        [
+            Category(household=household, name=name)
+            for household in households
+            for name, _typical, _monthly in kinds
+            if (household.pk, name) not in existing
+        ],
+        batch_size=1000
+    ))
+
+    return {
+        household.pk: [(existing[household.pk, name], typical, monthly) for name, typical, monthly in kinds]
+        for household in households
+    }
+
+
+def iter_seed_expenses(
+    household: Household,
+    users: list[User],
+    categories: list[tuple[Category, int, bool]],
+    start: tuple[int, int],
+    months: int,
+    per_month: int,
+    seed: int,
+) -> Iterator[Expense]:
+    """
+    Yields the expenses of a household month by month. The same arguments
+    always produce the same expenses.
+    """
+    rng = random.Random(seed)
+    # Some people in a household pay much more often than others
+    payer_weights = [1 / (index + 1) for index in range(len(users))]
+    everyday = [category for category in categories if not category[2]] or categories
+    year, month = start
+
+    for _ in range(months):
+        days = calendar.monthrange(year, month)[1]
+
+        for category, typical, monthly in categories:
+            if monthly:
+                date = datetime.date(year, month, 1)
+                yield build_expense(rng, household, users, payer_weights, category, typical, date)
+
+        for _ in range(per_month):
+            category, typical, _monthly = rng.choice(everyday)
+            date = datetime.date(year, month, rng.randint(1, days))
+            yield build_expense(rng, household, users, payer_weights, category, typical, date)
+
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def build_expense(rng, household, users, payer_weights, category, typical, date) -> Expense:
+    amount = decimal.Decimal(rng.lognormvariate(math.log(typical), 0.6)).quantize(CENT)
+    paid_by = rng.choices(users, payer_weights)[0]
+
+    return Expense(
+        household=household,
+        paid_by=paid_by,
+        created_by=paid_by,
+        category=category,
+        amount=min(max(amount, CENT), MAX_AMOUNT),
+        description=f'{rng.choice(DESCRIPTIONS.get(category.name, (category.name,)))} {date.isoformat()}',
+        date=date,
+    )
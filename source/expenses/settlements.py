@@ -0,0 +1,105 @@
+from typing import Mapping
+import decimal
+import heapq
+
+from .splits import from_cents, to_cents
+
+# Above this many members with a balance the exact solver (2^n states)
+# is too slow and the greedy plan is used instead
+EXACT_MAX_MEMBERS = 12
+
+Transfer = tuple[int, int, decimal.Decimal]
+
+
+def settle(balances: Mapping[int, decimal.Decimal]) -> list[Transfer]:
+    """
+    Who pays whom to clear the month. ``balances`` maps each user to what
+    they owe (positive) or are owed (negative). Returns
+    ``(debtor_id, creditor_id, amount)`` transfers.
+
+    Small groups get a plan with the fewest possible transfers, larger ones
+    a greedy plan with at most one transfer less than the members involved.
+    """
+    cents = {user_id: to_cents(balance) for user_id, balance in balances.items() if to_cents(balance)}
+
+    if len(cents) <= EXACT_MAX_MEMBERS:
+        groups = split_zero_sum_groups(cents)
+    else:
+        groups = [cents]
+
+    return [
+        (debtor, creditor, from_cents(amount))
+        for group in groups
+        for debtor, creditor, amount in settle_greedy(group)
+    ]
+
+
+def settle_greedy(cents: Mapping[int, int]) -> list[tuple[int, int, int]]:
+    """
+    Repeatedly matches the largest debtor with the largest creditor. Each
+    transfer clears at least one of them, O(n log n).
+    """
+    debtors = [(-amount, user_id) for user_id, amount in cents.items() if amount > 0]
+    creditors = [(amount, user_id) for user_id, amount in cents.items() if amount < 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+    transfers = []
+
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+        transfers.append((debtor, creditor, amount))
+
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+
+    return transfers
+
+
+def split_zero_sum_groups(cents: Mapping[int, int]) -> list[dict[int, int]]:
+    """
+    Partitions the members into as many groups settling among themselves
+    as possible. A group of k members needs k - 1 transfers, so this
+    minimizes the total. Dynamic programming over subsets, O(2^n * n).
+    """
+    members = list(cents)
+    size = len(members)
+    full = (1 << size) - 1
+    sums = [0] * (full + 1)
+    best = [0] * (full + 1)
+
+    for mask in range(1, full + 1):
+        lowest = (mask & -mask).bit_length() - 1
+        sums[mask] = sums[mask & (mask - 1)] + cents[members[lowest]]
+        best[mask] = max(
+            best[mask & ~(1 << index)] for index in range(size) if mask >> index & 1
+        ) + (sums[mask] == 0)
+
+    # Walk back from the full set, every time the remaining members add up
+    # to zero the members removed since the last cut form a group
+    groups = []
+    group = {}
+    mask = full
+
+    while mask:
+        bonus = sums[mask] == 0
+
+        if bonus and group:
+            groups.append(group)
+            group = {}
+
+        index = next(
+            index for index in range(size)
+            if mask >> index & 1 and best[mask] == best[mask & ~(1 << index)] + bonus
+        )
+        group[members[index]] = cents[members[index]]
+        mask &= ~(1 << index)
+
+    if group:
+        groups.append(group)
+
+    return groups
@@ -0,0 +1,53 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.dispatch import receiver
+
+from .models import Expense, Membership, SplitRule, SplitWeight
+from .cache import invalidate_active_users
+
+
+@receiver(pre_delete, sender=Expense)
+def remove_expense_from_aggregates(sender, instance: Expense, **kwargs):
+    # Runs inside the deletion transaction while the shares still exist
+    instance.apply_aggregates(sign=-1)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_active_users(sender, instance: User, update_fields=None, **kwargs):
+    # Logins only touch last_login, which doesn't change the split
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+
+    invalidate_active_users()
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def refresh_household_users(sender, instance: Membership, **kwargs):
+    invalidate_active_users()
+
+
+@receiver(post_save, sender=SplitRule)
+@receiver(post_delete, sender=SplitRule)
+@receiver(post_save, sender=SplitWeight)
+@receiver(post_delete, sender=SplitWeight)
+def resplit_expense(sender, instance, origin=None, **kwargs):
+    # Rules deleted along with their expense, category or user have
+    # nothing left to resplit
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+
+    if origin is not None and origin_model not in (SplitRule, SplitWeight):
+        return
+
+    rule = instance if sender is SplitRule else SplitRule.objects.filter(pk=instance.rule_id).first()
+
+    # Category rules only apply to the expenses created afterwards
+    if rule is None or rule.expense_id is None:
+        return
+
+    expense = Expense.objects.filter(pk=rule.expense_id).first()
+
+    if expense is not None:
+        expense.resplit()
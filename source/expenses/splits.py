@@ -0,0 +1,108 @@
+from typing import Mapping, Optional, Protocol
+from fractions import Fraction
+import decimal
+import math
+
+from .aggregates import CENT
+
+
+class Member(Protocol):
+    weight: decimal.Decimal
+    fixed_amount: Optional[decimal.Decimal]
+    excluded: bool
+
+
+def to_cents(amount: decimal.Decimal) -> int:
+    return int(amount.quantize(CENT) * 100)
+
+
+def from_cents(cents: int) -> decimal.Decimal:
+    return decimal.Decimal(cents).scaleb(-2)
+
+
+def largest_remainder(cents: int, weights: Mapping[int, Fraction]) -> dict[int, int]:
+    """
+    Splits ``cents`` proportionally to ``weights`` without losing any cent:
+    everyone gets the floor of their quota and the cents left go to the
+    largest remainders. Ties keep the order of ``weights``.
+    """
+    total_weight = sum(weights.values())
+
+    if cents <= 0 or total_weight <= 0:
+        return dict.fromkeys(weights, 0)
+
+    quotas = {key: cents * weight / total_weight for key, weight in weights.items()}
+    allocated = {key: math.floor(quota) for key, quota in quotas.items()}
+    leftover = cents - sum(allocated.values())
+
+    for key in sorted(quotas, key=lambda key: quotas[key] - allocated[key], reverse=True)[:leftover]:
+        allocated[key] += 1
+
+    return allocated
+
+
+def split_amount(
+    amount: decimal.Decimal,
+    user_ids: list[int],
+    members: Optional[Mapping[int, Member]] = None,
+    payer_id: Optional[int] = None,
+) -> dict[int, decimal.Decimal]:
+    """
+    Portion of ``amount`` that belongs to each of ``user_ids``. Fixed
+    amounts are taken first and the rest is split by weight, users without
+    a member entry weigh 1 and excluded users get nothing. Whatever can't
+    be assigned to anyone stays with the payer.
+
+    The portions always add up to ``amount`` exactly.
+    """
+    members = members or {}
+    cents = to_cents(amount)
+
+    if not members:
+        # Equal split, the same cents largest_remainder() hands out: the
+        # first users in order get the leftover cents
+        allocation = dict.fromkeys(user_ids, 0) if cents >= 0 else {}
+
+        if cents > 0 and allocation:
+            base, extra = divmod(cents, len(allocation))
+
+            for index, user_id in enumerate(allocation):
+                allocation[user_id] = base + (index < extra)
+
+        leftover = cents - sum(allocation.values())
+
+        if leftover and payer_id is not None:
+            allocation[payer_id] = allocation.get(payer_id, 0) + leftover
+
+        return {user_id: from_cents(value) for user_id, value in allocation.items()}
+
+    fixed: dict[int, Fraction] = {}
+    weighted: dict[int, Fraction] = {}
+
+    for user_id in user_ids:
+        member = members.get(user_id)
+
+        if member is None:
+            weighted[user_id] = Fraction(1)
+        elif member.excluded:
+            continue
+        elif member.fixed_amount is not None:
+            fixed[user_id] = Fraction(to_cents(member.fixed_amount))
+        elif member.weight > 0:
+            weighted[user_id] = Fraction(member.weight)
+
+    fixed_cents = sum(fixed.values())
+
+    if fixed_cents > cents:
+        # Fixed amounts larger than the expense are scaled down to fit
+        allocation = largest_remainder(cents, fixed)
+    else:
+        allocation = {key: int(value) for key, value in fixed.items()}
+        allocation.update(largest_remainder(cents - int(fixed_cents), weighted))
+
+    leftover = cents - sum(allocation.values())
+
+    if leftover and payer_id is not None:
+        allocation[payer_id] = allocation.get(payer_id, 0) + leftover
+
+    return {user_id: from_cents(value) for user_id, value in allocation.items()}
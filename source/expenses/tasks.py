@@ -0,0 +1,17 @@
+from .models import ExpenseShareSummary
+from .jobs import task
+
+
+@task('expenses.send_summary_email')
+def send_summary_email(user_id: int, year: int, month: int):
+    summary = ExpenseShareSummary.objects.filter(
+        user_id=user_id,
+        year=year,
+        month=month
+    ).select_related('user').first()
+
+    # The month may have been recalculated without this user since
+    if summary is None or not summary.user.email:
+        return
+
+    summary.build_email().send(fail_silently=False)
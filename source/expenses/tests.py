@@ -1,3 +1,1243 @@
-from django.test import TestCase
+from typing import Optional
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
+import datetime
+import base64
+import tempfile
+import zipfile
+import decimal
+import smtplib
+import json
+import csv
+import io
+import os
 
-# Create your tests here.
+from django.core.management.base import CommandError
+from django.core.mail.backends import smtp
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.core import mail
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+
+from .management.commands.profile_imports import profile
+from .cache import get_active_users, get_active_users_version
+from .checks import check_shared_cache
+from .exports import iter_xlsx
+from . import instrumentation
+from .notifications import enqueue_summaries, send_summaries
+from .pagination import keyset_page
+from .search import search_expenses
+from .settlements import EXACT_MAX_MEMBERS, settle
+from .splits import split_amount
+from .aggregates import ZERO
+from .models import BalanceSnapshot, Category, Expense, ExpenseShare, ExpenseShareSummary, Household, Job, Membership, MonthlyLedger, MonthlyRollup, Settlement, SplitRule, SplitWeight
+
+
+def create_household(name: str = 'Home', usernames: tuple[str, ...] = ('ana', 'bob', 'carl')):
+    household = Household.objects.create(name=name)
+    users = []
+
+    for username in usernames:
+        user = User.objects.create_user(username, f'{username}@example.com', 'secret')
+        Membership.objects.create(household=household, user=user)
+        users.append(user)
+
+    # The active users are invalidated on commit, which a TestCase never
+    # does, and a rolled back household id can be reused by the next test
+    cache.clear()
+    return household, users
+
+
+def create_expenses(household: Household, users: list[User], category: Category, year: int, month: int, count: int):
+    for number in range(count):
+        paid_by = users[number % len(users)]
+        Expense.objects.create(
+            household=household,
+            category=category,
+            paid_by=paid_by,
+            created_by=paid_by,
+            amount=decimal.Decimal('10.00') + number,
+            description=f'Expense {number}',
+            date=datetime.date(year, month, number % 28 + 1),
+        )
+
+
+def get_index_name(model, fields: list[str]) -> str:
+    return next(index.name for index in model._meta.indexes if index.fields == fields)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Checks SQLite query plans')
+class MonthIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        category = Category.objects.create(household=cls.household, name='Groceries')
+
+        for month in (4, 5, 6):
+            create_expenses(cls.household, cls.users, category, 2023, month, 10)
+
+    def assertSearchesIndex(self, queryset, table: str, index: str):
+        plan = queryset.explain()
+        self.assertRegex(plan, rf'SEARCH {table} USING (COVERING )?INDEX {index}\b')
+        self.assertNotRegex(plan, rf'SCAN {table}\b')
+
+    def test_month_is_a_date_range(self):
+        plan = Expense.get_by_month(self.household.pk, 2023, 5).explain()
+        self.assertRegex(plan, r'SEARCH expenses_expense USING (COVERING )?INDEX \w+ \(household_id=\? AND date>\? AND date<\?\)')
+
+    def test_payer_month_uses_date_paid_by_index(self):
+        queryset = Expense.objects.filter(household=self.household, paid_by=self.users[0]).in_month(2023, 5)
+        self.assertSearchesIndex(
+            queryset.values('pk'),
+            'expenses_expense',
+            get_index_name(Expense, ['household', 'date', 'paid_by'])
+        )
+
+    def test_user_shares_use_user_expense_index(self):
+        self.assertSearchesIndex(
+            ExpenseShare.get_by_month(self.household.pk, 2023, 5, self.users[0]),
+            'expenses_expenseshare',
+            get_index_name(ExpenseShare, ['household', 'user', 'expense'])
+        )
+
+
+class QueryCountTests(TestCase):
+    """
+    The lists and the summary email make the same number of queries
+    whatever the size of the month.
+    """
+    SMALL_MONTH = (2023, 4)
+    LARGE_MONTH = (2023, 5)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        groceries = Category.objects.create(household=cls.household, name='Groceries')
+        transport = Category.objects.create(household=cls.household, name='Transport')
+
+        create_expenses(cls.household, cls.users, groceries, *cls.SMALL_MONTH, 3)
+        create_expenses(cls.household, cls.users, groceries, *cls.LARGE_MONTH, 60)
+        create_expenses(cls.household, cls.users, transport, *cls.LARGE_MONTH, 60)
+
+        for year, month in (cls.SMALL_MONTH, cls.LARGE_MONTH):
+            ExpenseShare.calc_monthly_expense(cls.household.pk, year, month)
+
+    def setUp(self):
+        # Rendered months are cached across requests
+        cache.clear()
+        self.client.force_login(self.users[0])
+
+    def assertMonthQueries(self, url: str, count: int):
+        for year, month in (self.SMALL_MONTH, self.LARGE_MONTH):
+            with self.subTest(month=month), self.assertNumQueries(count):
+                response = self.client.get(url, {'year': year, 'month': month})
+                self.assertEqual(response.status_code, 200)
+
+    def test_expense_list(self):
+        self.assertMonthQueries(reverse('expense-list'), 5)
+
+    def test_expense_share_list(self):
+        self.assertMonthQueries(reverse('expense-user-list'), 7)
+
+    def test_email_body(self):
+        for year, month in (self.SMALL_MONTH, self.LARGE_MONTH):
+            summary = ExpenseShareSummary.objects.select_related('user').get(
+                household=self.household,
+                user=self.users[0],
+                year=year,
+                month=month
+            )
+
+            with self.subTest(month=month), self.assertNumQueries(4):
+                summary.get_email_body()
+
+
+class ReconcileLedgerTests(TestCase):
+    def test_month_requires_year(self):
+        with self.assertRaisesMessage(CommandError, '--month requires --year'):
+            call_command('reconcile_ledger', month=5)
+
+
+class ImportExpensesTests(TestCase):
+    ROWS = [
+        '2023-05-01,30.00,Groceries,ana,Market',
+        '2023-05-02,10.01,Groceries,bob,Bakery',
+        '2023-05-03,7.50,Transport,carl,Bus',
+        '2023-06-01,99.99,Groceries,ana,Market',
+        '2023-06-02,12.00,Transport,bob,Taxi',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        Category.objects.create(household=cls.household, name='Groceries')
+
+    def import_rows(self, rows: list[str], **options):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('date,amount,category,paid_by,description\n' + '\n'.join(rows) + '\n')
+
+        self.addCleanup(os.remove, file.name)
+        call_command('import_expenses', file.name, chunk_size=2, stdout=io.StringIO(), stderr=io.StringIO(), **options)
+
+    def test_imports_every_chunk_with_shares_and_aggregates(self):
+        self.import_rows(self.ROWS, create_categories=True)
+
+        self.assertEqual(Expense.objects.count(), 5)
+        self.assertEqual(ExpenseShare.objects.count(), 15)
+        self.assertEqual(MonthlyLedger.get_monthly_total(self.household.pk, 2023, 5), decimal.Decimal('47.51'))
+
+        for model in (MonthlyLedger, MonthlyRollup):
+            with self.subTest(model=model.__name__):
+                expected = model.compute_expected(self.household.pk)
+                stored = {
+                    tuple(getattr(row, field) for field in model.KEY_FIELDS): {
+                        field: getattr(row, field) for field in model.DELTA_FIELDS
+                    }
+                    for row in model.objects.filter(household=self.household)
+                }
+                self.assertEqual(stored, expected)
+
+    def test_imports_without_pks_from_bulk_inserts(self):
+        # e.g. MySQL, the pks are read back row by row
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            self.import_rows(self.ROWS, create_categories=True)
+
+        self.assertEqual(
+            sorted(Expense.objects.values_list('description', flat=True)),
+            ['Bakery', 'Bus', 'Market', 'Market', 'Taxi']
+        )
+        self.assertEqual(ExpenseShare.objects.count(), 15)
+        self.assertEqual(
+            set(ExpenseShare.objects.values_list('expense', flat=True)),
+            set(Expense.objects.values_list('pk', flat=True))
+        )
+        self.assertEqual(MonthlyLedger.get_monthly_total(self.household.pk, 2023, 5), decimal.Decimal('47.51'))
+
+    def test_dry_run_rolls_back_every_chunk(self):
+        self.import_rows(self.ROWS, create_categories=True, dry_run=True)
+
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(ExpenseShare.objects.exists())
+        self.assertFalse(MonthlyLedger.objects.exists())
+        self.assertFalse(Category.objects.filter(name='Transport').exists())
+
+    def test_dry_run_rolls_back_default_category(self):
+        self.import_rows(['2023-05-01,30.00,,ana,Market'], create_categories=True, category='Savings', dry_run=True)
+
+        self.assertFalse(Category.objects.filter(name='Savings').exists())
+
+    def test_default_category_must_exist(self):
+        with self.assertRaisesMessage(CommandError, "Category 'Savings' does not exist"):
+            self.import_rows(self.ROWS, category='Savings')
+
+
+class SetPaidTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        category = Category.objects.create(household=cls.household, name='Groceries')
+        create_expenses(cls.household, cls.users, category, 2023, 5, 6)
+        ExpenseShare.calc_monthly_expense(cls.household.pk, 2023, 5)
+
+    def get_summary(self, user: User) -> ExpenseShareSummary:
+        return ExpenseShareSummary.objects.get(household=self.household, user=user, year=2023, month=5)
+
+    def get_balance(self, user: User) -> decimal.Decimal:
+        return BalanceSnapshot.get_balance(self.household.pk, user, 2023, 5)
+
+    def test_debtor_pays_what_is_left(self):
+        summary = self.get_summary(self.users[0])
+        summary.register_payment(decimal.Decimal('0.50'))
+        summary.set_paid()
+
+        summary.refresh_from_db()
+        self.assertEqual(summary.paid_amount, summary.to_pay)
+        self.assertTrue(summary.paid)
+        self.assertEqual(self.get_balance(self.users[0]), ZERO)
+
+    def test_creditor_is_left_untouched(self):
+        ExpenseShareSummary.objects.filter(household=self.household, user=self.users[2]).update(to_pay=decimal.Decimal('-2.00'))
+        summary = self.get_summary(self.users[2])
+        balance = self.get_balance(self.users[2])
+        summary.set_paid()
+
+        summary.refresh_from_db()
+        self.assertEqual(summary.paid_amount, ZERO)
+        self.assertEqual(self.get_balance(self.users[2]), balance)
+
+
+class NotificationKeyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        cls.category = Category.objects.create(household=cls.household, name='Groceries')
+        create_expenses(cls.household, cls.users, cls.category, 2023, 5, 6)
+        ExpenseShare.calc_monthly_expense(cls.household.pk, 2023, 5)
+
+    def get_summaries(self):
+        return ExpenseShareSummary.objects.filter(household=self.household, year=2023, month=5)
+
+    def test_same_summary_is_queued_once(self):
+        self.assertEqual(enqueue_summaries(self.get_summaries()), 3)
+        self.assertEqual(enqueue_summaries(self.get_summaries()), 0)
+
+    def test_changed_month_is_queued_again(self):
+        enqueue_summaries(self.get_summaries())
+        create_expenses(self.household, self.users, self.category, 2023, 5, 1)
+        ExpenseShare.calc_monthly_expense(self.household.pk, 2023, 5)
+
+        self.assertEqual(enqueue_summaries(self.get_summaries()), 3)
+
+    def test_unchanged_month_is_not_queued_again(self):
+        enqueue_summaries(self.get_summaries())
+        ExpenseShare.calc_monthly_expense(self.household.pk, 2023, 5)
+
+        self.assertEqual(enqueue_summaries(self.get_summaries()), 0)
+
+    def test_payment_changes_the_key(self):
+        summary = self.get_summaries().get(user=self.users[0])
+        key = summary.get_notification_key()
+        summary.register_payment(decimal.Decimal('1.00'))
+
+        self.assertNotEqual(summary.get_notification_key(), key)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        category = Category.objects.create(household=cls.household, name='Groceries')
+        create_expenses(cls.household, cls.users, category, 2023, 5, 6)
+
+        other, other_users = create_household('Other', ('dana',))
+        create_expenses(other, other_users, Category.objects.create(household=other, name='Groceries'), 2023, 5, 3)
+
+    def test_searches_one_household(self):
+        result = search_expenses(self.household.pk, 'groc')
+
+        self.assertEqual(result.total, 6)
+        self.assertFalse(result.capped)
+        self.assertEqual(Expense.objects.filter(household=self.household, pk__in=[expense.pk for expense in result.expenses]).count(), 6)
+        self.assertEqual(result.facets['month'], [{'id': 2023 * 12 + 4, 'name': '2023-05', 'count': 6}])
+        self.assertEqual([facet['count'] for facet in result.facets['payer']], [2, 2, 2])
+
+    def test_broad_search_only_covers_newest_matches(self):
+        newest = list(Expense.objects.filter(household=self.household).order_by('-pk').values_list('pk', flat=True)[:4])
+
+        with mock.patch('expenses.search.MAX_HITS', 4):
+            result = search_expenses(self.household.pk, 'groceries', size=10)
+
+        self.assertEqual(result.total, 4)
+        self.assertTrue(result.capped)
+        self.assertEqual(sorted(expense.pk for expense in result.expenses), sorted(newest))
+        self.assertEqual(sum(facet['count'] for facet in result.facets['category']), 4)
+
+
+class CalcMonthTotalTests(TestCase):
+    def setUp(self):
+        self.household, self.users = create_household()
+        category = Category.objects.create(household=self.household, name='Groceries')
+        create_expenses(self.household, self.users, category, 2023, 5, 6)
+
+    def test_reports_totals_and_throughput(self):
+        stdout = io.StringIO()
+        call_command('calc_month_total', '--from', '2023-05', '--no-notify', stdout=stdout)
+
+        self.assertRegex(
+            stdout.getvalue(),
+            r'^Calculated 1 household months and 3 summaries in [\d.]+s \([\d.]+ household months/s\)\n$'
+        )
+
+    def test_reports_batches_when_verbose(self):
+        stdout = io.StringIO()
+        call_command('calc_month_total', '--from', '2023-05', '--no-notify', verbosity=2, stdout=stdout)
+
+        self.assertIn('Totals of 1 household(s) for 5/2023 calculated in', stdout.getvalue())
+
+    def test_backfill_only_notifies_with_notify(self):
+        call_command('calc_month_total', '--from', '2023-05', stdout=io.StringIO())
+        self.assertFalse(Job.objects.exists())
+
+        call_command('calc_month_total', '--from', '2023-05', '--notify', stdout=io.StringIO())
+        self.assertEqual(Job.objects.filter(name='expenses.send_summary_email').count(), 3)
+
+    def test_current_month_is_notified(self):
+        category = Category.objects.get(household=self.household)
+        now = timezone.now()
+        create_expenses(self.household, self.users, category, now.year, now.month, 3)
+
+        call_command('calc_month_total', '--from', '2023-05', '--to', now.strftime('%Y-%m'), stdout=io.StringIO())
+
+        self.assertEqual(
+            sorted(Job.objects.values_list('payload__month', 'payload__year')),
+            [(now.month, now.year)] * 3
+        )
+
+    def test_concurrency_requires_sync(self):
+        with self.assertRaisesMessage(CommandError, '--concurrency only applies with --sync'):
+            call_command('calc_month_total', '--concurrency', '4', stdout=io.StringIO())
+
+
+class CalcMonthTotalNotifyTests(TransactionTestCase):
+    """
+    run_jobs sends from worker threads, which only see committed data.
+    """
+    def test_rerun_sends_one_email_per_user(self):
+        household, users = create_household()
+        category = Category.objects.create(household=household, name='Groceries')
+        create_expenses(household, users, category, 2023, 5, 6)
+
+        for _ in range(2):
+            call_command('calc_month_total', '--from', '2023-05', '--notify', stdout=io.StringIO())
+
+        call_command('run_jobs', once=True, stdout=io.StringIO())
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [user.email for user in users])
+
+
+class ActiveUsersCacheTests(TestCase):
+    def test_version_is_bumped_on_commit(self):
+        household, users = create_household()
+        self.assertEqual(get_active_users({household.pk})[household.pk], users)
+        version = get_active_users_version()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            users[0].is_active = False
+            users[0].save()
+            # Another process reloading now would get the uncommitted users
+            self.assertEqual(get_active_users_version(), version)
+
+        for callback in callbacks:
+            callback()
+
+        self.assertNotEqual(get_active_users_version(), version)
+        self.assertEqual(get_active_users({household.pk})[household.pk], users[1:])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_deploy_check_warns_about_local_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['expenses.W001'])
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True, INSTRUMENTATION_METRICS_TOKEN='scrape-token')
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('expenses.instrumentation.registry', instrumentation.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def test_unresolved_paths_share_one_route(self):
+        middleware = instrumentation.InstrumentationMiddleware(lambda request: HttpResponse(status=404))
+
+        for path in ('/wp-login.php', '/.env', '/admin/../etc/passwd'):
+            request = self.factory.get(path)
+            request.resolver_match = None
+            middleware(request)
+
+        self.assertEqual(list(self.registry.totals), [instrumentation.UNRESOLVED_ROUTE])
+        self.assertEqual(self.registry.totals[instrumentation.UNRESOLVED_ROUTE]['requests'], 3)
+
+    def test_metrics_require_token_or_staff(self):
+        staff = User.objects.create_user('admin', is_staff=True)
+        member = User.objects.create_user('member')
+
+        for user, headers, status in (
+            (AnonymousUser(), {}, 403),
+            (AnonymousUser(), {'Authorization': 'Bearer wrong'}, 403),
+            (member, {}, 403),
+            (AnonymousUser(), {'Authorization': 'Bearer scrape-token'}, 200),
+            (staff, {}, 200),
+        ):
+            with self.subTest(user=str(user), headers=headers):
+                request = self.factory.get('/metrics', headers=headers)
+                request.user = user
+                self.assertEqual(instrumentation.metrics_view(request).status_code, status)
+
+
+class MoveHouseholdTests(TestCase):
+    def test_user_keeps_ledger_and_balance_in_both_households(self):
+        old, users = create_household()
+        new, new_users = create_household('New', ('dana',))
+        ana = users[0]
+        create_expenses(old, users, Category.objects.create(household=old, name='Groceries'), 2023, 5, 3)
+
+        Membership.objects.filter(user=ana).update(household=new)
+        cache.clear()
+        Expense.objects.create(
+            household=new,
+            category=Category.objects.create(household=new, name='Groceries'),
+            paid_by=ana,
+            created_by=ana,
+            amount=decimal.Decimal('40.00'),
+            date=datetime.date(2023, 5, 20),
+        )
+
+        for household in (old, new):
+            ExpenseShare.calc_monthly_expense(household.pk, 2023, 5)
+
+        ledger = MonthlyLedger.objects.get(household=new, user=ana, year=2023, month=5)
+        self.assertEqual(ledger.total_paid, decimal.Decimal('40.00'))
+        self.assertEqual(ledger.total_amount, decimal.Decimal('20.00'))
+        self.assertTrue(MonthlyLedger.objects.filter(household=old, user=ana, year=2023, month=5).exists())
+        self.assertEqual(BalanceSnapshot.objects.filter(user=ana, year=2023, month=5).count(), 2)
+
+
+class SplitAmountTests(SimpleTestCase):
+    def test_shares_add_up_to_the_amount(self):
+        for amount in ('0.01', '0.02', '10.00', '10.01', '99.99', '1234.57'):
+            for size in (1, 2, 3, 7):
+                with self.subTest(amount=amount, size=size):
+                    shares = split_amount(decimal.Decimal(amount), list(range(1, size + 1)))
+                    self.assertEqual(sum(shares.values()), decimal.Decimal(amount))
+
+    def test_odd_cents_go_to_the_first_users(self):
+        self.assertEqual(split_amount(decimal.Decimal('10.00'), [1, 2, 3]), {
+            1: decimal.Decimal('3.34'),
+            2: decimal.Decimal('3.33'),
+            3: decimal.Decimal('3.33'),
+        })
+
+    def test_splits_by_weight(self):
+        # User 3 has no weight and weighs 1
+        members = {1: SplitWeight(weight=decimal.Decimal(2)), 2: SplitWeight(weight=decimal.Decimal(1))}
+
+        self.assertEqual(split_amount(decimal.Decimal('10.01'), [1, 2, 3], members), {
+            1: decimal.Decimal('5.01'),
+            2: decimal.Decimal('2.50'),
+            3: decimal.Decimal('2.50'),
+        })
+
+    def test_fixed_amounts_are_taken_first(self):
+        members = {1: SplitWeight(fixed_amount=decimal.Decimal('4.00')), 2: SplitWeight(excluded=True)}
+
+        self.assertEqual(split_amount(decimal.Decimal('10.00'), [1, 2, 3], members), {
+            1: decimal.Decimal('4.00'),
+            3: decimal.Decimal('6.00'),
+        })
+
+    def test_unassigned_amount_stays_with_the_payer(self):
+        members = {1: SplitWeight(excluded=True), 2: SplitWeight(excluded=True)}
+
+        self.assertEqual(split_amount(decimal.Decimal('10.00'), [1, 2], members, payer_id=1), {1: decimal.Decimal('10.00')})
+
+
+class SettleTests(SimpleTestCase):
+    # Two groups settle among themselves: 1 with 3 and 4, 2 with 5. The
+    # greedy plan pays 5 from 1 first and needs a transfer more.
+    BALANCES = {
+        1: decimal.Decimal('4.00'),
+        2: decimal.Decimal('3.00'),
+        3: decimal.Decimal('-2.00'),
+        4: decimal.Decimal('-2.00'),
+        5: decimal.Decimal('-3.00'),
+    }
+
+    def assertSettles(self, balances: dict, transfers: list):
+        remaining = dict(balances)
+
+        for debtor, creditor, amount in transfers:
+            self.assertGreater(amount, ZERO)
+            remaining[debtor] -= amount
+            remaining[creditor] += amount
+
+        self.assertEqual(set(remaining.values()), {ZERO})
+
+    def test_transfers_net_every_balance_to_zero(self):
+        for size in (2, EXACT_MAX_MEMBERS, EXACT_MAX_MEMBERS + 2):
+            with self.subTest(size=size):
+                balances = {user_id: decimal.Decimal(user_id * 7 % 13) - 6 for user_id in range(1, size)}
+                balances[size] = -sum(balances.values())
+                self.assertSettles(balances, settle(balances))
+
+    def test_small_groups_get_the_fewest_transfers(self):
+        transfers = settle(self.BALANCES)
+
+        self.assertSettles(self.BALANCES, transfers)
+        self.assertEqual(len(transfers), 3)
+
+    def test_large_groups_get_the_greedy_plan(self):
+        with mock.patch('expenses.settlements.EXACT_MAX_MEMBERS', len(self.BALANCES) - 1):
+            transfers = settle(self.BALANCES)
+
+        self.assertSettles(self.BALANCES, transfers)
+        self.assertEqual(len(transfers), 4)
+
+    def test_greedy_plan_needs_less_transfers_than_members(self):
+        balances = {user_id: decimal.Decimal(f'{user_id}.{user_id:02d}') for user_id in range(1, EXACT_MAX_MEMBERS * 2)}
+        balances[0] = -sum(balances.values())
+
+        transfers = settle(balances)
+
+        self.assertSettles(balances, transfers)
+        self.assertLess(len(transfers), len(balances))
+
+
+class PerUserMonthlyTotalTests(TestCase):
+    def test_follows_the_split_weights(self):
+        household, users = create_household()
+        category = Category.objects.create(household=household, name='Groceries')
+        rule = SplitRule.objects.create(category=category)
+        SplitWeight.objects.create(rule=rule, user=users[0], weight=2)
+        create_expenses(household, users, category, 2023, 5, 3)
+
+        # 10 + 11 + 12 split 2:1:1
+        self.assertEqual(ExpenseShare.get_per_user_monthly_total(household.pk, 2023, 5), {
+            users[0].pk: decimal.Decimal('16.50'),
+            users[1].pk: decimal.Decimal('8.25'),
+            users[2].pk: decimal.Decimal('8.25'),
+        })
+
+    def test_month_without_active_users(self):
+        household, users = create_household()
+        category = Category.objects.create(household=household, name='Groceries')
+        create_expenses(household, users, category, 2023, 5, 3)
+        User.objects.filter(pk__in=[user.pk for user in users]).update(is_active=False)
+
+        self.assertEqual(ExpenseShare.get_per_user_monthly_total(household.pk, 2023, 5), {})
+        self.assertEqual(ExpenseShare.get_per_user_monthly_total(household.pk, 2023, 6), {})
+
+
+class ExpenseListTests(TestCase):
+    """
+    60 expenses in May over 28 days, so most dates are shared by two or
+    three expenses and the list takes two pages.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        cls.category = Category.objects.create(household=cls.household, name='Groceries')
+        create_expenses(cls.household, cls.users, cls.category, 2023, 5, 60)
+        create_expenses(cls.household, cls.users, cls.category, 2023, 4, 5)
+
+    def setUp(self):
+        # Rendered pages outlive the rolled back expenses of other tests
+        cache.clear()
+        self.client.force_login(self.users[0])
+        self.url = reverse('expense-list')
+
+    def get_every_page(self, query: dict) -> list[int]:
+        response = self.client.get(self.url, query)
+        pks = [expense.pk for expense in response.context['expenses']]
+
+        while response.context['next_url']:
+            response = self.client.get(response.context['next_url'])
+            self.assertEqual(response.status_code, 200)
+            pks.extend(expense.pk for expense in response.context['expenses'])
+
+        return pks
+
+    def test_pages_keep_their_order_across_equal_dates(self):
+        queryset = Expense.get_by_month(self.household.pk, 2023, 5)
+        expected = list(queryset.order_by('date', 'pk').values_list('pk', flat=True))
+        pks = []
+        cursor = None
+
+        while True:
+            page = keyset_page(queryset, cursor, lambda expense: (expense.date, expense.pk), size=7)
+            pks.extend(expense.pk for expense in page.rows)
+            cursor = page.next_cursor
+
+            if cursor is None:
+                break
+
+        self.assertEqual(pks, expected)
+
+    def test_view_pages_through_the_month(self):
+        pks = self.get_every_page({'month': 5, 'year': 2023})
+
+        self.assertEqual(pks, list(
+            Expense.get_by_month(self.household.pk, 2023, 5).order_by('date', 'pk').values_list('pk', flat=True)
+        ))
+
+    def test_all_months(self):
+        pks = self.get_every_page({'all': 1})
+
+        self.assertEqual(pks, list(
+            Expense.get_all(self.household.pk).order_by('date', 'pk').values_list('pk', flat=True)
+        ))
+        self.assertEqual(len(pks), 65)
+
+    def test_invalid_cursor(self):
+        for cursor in ('2023-05-01', 'x_1', '2023-05-01_x', '2023-13-01_1'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(self.url, {'month': 5, 'year': 2023, 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_month_is_not_modified(self):
+        query = {'month': 5, 'year': 2023}
+        etag = self.client.get(self.url, query).headers['ETag']
+
+        response = self.client.get(self.url, query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_expenses(self.household, self.users, self.category, 2023, 5, 1)
+
+        response = self.client.get(self.url, query, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+
+class MonthCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        cls.category = Category.objects.create(household=cls.household, name='Groceries')
+        create_expenses(cls.household, cls.users, cls.category, 2023, 5, 3)
+        cls.other_household, cls.other_users = create_household('Other', ('dan', 'eve'))
+        cls.other_category = Category.objects.create(household=cls.other_household, name='Groceries')
+
+    def setUp(self):
+        # Rendered pages outlive the rolled back expenses of other tests
+        cache.clear()
+        self.client.force_login(self.users[0])
+
+    def get_etag(self, month: int) -> str:
+        return self.client.get(reverse('expense-user-list'), {'month': month, 'year': 2023}).headers['ETag']
+
+    def test_repeated_request_only_loads_the_user(self):
+        self.client.get(reverse('expense-user-list'), {'month': 5, 'year': 2023})
+
+        # Session, user and household
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('expense-user-list'), {'month': 5, 'year': 2023})
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_saving_an_expense_only_refreshes_its_month(self):
+        may, april = self.get_etag(5), self.get_etag(4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_expenses(self.other_household, self.other_users, self.other_category, 2023, 5, 1)
+
+        self.assertEqual((self.get_etag(5), self.get_etag(4)), (may, april))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_expenses(self.household, self.users, self.category, 2023, 5, 1)
+
+        self.assertNotEqual(self.get_etag(5), may)
+        self.assertEqual(self.get_etag(4), april)
+
+    def test_payment_refreshes_its_month(self):
+        ExpenseShare.calc_monthly_expense(self.household.pk, 2023, 5)
+        summary = ExpenseShareSummary.objects.get(household=self.household, user=self.users[1], year=2023, month=5)
+        may = self.get_etag(5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            summary.set_paid()
+
+        self.assertNotEqual(self.get_etag(5), may)
+
+    def test_home_totals_follow_the_year(self):
+        totals = self.client.get(reverse('home')).context['expenses']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            create_expenses(self.household, self.users, self.category, timezone.now().year, 1, 1)
+
+        self.assertNotEqual(self.client.get(reverse('home')).context['expenses'], totals)
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.household, self.users = create_household()
+        self.groceries = Category.objects.create(household=self.household, name='Groceries')
+        self.rent = Category.objects.create(household=self.household, name='Rent')
+        # 10 by ana, 11 by bob and 12 by carl
+        create_expenses(self.household, self.users, self.groceries, 2022, 12, 3)
+        create_expenses(self.household, self.users, self.rent, 2023, 5, 1)
+        self.client.force_login(self.users[0])
+
+    def get_series(self, **query) -> dict:
+        response = self.client.get(reverse('dashboard-api'), {'from': 2022, 'to': 2023, **query})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_buckets_the_months_by_category_and_payer(self):
+        series = self.get_series()
+
+        self.assertEqual(len(series['months']), 24)
+        self.assertEqual((series['months'][11], series['months'][16]), ('2022-12', '2023-05'))
+        self.assertEqual(sorted(series['categories']), ['Groceries', 'Rent'])
+        self.assertEqual(series['totals'][11], '33.00')
+        self.assertEqual(series['totals'][16], '10.00')
+        self.assertEqual(sum(decimal.Decimal(total) for total in series['totals']), decimal.Decimal(43))
+        self.assertEqual(series['by_category']['Rent'][16], '10.00')
+        self.assertEqual(series['by_payer']['bob'][11], '11.00')
+        self.assertEqual(sorted((cell[0], cell[3], cell[4]) for cell in series['cells']), [
+            (11, '10.00', 1),
+            (11, '11.00', 1),
+            (11, '12.00', 1),
+            (16, '10.00', 1),
+        ])
+
+    def test_follows_edited_and_deleted_expenses(self):
+        expense = Expense.objects.get(category=self.rent)
+        expense.date = datetime.date(2022, 12, 31)
+        expense.category = self.groceries
+        expense.amount = decimal.Decimal('20.00')
+        expense.save()
+        Expense.objects.get(category=self.groceries, paid_by=self.users[1]).delete()
+
+        series = self.get_series()
+
+        self.assertEqual(series['categories'], ['Groceries'])
+        self.assertEqual(series['totals'][11], '42.00')
+        self.assertEqual(series['totals'][16], '0.00')
+        self.assertEqual(series['by_payer']['ana'][11], '30.00')
+        self.assertNotIn('bob', series['by_payer'])
+
+    def test_rejects_invalid_ranges(self):
+        for query in ({'from': 'x'}, {'from': 2023, 'to': 2022}, {'from': 2000, 'to': 2023}):
+            with self.subTest(query=query):
+                response = self.client.get(reverse('dashboard-api'), query)
+                self.assertEqual(response.status_code, 400)
+
+
+def read_xlsx(content: bytes) -> list[list[str]]:
+    namespace = {'sheet': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+    with zipfile.ZipFile(io.BytesIO(content)) as archive:
+        sheet = ElementTree.fromstring(archive.read('xl/worksheets/sheet1.xml'))
+
+    return [
+        [''.join(cell.itertext()) for cell in row.findall('sheet:c', namespace)]
+        for row in sheet.iterfind('sheet:sheetData/sheet:row', namespace)
+    ]
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        cls.category = Category.objects.create(household=cls.household, name='Groceries')
+        create_expenses(cls.household, cls.users, cls.category, 2023, 5, 3)
+        create_expenses(cls.household, cls.users, cls.category, 2023, 6, 1)
+        other_household, other_users = create_household('Other', ('dan',))
+        other_category = Category.objects.create(household=other_household, name='Groceries')
+        create_expenses(other_household, other_users, other_category, 2023, 5, 1)
+
+    def setUp(self):
+        self.client.force_login(self.users[0])
+
+    def export(self, kind: str, file_format: str, **query) -> bytes:
+        response = self.client.get(reverse('export', args=[kind, file_format]), {'from': '2023-05', **query})
+        self.assertEqual(response.status_code, 200)
+        return response.getvalue()
+
+    def test_expenses_csv(self):
+        rows = list(csv.reader(io.StringIO(self.export('expenses', 'csv').decode())))
+        pks = list(Expense.objects.filter(household=self.household).order_by('date', 'pk').values_list('pk', flat=True))
+
+        self.assertEqual(rows, [
+            ['id', 'date', 'category', 'description', 'amount', 'paid_by', 'created_by'],
+            [str(pks[0]), '2023-05-01', 'Groceries', 'Expense 0', '10.00', 'ana', 'ana'],
+            [str(pks[1]), '2023-05-02', 'Groceries', 'Expense 1', '11.00', 'bob', 'bob'],
+            [str(pks[2]), '2023-05-03', 'Groceries', 'Expense 2', '12.00', 'carl', 'carl'],
+        ])
+
+    def test_month_range(self):
+        rows = list(csv.reader(io.StringIO(self.export('expenses', 'csv', to='2023-06').decode())))
+
+        self.assertEqual([row[1] for row in rows[1:]], ['2023-05-01', '2023-05-02', '2023-05-03', '2023-06-01'])
+
+    def test_shares_csv_only_has_the_users_shares(self):
+        rows = list(csv.reader(io.StringIO(self.export('shares', 'csv', user=self.users[1].pk).decode())))
+
+        self.assertEqual(rows[0][6:], ['user', 'amount', 'discount'])
+        self.assertEqual([row[6:] for row in rows[1:]], [
+            ['ana', '0.00', '6.66'],
+            ['ana', '3.67', '0.00'],
+            ['ana', '4.00', '0.00'],
+        ])
+
+    def test_xlsx_matches_csv(self):
+        csv_rows = list(csv.reader(io.StringIO(self.export('shares', 'csv').decode())))
+
+        self.assertEqual(read_xlsx(self.export('shares', 'xlsx')), csv_rows)
+
+    def test_xlsx_escapes_text_across_chunks(self):
+        rows = [(number, f'<b>&"{number}"\x01</b>', decimal.Decimal('1.50'), None) for number in range(5)]
+        content = b''.join(iter_xlsx(['id', 'text', 'amount', 'empty'], rows, rows_per_chunk=2))
+
+        self.assertEqual(read_xlsx(content), [['id', 'text', 'amount', 'empty']] + [
+            [str(number), f'<b>&"{number}"</b>', '1.50', ''] for number in range(5)
+        ])
+
+    def test_rejects_invalid_filters(self):
+        for path, query in (
+            (reverse('export', args=['budgets', 'csv']), {}),
+            (reverse('export', args=['expenses', 'pdf']), {}),
+            (reverse('export', args=['expenses', 'csv']), {'from': '2023-13'}),
+            (reverse('export', args=['expenses', 'csv']), {'from': '2023-06', 'to': '2023-05'}),
+        ):
+            with self.subTest(path=path, query=query):
+                self.assertEqual(self.client.get(path, query).status_code, 400)
+
+
+class ExpenseUpdateTests(TestCase):
+    def setUp(self):
+        self.household, self.users = create_household()
+        self.category = Category.objects.create(household=self.household, name='Groceries')
+        create_expenses(self.household, self.users, self.category, 2023, 5, 1)
+        self.expense = Expense.objects.get()
+
+    def get_shares(self) -> dict:
+        return {
+            share.user_id: (share.pk, share.amount, share.discount)
+            for share in ExpenseShare.objects.filter(expense=self.expense)
+        }
+
+    def assertLedgerMatchesShares(self):
+        expected = MonthlyLedger.compute_expected(self.household.pk)
+        actual = {
+            (ledger.household_id, ledger.user_id, ledger.year, ledger.month): ledger
+            for ledger in MonthlyLedger.objects.filter(household=self.household)
+        }
+
+        for key, values in expected.items():
+            for field, value in values.items():
+                self.assertEqual(getattr(actual[key], field), value, (key, field))
+
+    def test_description_only_save_is_one_update(self):
+        self.expense.description = 'Bakery'
+
+        with self.assertNumQueries(1):
+            self.expense.save()
+
+        self.assertEqual(Expense.objects.get().description, 'Bakery')
+
+    def test_saving_a_created_expense_again_is_one_update(self):
+        expense = Expense.objects.create(
+            household=self.household,
+            category=self.category,
+            paid_by=self.users[0],
+            created_by=self.users[0],
+            amount=decimal.Decimal('5.00'),
+            date=datetime.date(2023, 5, 2),
+        )
+        expense.description = 'Bakery'
+
+        with self.assertNumQueries(1):
+            expense.save()
+
+    def test_amount_change_updates_the_shares_in_place(self):
+        before = self.get_shares()
+        self.expense.amount = decimal.Decimal('30.00')
+        self.expense.save()
+        after = self.get_shares()
+
+        self.assertEqual({user_id: share[0] for user_id, share in after.items()}, {user_id: share[0] for user_id, share in before.items()})
+        self.assertEqual(after[self.users[0].pk][1:], (ZERO, decimal.Decimal('20.00')))
+        self.assertEqual(after[self.users[1].pk][1:], (decimal.Decimal('10.00'), ZERO))
+        self.assertLedgerMatchesShares()
+
+    def test_unchanged_split_writes_no_share(self):
+        self.expense.date = datetime.date(2023, 5, 20)
+
+        with mock.patch.object(ExpenseShare.objects, 'bulk_update') as bulk_update:
+            self.expense.save()
+
+        bulk_update.assert_not_called()
+        self.assertLedgerMatchesShares()
+
+    def test_share_of_a_deactivated_user_is_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[2].is_active = False
+            self.users[2].save()
+
+        self.expense.amount = decimal.Decimal('20.00')
+        self.expense.save()
+        shares = self.get_shares()
+
+        self.assertEqual(sorted(shares), [self.users[0].pk, self.users[1].pk])
+        self.assertEqual(shares[self.users[1].pk][1], decimal.Decimal('10.00'))
+
+
+class SettlementPlanTests(TestCase):
+    def setUp(self):
+        self.household, self.users = create_household()
+        self.category = Category.objects.create(household=self.household, name='Groceries')
+        # Ana's portions add up to 11.01 and she paid 10.00, Bob's to what
+        # he paid and Carl's to 10.99 of the 12.00 he paid
+        create_expenses(self.household, self.users, self.category, 2023, 5, 3)
+
+    def get_plan(self) -> list[tuple]:
+        return list(Settlement.objects.filter(household=self.household, year=2023, month=5).values_list(
+            'from_user__username', 'to_user__username', 'amount'
+        ).order_by('from_user__username', 'to_user__username'))
+
+    def test_stores_the_plan_of_the_month(self):
+        ExpenseShare.calc_monthly_expense(self.household.pk, 2023, 5)
+
+        self.assertEqual(self.get_plan(), [('ana', 'carl', decimal.Decimal('1.01'))])
+        self.assertFalse(Settlement.get_for_user(self.household.pk, self.users[1], 2023, 5).exists())
+
+    def test_recalculating_replaces_the_plan(self):
+        ExpenseShare.calc_monthly_expense(self.household.pk, 2023, 5)
+        expense = Expense.objects.get(paid_by=self.users[1])
+        expense.amount = decimal.Decimal('41.00')
+        expense.save()
+        ExpenseShare.calc_monthly_expense(self.household.pk, 2023, 5)
+
+        # Ana's portions now add up to 21.01 and Carl's to 20.99
+        self.assertEqual(self.get_plan(), [
+            ('ana', 'bob', decimal.Decimal('11.01')),
+            ('carl', 'bob', decimal.Decimal('8.99')),
+        ])
+
+    def test_share_list_shows_the_users_transfers(self):
+        ExpenseShare.calc_monthly_expense(self.household.pk, 2023, 5)
+        self.client.force_login(self.users[2])
+
+        response = self.client.get(reverse('expense-user-list'), {'month': 5, 'year': 2023})
+
+        self.assertEqual([
+            (settlement.from_user, settlement.to_user, settlement.amount) for settlement in response.context['settlements']
+        ], [(self.users[0], self.users[2], decimal.Decimal('1.01'))])
+
+
+# Basic auth hashes the password on every request
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ExpenseApiTests(TestCase):
+    def setUp(self):
+        self.household, self.users = create_household()
+        self.category = Category.objects.create(household=self.household, name='Groceries')
+        credentials = base64.b64encode(b'ana:secret').decode()
+        self.auth = {'HTTP_AUTHORIZATION': f'Basic {credentials}'}
+
+    def build_item(self, **fields) -> dict:
+        return {
+            'category': self.category.pk,
+            'description': 'Bread',
+            'amount': '12.30',
+            'date': '2023-05-02',
+            'paid_by': self.users[1].pk,
+            **fields,
+        }
+
+    def post(self, name: str, body, client: Optional[Client] = None, **extra):
+        return (client or self.client).post(reverse(name), json.dumps(body), content_type='application/json', **extra)
+
+    def test_creates_expense(self):
+        response = self.post('api-expenses', self.build_item(), **self.auth)
+
+        self.assertEqual(response.status_code, 201)
+        expense = Expense.objects.get(pk=response.json()['id'])
+        self.assertEqual((expense.amount, expense.paid_by, expense.created_by), (decimal.Decimal('12.30'), self.users[1], self.users[0]))
+        self.assertEqual(ExpenseShare.objects.filter(expense=expense).count(), 3)
+        self.assertEqual(MonthlyLedger.get_monthly_total(self.household.pk, 2023, 5), decimal.Decimal('12.30'))
+
+    def test_requires_authentication(self):
+        response = self.post('api-expenses', self.build_item())
+
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_batch_creates_every_expense(self):
+        items = [self.build_item(amount=str(amount)) for amount in (10, 20, 30)]
+        response = self.post('api-expenses-batch', {'expenses': items}, **self.auth)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual(sorted(Expense.objects.values_list('pk', flat=True)), sorted(response.json()['ids']))
+        self.assertEqual(ExpenseShare.objects.count(), 9)
+        self.assertEqual(MonthlyLedger.get_monthly_total(self.household.pk, 2023, 5), decimal.Decimal(60))
+
+    def test_batch_limit(self):
+        with mock.patch('expenses.api.MAX_BATCH_SIZE', 2):
+            response = self.post('api-expenses-batch', [self.build_item()] * 3, **self.auth)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_batch_is_all_or_nothing(self):
+        other_household, other_users = create_household('Other', ('dan',))
+        other_category = Category.objects.create(household=other_household, name='Groceries')
+        items = [
+            self.build_item(),
+            self.build_item(category=other_category.pk),
+            self.build_item(amount='-1', paid_by=other_users[0].pk),
+            'not an expense',
+        ]
+        response = self.post('api-expenses-batch', items, **self.auth)
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual(sorted(errors), ['1', '2', '3'])
+        self.assertEqual(list(errors['1']), ['category'])
+        self.assertEqual(sorted(errors['2']), ['amount', 'paid_by'])
+        self.assertFalse(Expense.objects.exists())
+
+    def test_session_requires_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.users[0])
+
+        response = self.post('api-expenses', self.build_item(), client=client)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Expense.objects.exists())
+
+        token = 'a' * 32
+        client.cookies['csrftoken'] = token
+        response = self.post('api-expenses', self.build_item(), client=client, HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 201)
+
+    def test_lists_expenses_by_keyset(self):
+        create_expenses(self.household, self.users, self.category, 2023, 5, 20)
+        create_expenses(self.household, self.users, self.category, 2023, 6, 5)
+        ids = []
+        query = {'from': '2023-05', 'to': '2023-05', 'size': 7, 'fields': 'id,date'}
+
+        while True:
+            response = self.client.get(reverse('api-expenses'), query, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertTrue(all(list(row) == ['id', 'date'] for row in body['results']))
+            ids.extend(row['id'] for row in body['results'])
+
+            if body['next'] is None:
+                break
+
+            query['cursor'] = body['next']
+
+        self.assertEqual(ids, list(
+            Expense.get_by_month(self.household.pk, 2023, 5).order_by('date', 'pk').values_list('pk', flat=True)
+        ))
+
+    def test_rejects_invalid_listing_parameters(self):
+        for query in ({'cursor': 'nope'}, {'from': '2023-13'}, {'fields': 'id,secret'}, {'size': 'x'}):
+            with self.subTest(query=query):
+                response = self.client.get(reverse('api-expenses'), query, **self.auth)
+                self.assertEqual(response.status_code, 400)
+
+
+class FakeSMTP:
+    """
+    Stand-in for smtplib.SMTP under Django's SMTP backend. Records every
+    connection opened and fails the sends to ``failures`` recipients as
+    many times as their count.
+    """
+    connections = []
+    failures = {}
+
+    def __init__(self, host, port, **kwargs):
+        self.sent = []
+        self.connections.append(self)
+
+    def starttls(self, **kwargs):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        for address in to_addrs:
+            if self.failures.get(address):
+                self.failures[address] -= 1
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+        self.sent.extend(to_addrs)
+
+    def quit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeSMTPBackend(smtp.EmailBackend):
+    connection_class = FakeSMTP
+
+
+class SendSummariesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.household, cls.users = create_household()
+        category = Category.objects.create(household=cls.household, name='Groceries')
+        create_expenses(cls.household, cls.users, category, 2023, 5, 6)
+        ExpenseShare.calc_monthly_expense(cls.household.pk, 2023, 5)
+        cls.emails = [user.email for user in cls.users]
+
+    def setUp(self):
+        FakeSMTP.connections = []
+        FakeSMTP.failures = {}
+        # No backoff waits between retries
+        patcher = mock.patch('expenses.notifications.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, **kwargs):
+        summaries = ExpenseShareSummary.objects.filter(household=self.household).select_related('user').order_by('user')
+        return send_summaries(summaries, **kwargs)
+
+    def get_smtp_sent(self) -> list[str]:
+        return [address for connection in FakeSMTP.connections for address in connection.sent]
+
+    def test_sends_every_summary(self):
+        report = self.send()
+
+        self.assertEqual(report.sent, self.emails)
+        self.assertEqual(report.failed, {})
+        self.assertEqual([message.to for message in mail.outbox], [[email] for email in self.emails])
+
+    @override_settings(EMAIL_BACKEND='expenses.tests.FakeSMTPBackend')
+    def test_reuses_one_smtp_connection(self):
+        report = self.send()
+
+        self.assertEqual(report.sent, self.emails)
+        self.assertEqual(len(FakeSMTP.connections), 1)
+        self.assertEqual(self.get_smtp_sent(), self.emails)
+
+    @override_settings(EMAIL_BACKEND='expenses.tests.FakeSMTPBackend')
+    def test_retries_transient_failure_on_a_new_connection(self):
+        FakeSMTP.failures = {self.emails[1]: 1}
+        report = self.send(retries=2)
+
+        self.assertEqual(report.sent, self.emails)
+        self.assertEqual(report.failed, {})
+        self.assertEqual(len(FakeSMTP.connections), 2)
+        self.sleep.assert_called_once_with(0.5)
+
+    @override_settings(EMAIL_BACKEND='expenses.tests.FakeSMTPBackend')
+    def test_reports_failed_recipient_and_sends_the_rest(self):
+        FakeSMTP.failures = {self.emails[1]: 3}
+        report = self.send(retries=2)
+
+        self.assertEqual(report.sent, [self.emails[0], self.emails[2]])
+        self.assertEqual(report.failed, {self.emails[1]: 'Connection unexpectedly closed'})
+        self.assertEqual(self.get_smtp_sent(), [self.emails[0], self.emails[2]])
+        self.assertEqual([call.args for call in self.sleep.call_args_list], [(0.5,), (1.0,)])
+
+
+class ColdStartTests(SimpleTestCase):
+    """
+    Management commands start in a fresh interpreter, the same way cron or
+    the job worker run them.
+    """
+    # Generous for CI, both take about 0.5s locally
+    BUDGET_MS = 2000
+    # Only the summary emails and the bot need them
+    LAZY_PACKAGES = ('prettytable', 'telebot')
+
+    def assertColdStart(self, argv: list[str]):
+        # The first run warms the bytecode and file system caches
+        elapsed, modules = min((profile(argv) for _ in range(2)), key=lambda run: run[0])
+        names = [name for name, _own, _cumulative in modules]
+
+        for package in self.LAZY_PACKAGES:
+            self.assertFalse(
+                [name for name in names if name == package or name.startswith(f'{package}.')],
+                f'{" ".join(argv)} imports {package}'
+            )
+
+        self.assertLess(elapsed, self.BUDGET_MS)
+
+    def test_check(self):
+        self.assertColdStart(['check'])
+
+    def test_calc_month_total_help(self):
+        self.assertColdStart(['calc_month_total', '--help'])
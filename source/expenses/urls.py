@@ -2,7 +2,7 @@
 from django.contrib.auth.decorators import login_required
 from django.urls import path
 
-from . import views
+from . import api, views
 
 
 urlpatterns = [
@@ -10,4 +10,11 @@ urlpatterns = [
     path('expense/', login_required(views.ExpenseFormView.as_view()), name='expense'),
     path('expense/list/', login_required(views.ExpenseListView.as_view()), name='expense-list'),
     path('expense/list/user/', login_required(views.ExpenseShareListView.as_view(is_user=True)), name='expense-user-list'),
+    path('export/<slug:kind>.<slug:file_format>', login_required(views.ExportView.as_view()), name='export'),
+    path('search/', login_required(views.SearchView.as_view()), name='search'),
+    path('api/dashboard/', login_required(views.DashboardView.as_view()), name='dashboard-api'),
+    path('api/expenses/', api.ExpenseApiView.as_view(), name='api-expenses'),
+    path('api/expenses/batch/', api.ExpenseBatchApiView.as_view(), name='api-expenses-batch'),
+    path('api/shares/', api.ExpenseShareApiView.as_view(), name='api-shares'),
+    path('api/summaries/', api.ExpenseShareSummaryApiView.as_view(), name='api-summaries'),
 ]
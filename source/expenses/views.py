@@ -1,41 +1,60 @@
 from datetime import datetime
 
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import FormView
 from django.contrib import messages
 from django.shortcuts import render
-from django.utils import timezone
+from django.utils import timezone, translation
 from django.db.models import Sum
 from django.views import View
 
+from .exports import EXPORTS, WRITERS, get_export_queryset, iter_export
 from .forms import ExpenseForm, ExpenseFilterForm
-from .models import Expense, ExpenseShare
-from .mixins import FilterMixin
+from .models import BalanceSnapshot, Expense, ExpenseShare, MonthlyLedger, MonthlyRollup, Settlement
+from .search import FACETS, PAGE_SIZE, search_expenses
+from .mixins import FilterMixin, HouseholdMixin, MonthCacheMixin
+from .pagination import Page, keyset_page
+from .cache import get_or_set_for_month
+from .dates import parse_year_month
+from .aggregates import ZERO
 
 
-class HomeView(View):
+class HomeView(View, HouseholdMixin):
     def get_context_data(self, **kwargs):
-        queryset = Expense.objects.filter(
-            date__year=timezone.now().year
+        household_id = self.get_household_id(self.request)
+        year = timezone.now().year
+        context = {}
+        context["expenses"] = get_or_set_for_month(
+            f"views:home:{translation.get_language()}",
+            household_id,
+            year,
+            None,
+            lambda: self.get_monthly_totals(household_id, year)
+        )
+        return context
+
+    def get_monthly_totals(self, household_id: int, year: int) -> dict:
+        queryset = MonthlyRollup.objects.filter(
+            household_id=household_id,
+            year=year
         ).values(
-            "date__month"
+            "month"
         ).annotate(
-            total=Sum("amount")
+            total=Sum("total")
         ).order_by(
-            "date__month"
+            "month"
         )
-        context = {}
-        context["expenses"] = {
-            datetime(1900, month["date__month"], 1).strftime("%B"): month["total"]
+        return {
+            datetime(1900, month["month"], 1).strftime("%B"): month["total"]
             for month in queryset
         }
-        return context
-    
+
     def get(self, request):
         return render(request, 'home.html', self.get_context_data())
 
 
-class ExpenseFormView(FormView):
+class ExpenseFormView(FormView, HouseholdMixin):
     form_class = ExpenseForm
     template_name = 'expense_form.html'
 
@@ -45,6 +64,7 @@ class ExpenseFormView(FormView):
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['user'] = self.request.user
+        kwargs['household_id'] = self.get_household_id(self.request)
         return kwargs
 
     def form_invalid(self, form):
@@ -57,48 +77,293 @@ class ExpenseFormView(FormView):
         return super().form_valid(form)
 
 
-class ExpenseListView(View, FilterMixin):
+class ExpenseListView(View, FilterMixin, HouseholdMixin, MonthCacheMixin):
+    """
+    Expenses of a month, or of all months with ``all=1``, loaded a page at a
+    time as the table is scrolled. Requests with a cursor only render the
+    rows of the next page.
+    """
+    cache_name = 'expense-list'
+
+    def get_page(self) -> Page:
+        household_id = self.get_household_id(self.request)
+
+        if self.is_all_months(self.request):
+            queryset = Expense.get_all(household_id)
+        else:
+            queryset = Expense.get_by_month(household_id, self.get_year(self.request), self.get_month(self.request))
+
+        return keyset_page(queryset, self.get_cursor(self.request), lambda expense: (expense.date, expense.pk))
 
     def get_context_data(self) -> dict:
+        page = self.get_page()
+
+        context = {}
+        context['expenses'] = page.rows
+        context['next_url'] = self.get_next_url(self.request, page.next_cursor)
+
+        if self.get_cursor(self.request):
+            return context
+
+        household_id = self.get_household_id(self.request)
         month = self.get_month(self.request)
         year = self.get_year(self.request)
 
-        context = {}
-        context['expenses'] = Expense.get_by_month(year, month)
-        context['total'] = Expense.get_monthly_total(year, month)
-        context['month_name'] = timezone.datetime(year, month, 1).strftime('%B')
-        context['year_number'] = year
+        if self.is_all_months(self.request):
+            context['total'] = MonthlyLedger.get_total(household_id)
+            context['month_name'] = _('all months')
+        else:
+            context['total'] = MonthlyLedger.get_monthly_total(household_id, year, month)
+            context['month_name'] = timezone.datetime(year, month, 1).strftime('%B')
+            context['year_number'] = year
+
         context['filter_form'] = ExpenseFilterForm(initial={'month': month, 'year': year})
 
         return context
 
     def get(self, request):
-        return render(request, 'expense_list.html', self.get_context_data())
+        try:
+            self.get_cursor(request)
+        except ValueError:
+            return HttpResponseBadRequest(_('Invalid cursor'))
+
+        all_months = self.is_all_months(request)
+        template_name = 'includes/expense_rows.html' if self.get_cursor(request) else 'expense_list.html'
+        return self.cached_response(
+            request,
+            self.get_household_id(request),
+            None if all_months else self.get_year(request),
+            None if all_months else self.get_month(request),
+            lambda: render(request, template_name, self.get_context_data())
+        )
+
 
+class ExpenseShareListView(View, FilterMixin, HouseholdMixin, MonthCacheMixin):
+    cache_name = 'expense-share-list'
+
+    def get_page(self) -> Page:
+        household_id = self.get_household_id(self.request)
+        user = self.request.user
+
+        if self.is_all_months(self.request):
+            queryset = ExpenseShare.get_all_for_user(household_id, user)  # type: ignore
+        else:
+            queryset = ExpenseShare.get_by_month(
+                household_id,
+                self.get_year(self.request),
+                self.get_month(self.request),
+                user=user  # type: ignore
+            )
+
+        return keyset_page(
+            queryset,
+            self.get_cursor(self.request),
+            lambda share: (share.expense.date, share.expense_id),
+            date_field='expense__date',
+            id_field='expense_id'
+        )
 
-class ExpenseShareListView(View, FilterMixin):
     def get_context_data(self) -> dict:
+        page = self.get_page()
+
+        context = {}
+        context['expenses'] = page.rows
+        context['next_url'] = self.get_next_url(self.request, page.next_cursor)
+
+        if self.get_cursor(self.request):
+            return context
+
+        household_id = self.get_household_id(self.request)
+        user = self.request.user
         month = self.get_month(self.request)
         year = self.get_year(self.request)
 
-        context = {}
-        context['expenses'] = ExpenseShare.get_by_month(
-            year,
-            month,
-            user=self.request.user  # type: ignore
-        )
-        context['total_per_user'] = ExpenseShare.get_per_user_monthly_total(year, month)
-        context['total_to_discount'] = ExpenseShare.get_monthly_discounted_total(
-            year,
-            month,
-            user=self.request.user  # type: ignore
-        )
-        context['total'] = context['total_per_user'] - context['total_to_discount']
-        context['month_name'] = timezone.datetime(year, month, 1).strftime('%B')
-        context['year_number'] = year
+        if self.is_all_months(self.request):
+            ledger = MonthlyLedger.get_totals_for_user(household_id, user)  # type: ignore
+            now = timezone.now()
+            context['settlements'] = []
+            context['balance'] = BalanceSnapshot.get_balance(household_id, user, now.year, now.month)  # type: ignore
+            context['month_name'] = _('all months')
+        else:
+            ledger = MonthlyLedger.get_for_user(household_id, user, year, month)  # type: ignore
+            context['settlements'] = Settlement.get_for_user(household_id, user, year, month)  # type: ignore
+            context['balance'] = BalanceSnapshot.get_balance(household_id, user, year, month)  # type: ignore
+            context['month_name'] = timezone.datetime(year, month, 1).strftime('%B')
+            context['year_number'] = year
+
+        context['total_per_user'] = ledger.total_amount
+        context['total_to_discount'] = ledger.total_discount
+        context['total'] = ledger.to_pay
         context['filter_form'] = ExpenseFilterForm(initial={'month': month, 'year': year})
 
         return context
 
     def get(self, request):
-        return render(request, 'expense_share.html', self.get_context_data())
+        try:
+            self.get_cursor(request)
+        except ValueError:
+            return HttpResponseBadRequest(_('Invalid cursor'))
+
+        all_months = self.is_all_months(request)
+        template_name = 'includes/expense_share_rows.html' if self.get_cursor(request) else 'expense_share.html'
+        return self.cached_response(
+            request,
+            self.get_household_id(request),
+            None if all_months else self.get_year(request),
+            None if all_months else self.get_month(request),
+            lambda: render(request, template_name, self.get_context_data())
+        )
+
+
+class DashboardView(View, HouseholdMixin):
+    """
+    Month series of several years broken down by category and payer, read
+    from the rollup table in one query.
+    """
+    max_years = 20
+
+    def get(self, request):
+        current_year = timezone.now().year
+
+        try:
+            from_year = int(request.GET.get('from', current_year))
+            to_year = int(request.GET.get('to', current_year))
+        except ValueError:
+            return HttpResponseBadRequest(_('Invalid year'))
+
+        if from_year > to_year or to_year - from_year >= self.max_years:
+            return HttpResponseBadRequest(_('Invalid year range'))
+
+        return JsonResponse(self.get_series(self.get_household_id(request), from_year, to_year))
+
+    def get_series(self, household_id: int, from_year: int, to_year: int) -> dict:
+        months = [
+            f'{year}-{month:02d}'
+            for year in range(from_year, to_year + 1)
+            for month in range(1, 13)
+        ]
+        totals = [ZERO] * len(months)
+        categories: dict[str, int] = {}
+        payers: dict[str, int] = {}
+        by_category: dict[str, list] = {}
+        by_payer: dict[str, list] = {}
+        cells = []
+
+        for rollup in MonthlyRollup.get_between(household_id, from_year, to_year):
+            index = (rollup.year - from_year) * 12 + rollup.month - 1
+            category = rollup.category.name
+            payer = rollup.paid_by.username
+
+            categories.setdefault(category, len(categories))
+            payers.setdefault(payer, len(payers))
+            by_category.setdefault(category, [ZERO] * len(months))[index] += rollup.total
+            by_payer.setdefault(payer, [ZERO] * len(months))[index] += rollup.total
+            totals[index] += rollup.total
+            cells.append([index, categories[category], payers[payer], rollup.total, rollup.count])
+
+        return {
+            'months': months,
+            'categories': list(categories),
+            'payers': list(payers),
+            'totals': totals,
+            'by_category': by_category,
+            'by_payer': by_payer,
+            # [month index, category index, payer index, total, count]
+            'cells': cells,
+        }
+
+
+class SearchView(View, HouseholdMixin):
+    """
+    Full-text search over expense descriptions and categories, best matches
+    first, with the category, payer and month facets of the matches. Broad
+    searches are capped to their newest matches and flagged as ``capped``.
+    """
+    max_page_size = 100
+
+    def get(self, request):
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+            size = min(max(int(request.GET.get('size', PAGE_SIZE)), 1), self.max_page_size)
+            from_month = parse_year_month(request.GET['from']) if request.GET.get('from') else None
+            to_month = parse_year_month(request.GET['to']) if request.GET.get('to') else None
+            category_id = int(request.GET['category']) if request.GET.get('category') else None
+            payer_id = int(request.GET['payer']) if request.GET.get('payer') else None
+        except ValueError:
+            return HttpResponseBadRequest(_('Invalid filters'))
+
+        facets = request.GET['facets'].split(',') if 'facets' in request.GET else FACETS
+        result = search_expenses(
+            self.get_household_id(request),
+            request.GET.get('q', ''),
+            page=page,
+            size=size,
+            from_month=from_month,
+            to_month=to_month,
+            category_id=category_id,
+            payer_id=payer_id,
+            facets=tuple(facet for facet in facets if facet in FACETS),
+        )
+
+        return JsonResponse({
+            'total': result.total,
+            'page': result.page,
+            'has_next': result.has_next,
+            'capped': result.capped,
+            'results': [
+                {
+                    'id': expense.pk,
+                    'date': expense.date,
+                    'description': expense.description,
+                    'amount': expense.amount,
+                    'category': expense.category.name,
+                    'paid_by': expense.paid_by.username,
+                }
+                for expense in result.expenses
+            ],
+            'facets': result.facets,
+        })
+
+
+class ExportView(View, HouseholdMixin):
+    """
+    Streams expenses or shares of a month range as CSV or XLSX. Rows are
+    fetched in chunks and written as they arrive, so memory stays flat
+    whatever the size of the range.
+    """
+    def get(self, request, kind: str, file_format: str):
+        if kind not in EXPORTS or file_format not in WRITERS:
+            return HttpResponseBadRequest(_('Unknown export'))
+
+        now = timezone.now()
+
+        try:
+            from_month = parse_year_month(request.GET.get('from') or f'{now.year}-{now.month}')
+            to_month = parse_year_month(request.GET['to']) if request.GET.get('to') else from_month
+            category_id = int(request.GET['category']) if request.GET.get('category') else None
+            user_id = int(request.GET['user']) if request.GET.get('user') else None
+        except ValueError:
+            return HttpResponseBadRequest(_('Invalid filters'))
+
+        if to_month < from_month:
+            return HttpResponseBadRequest(_('Invalid month range'))
+
+        # Everyone sees every expense of their household, but only staff can
+        # export other users' shares
+        if kind == 'shares' and not request.user.is_staff:
+            user_id = request.user.pk
+
+        queryset = get_export_queryset(
+            kind,
+            self.get_household_id(request),
+            from_month,
+            to_month,
+            category_id,
+            user_id
+        )
+        _writer, content_type = WRITERS[file_format]
+        filename = '%s-%d-%02d-%d-%02d.%s' % (kind, *from_month, *to_month, file_format)
+
+        response = StreamingHttpResponse(iter_export(kind, file_format, queryset), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Runs the Telegram bot with long polling or registers its webhook'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--webhook',
+            metavar='URL',
+            help='Register this URL (pointing to the telegram-webhook view) instead of polling'
+        )
+        parser.add_argument(
+            '--delete-webhook',
+            action='store_true',
+            help='Remove the registered webhook and exit'
+        )
+        parser.add_argument('--timeout', type=int, default=20, help='Long polling timeout in seconds')
+
+    def handle(self, *args, **options):
+        if not settings.TELEBOT_API_TOKEN:
+            raise CommandError('TELEBOT_API_TOKEN is not configured')
+
+        from telegram.telebot import bot
+
+        if options['delete_webhook']:
+            asyncio.run(bot.delete_webhook())
+            logger.info('Webhook deleted')
+            return
+
+        if options['webhook']:
+            # The webhook view rejects every update without a secret
+            if not settings.TELEBOT_WEBHOOK_SECRET:
+                raise CommandError('TELEBOT_WEBHOOK_SECRET is required to use a webhook')
+
+            asyncio.run(bot.set_webhook(options['webhook'], secret_token=settings.TELEBOT_WEBHOOK_SECRET))
+            logger.info('Webhook set to %s', options['webhook'])
+            return
+
+        logger.info(
+            'Polling updates with up to %s concurrent handlers',
+            settings.TELEBOT_MAX_CONCURRENT_UPDATES
+        )
+        asyncio.run(self.poll(bot, options['timeout']))
+
+    async def poll(self, bot, timeout: int):
+        try:
+            await bot.infinity_polling(timeout=timeout, logger_level=logging.INFO)
+        finally:
+            await bot.close_session()
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.5 on 2026-10-18 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_household(apps, schema_editor):
+    # Telegram users belong to the household of their user
+    TelegramUser = apps.get_model('telegram', 'TelegramUser')
+    Membership = apps.get_model('expenses', 'Membership')
+    db = schema_editor.connection.alias
+    households = dict(Membership.objects.using(db).values_list('user_id', 'household_id'))
+    telegram_users = list(TelegramUser.objects.using(db).all())
+
+    for telegram_user in telegram_users:
+        telegram_user.household_id = households.get(telegram_user.user_id)
+
+    TelegramUser.objects.using(db).bulk_update(telegram_users, ['household'], batch_size=1000)
+    # Users without a household can't use the bot anyway
+    TelegramUser.objects.using(db).filter(household__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('expenses', '0015_household'),
+        ('telegram', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telegramuser',
+            name='household',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='telegram_users', to='expenses.household'),
+        ),
+        migrations.RunPython(set_household, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='telegramuser',
+            name='household',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='telegram_users', to='expenses.household'),
+        ),
+    ]
@@ -1,8 +1,11 @@
 from django.contrib.auth.models import User
 from django.db import models
 
+from expenses.models import Household
+
 
 class TelegramUser(models.Model):
+    household = models.ForeignKey(Household, on_delete=models.CASCADE, related_name='telegram_users')
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='telegram_user')
     telegram_id = models.IntegerField(unique=True)
 
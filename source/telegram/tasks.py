@@ -0,0 +1,19 @@
+from django.conf import settings
+
+from expenses.jobs import task
+from .models import TelegramUser
+
+
+@task('telegram.send_message')
+def send_message(user_id: int, message: str):
+    from telebot import apihelper
+
+    telegram_user = TelegramUser.objects.filter(user_id=user_id).first()
+
+    if telegram_user is None:
+        return
+
+    if settings.TELEBOT_API_URL:
+        apihelper.API_URL = settings.TELEBOT_API_URL
+
+    apihelper.send_message(settings.TELEBOT_API_TOKEN, telegram_user.telegram_id, message)
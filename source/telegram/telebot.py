@@ -1,84 +1,173 @@
-from decimal import getcontext
+from typing import Awaitable, Callable, Optional
+import functools
+import asyncio
 
 from django.utils.translation import gettext as _
 from django.contrib.auth.models import User
-from django.db.models import QuerySet
+from django.db import close_old_connections
 from django.conf import settings
 
+from telebot.async_telebot import AsyncTeleBot
+from telebot import apihelper, asyncio_helper
+from asgiref.sync import sync_to_async
 import prettytable as pt
-import telebot
 
-from expenses.models import ExpenseShare
+from expenses.models import ExpenseShare, Membership, MonthlyLedger
+from expenses.instrumentation import instrumented
+from expenses.cache import get_or_set_for_month
+from expenses.aggregates import decimal_sum
+from expenses.dates import month_range
+from expenses.jobs import enqueue
 from .models import TelegramUser
 
-bot = telebot.TeleBot(settings.TELEBOT_API_TOKEN, threaded=False)
+if settings.TELEBOT_API_URL:
+    apihelper.API_URL = asyncio_helper.API_URL = settings.TELEBOT_API_URL
 
+bot = AsyncTeleBot(settings.TELEBOT_API_TOKEN)
 
-@bot.message_handler(commands=['registrar'])
-def register_user(message):
-    username = message.text
-    username = username.replace('/registrar ', '')
+_handler_slots: Optional[asyncio.Semaphore] = None
 
-    try:
-        user = User.objects.get(username=username)
-    except User.DoesNotExist:
-        bot.reply_to(message, _('User does not exist'))
-        return
 
-    TelegramUser.objects.create(user=user, telegram_id=message.chat.id)
-    bot.reply_to(message, _('User registered'))
+def database_sync_to_async(func: Callable) -> Callable[..., Awaitable]:
+    """
+    Runs ORM code in a worker thread, so several handlers can wait on the
+    database at once. Connections are kept between updates (CONN_MAX_AGE)
+    and recycled the same way Django does around a request.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
 
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
 
-@bot.message_handler(commands=['gastos'])
-def user_expenses(message):
-    chat_id = message.chat.id
+    return sync_to_async(wrapper, thread_sensitive=False)
 
-    try:
-        telegram_user = TelegramUser.objects.get(telegram_id=chat_id)
-    except TelegramUser.DoesNotExist:
-        bot.reply_to(message, _('User not registered'))
-        return
 
-    user = telegram_user.user
-    msg = message.text.replace('/gastos ', '')
+def bounded(handler: Callable[..., Awaitable]) -> Callable[..., Awaitable]:
+    """
+    Caps how many updates are handled at the same time so a burst of
+    messages can't exhaust the database connections.
+    """
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        global _handler_slots
+
+        if _handler_slots is None:
+            _handler_slots = asyncio.Semaphore(settings.TELEBOT_MAX_CONCURRENT_UPDATES)
+
+        async with _handler_slots:
+            return await handler(*args, **kwargs)
 
+    return wrapper
+
+
+@database_sync_to_async
+def register_user_reply(chat_id: int, username: str) -> str:
     try:
-        month, year = msg.split(' ')
-    except ValueError:
-        bot.reply_to(message, _('Invalid date'))
-        return
+        user = User.objects.get(username=username)
+    except User.DoesNotExist:
+        return _('User does not exist')
 
-    expenses_shares: QuerySet[ExpenseShare] = user.expense_shares.all() # type: ignore
+    household_id = Membership.get_household_id(user)
 
-    if not expenses_shares:
-        bot.reply_to(message, _('No expenses registered'))
-        return
+    if household_id is None:
+        return _('User is not a member of any household')
+
+    TelegramUser.objects.create(household_id=household_id, user=user, telegram_id=chat_id)
+    return _('User registered')
+
+
+def render_user_expenses(household_id: int, user_id: int, year: int, month: int) -> Optional[str]:
+    categories = ExpenseShare.objects.in_month(year, month).filter(
+        household_id=household_id,
+        user_id=user_id
+    ).values(
+        'expense__category__name'
+    ).annotate(
+        total=decimal_sum('amount')
+    ).order_by(
+        'expense__category__name'
+    )
+
+    if not categories:
+        return None
 
     table = pt.PrettyTable(['Category', 'Amount'])
     table.padding_width = 1
     table.align['Category'] = 'l'
     table.align['Amount'] = 'r'
 
-    for expense_share in expenses_shares:
-        table.add_row([expense_share.expense.category.name, expense_share.amount])
-    
+    for category in categories:
+        table.add_row([category['expense__category__name'], round(category['total'], 2)])
 
-    per_user = ExpenseShare.get_per_user_monthly_total(year, month)
-    user_discounts = ExpenseShare.get_monthly_discounted_total(year, month, user)
+    ledger = MonthlyLedger.get_for_user(household_id, User(pk=user_id), year, month)
     text = f'```{table.get_string()}```\n\n'
-    text += _('Subtotal: %s\n') % round(per_user, 2)
-    text += _('Discounts: %s\n') % round(user_discounts, 2)
-    text += _('Total: %s\n') % round(per_user - user_discounts, 2)
-    bot.send_message(chat_id, text, parse_mode='Markdown')
+    text += _('Subtotal: %s\n') % round(ledger.total_amount, 2)
+    text += _('Discounts: %s\n') % round(ledger.total_discount, 2)
+    text += _('Total: %s\n') % round(ledger.to_pay, 2)
+    return text
 
 
-def send_message(user: User, message: str):
+@database_sync_to_async
+def user_expenses_reply(chat_id: int, text: str) -> tuple[str, Optional[str]]:
     try:
-        telegram_user = TelegramUser.objects.get(user=user)
+        telegram_user = TelegramUser.objects.get(telegram_id=chat_id)
     except TelegramUser.DoesNotExist:
+        return _('User not registered'), None
+
+    msg = text.replace('/gastos ', '')
+
+    try:
+        month, year = (int(value) for value in msg.split(' '))
+        month_range(year, month)
+    except ValueError:
+        return _('Invalid date'), None
+
+    # Cached per user and month, the household's month generation changes
+    # whenever one of its expenses is saved or deleted
+    reply = get_or_set_for_month(
+        f'telegram:gastos:{telegram_user.user_id}',
+        telegram_user.household_id,
+        year,
+        month,
+        lambda: render_user_expenses(telegram_user.household_id, telegram_user.user_id, year, month)
+    )
+
+    if reply is None:
+        return _('No expenses registered'), None
+
+    return reply, 'Markdown'
+
+
+@bot.message_handler(commands=['registrar'])
+@instrumented
+@bounded
+async def register_user(message):
+    username = message.text
+    username = username.replace('/registrar ', '')
+
+    await bot.reply_to(message, await register_user_reply(message.chat.id, username))
+
+
+@bot.message_handler(commands=['gastos'])
+@instrumented
+@bounded
+async def user_expenses(message):
+    text, parse_mode = await user_expenses_reply(message.chat.id, message.text)
+
+    if parse_mode is None:
+        await bot.reply_to(message, text)
         return
 
-    bot.send_message(telegram_user.telegram_id, message)
+    await bot.send_message(message.chat.id, text, parse_mode=parse_mode)
 
 
-bot.infinity_polling()
\ No newline at end of file
+def send_message(user: User, message: str, key: Optional[str] = None):
+    """
+    Queues a message for the user, sent by the job worker. Messages with
+    the same ``key`` are only sent once.
+    """
+    enqueue('telegram.send_message', key=key, user_id=user.pk, message=message)
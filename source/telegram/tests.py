@@ -1,3 +1,198 @@
-from django.test import TestCase
+from unittest import mock
+import datetime
+import asyncio
+import decimal
+import json
+import time
+import io
 
-# Create your tests here.
+from django.core.management.base import CommandError
+from django.core.management import call_command
+from django.test import AsyncClient, SimpleTestCase, TransactionTestCase, override_settings
+from django.utils.translation import gettext as _
+from django.urls import reverse
+from asgiref.sync import async_to_sync
+
+from expenses.models import Category, Expense, ExpenseShare
+from expenses.tests import create_expenses, create_household
+from .models import TelegramUser
+from .telebot import user_expenses_reply
+
+SECRET = 'webhook-secret'
+
+
+class FakeBotAPI:
+    """
+    Stands in for the Telegram Bot API behind AsyncTeleBot: records every
+    call and answers them as if the message had been sent.
+    """
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, token, url, method='get', params=None, files=None, **kwargs):
+        self.calls.append((url, params))
+        return {
+            'message_id': len(self.calls),
+            'date': 0,
+            'chat': {'id': int(params['chat_id']), 'type': 'private'},
+            'text': params.get('text', ''),
+        }
+
+
+def build_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Ana'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': text.index(' ')}],
+        },
+    }
+
+
+@override_settings(TELEBOT_WEBHOOK_SECRET=SECRET)
+class WebhookTests(TransactionTestCase):
+    """
+    The handlers reach the database from worker threads, so the data has to
+    be committed for them to see it.
+    """
+    UPDATES = 1000
+    # Generous for CI, a local run handles the 1,000 updates in about 7s
+    BUDGET_SECONDS = 30
+    CHAT_ID = 1234
+
+    def setUp(self):
+        household, users = create_household()
+        category = Category.objects.create(household=household, name='Groceries')
+        create_expenses(household, users, category, 2023, 5, 6)
+        ExpenseShare.calc_monthly_expense(household.pk, 2023, 5)
+        TelegramUser.objects.create(household=household, user=users[0], telegram_id=self.CHAT_ID)
+
+        self.api = FakeBotAPI()
+        patcher = mock.patch('telebot.asyncio_helper._process_request', self.api)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # The handler semaphore is bound to the event loop of the first test
+        # that used it
+        patcher = mock.patch('telegram.telebot._handler_slots', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.client = AsyncClient()
+        self.url = reverse('telegram-webhook')
+
+    async def post(self, body, secret: str = SECRET):
+        return await self.client.post(
+            self.url,
+            body if isinstance(body, (str, bytes)) else json.dumps(body),
+            content_type='application/json',
+            headers={'X-Telegram-Bot-Api-Secret-Token': secret}
+        )
+
+    async def test_rejects_wrong_secret(self):
+        response = await self.post(build_update(1, self.CHAT_ID, '/gastos 5 2023'), secret='wrong')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.api.calls, [])
+
+    @override_settings(TELEBOT_WEBHOOK_SECRET='')
+    async def test_rejects_every_update_without_a_configured_secret(self):
+        for secret in ('', 'anything'):
+            with self.subTest(secret=secret):
+                response = await self.post(build_update(1, self.CHAT_ID, '/gastos 5 2023'), secret=secret)
+                self.assertEqual(response.status_code, 403)
+
+        self.assertEqual(self.api.calls, [])
+
+    async def test_rejects_malformed_updates(self):
+        for body in ('{', '[]', 'null', '{}', '{"update_id": 1, "message": 5}', b'\xff\xfe'):
+            with self.subTest(body=body):
+                response = await self.post(body)
+                self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(self.api.calls, [])
+
+    async def test_handles_burst_of_updates(self):
+        updates = [build_update(number, self.CHAT_ID, '/gastos 5 2023') for number in range(self.UPDATES)]
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(self.post(update) for update in updates))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual([response.status_code for response in responses], [200] * self.UPDATES)
+        self.assertEqual(len(self.api.calls), self.UPDATES)
+        self.assertTrue(all(url == 'sendMessage' and 'Total' in params['text'] for url, params in self.api.calls))
+        self.assertLess(elapsed, self.BUDGET_SECONDS)
+
+
+class GastosTests(TransactionTestCase):
+    """
+    The replies are built in worker threads, so the data has to be
+    committed for them to see it.
+    """
+    CHAT_ID = 1234
+
+    def setUp(self):
+        self.household, self.users = create_household()
+        self.groceries = Category.objects.create(household=self.household, name='Groceries')
+        self.rent = Category.objects.create(household=self.household, name='Rent')
+        # Bob owes 3.33 of the 10.00 and 4.00 of the 12.00, and is owed 7.33
+        # of the 11.00 he paid
+        create_expenses(self.household, self.users, self.groceries, 2023, 5, 3)
+        self.create_expense(self.rent, '90.00', datetime.date(2023, 5, 1))
+        self.create_expense(self.rent, '60.00', datetime.date(2023, 6, 1))
+        TelegramUser.objects.create(household=self.household, user=self.users[1], telegram_id=self.CHAT_ID)
+
+    def create_expense(self, category: Category, amount: str, date: datetime.date) -> Expense:
+        return Expense.objects.create(
+            household=self.household,
+            category=category,
+            paid_by=self.users[0],
+            created_by=self.users[0],
+            amount=decimal.Decimal(amount),
+            description='Expense',
+            date=date,
+        )
+
+    def get_reply(self, text: str = '/gastos 5 2023') -> tuple:
+        return async_to_sync(user_expenses_reply)(self.CHAT_ID, text)
+
+    def test_sums_the_month_by_category(self):
+        text, parse_mode = self.get_reply()
+
+        self.assertEqual(parse_mode, 'Markdown')
+        rows = [line.split('|')[1:3] for line in text.split('\n') if line.startswith('|')]
+        self.assertEqual([[cell.strip() for cell in row] for row in rows], [
+            ['Category', 'Amount'],
+            ['Groceries', '7.33'],
+            ['Rent', '30.00'],
+        ])
+        self.assertIn('Total: 33.67', text)
+
+    def test_rejects_invalid_dates(self):
+        for text in ('/gastos 13 2023', '/gastos may 2023', '/gastos 5'):
+            with self.subTest(text=text):
+                self.assertEqual(self.get_reply(text), (_('Invalid date'), None))
+
+    def test_reply_is_cached_until_the_month_changes(self):
+        text = self.get_reply()[0]
+
+        # Bypasses the invalidation, so only a cached reply stays the same
+        ExpenseShare.objects.filter(user=self.users[1], expense__category=self.rent).update(amount=decimal.Decimal('45.00'))
+        self.assertEqual(self.get_reply()[0], text)
+
+        self.create_expense(self.rent, '1.00', datetime.date(2023, 6, 2))
+        self.assertEqual(self.get_reply()[0], text)
+
+        self.create_expense(self.rent, '3.00', datetime.date(2023, 5, 2))
+        self.assertIn('| Rent      |  46.00 |', self.get_reply()[0])
+
+
+class RunBotTests(SimpleTestCase):
+    @override_settings(TELEBOT_API_TOKEN='123:token', TELEBOT_WEBHOOK_SECRET='')
+    def test_webhook_requires_secret(self):
+        with self.assertRaisesMessage(CommandError, 'TELEBOT_WEBHOOK_SECRET is required'):
+            call_command('runbot', webhook='https://example.com/telegram/webhook/', stdout=io.StringIO())
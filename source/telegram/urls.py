@@ -0,0 +1,8 @@
+from django.urls import path
+
+from . import views
+
+
+urlpatterns = [
+    path('webhook/', views.webhook, name='telegram-webhook'),
+]
@@ -1,3 +1,34 @@
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed
+from django.utils.crypto import constant_time_compare
+from django.conf import settings
 
-# Create your views here.
+
+async def webhook(request):
+    # Django 4.2's view decorators aren't async aware, so the method and
+    # CSRF exemption are handled here
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    secret = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+
+    # Without a configured secret anyone could post updates as the bot
+    if not settings.TELEBOT_WEBHOOK_SECRET or not constant_time_compare(secret, settings.TELEBOT_WEBHOOK_SECRET):
+        return HttpResponseForbidden()
+
+    # Imported here so serving the web app, or loading the URLs in every
+    # management command, doesn't import the Telegram client nor create the bot
+    from telebot import types
+
+    from .telebot import bot
+
+    try:
+        update = types.Update.de_json(request.body.decode('utf-8'))
+    except (ValueError, KeyError, TypeError):
+        # Not UTF-8, not JSON or not shaped like an update
+        return HttpResponseBadRequest()
+
+    await bot.process_new_updates([update])
+    return HttpResponse()
+
+
+webhook.csrf_exempt = True  # type: ignore